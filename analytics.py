@@ -0,0 +1,171 @@
+from typing import NamedTuple
+import numpy as np
+from db_storage.cache import cached_query
+from db_storage.storage import get_storage
+
+PERCENTILES = (25, 50, 75, 90)
+
+
+class RatingCube(NamedTuple):
+    """Dense reviewer x ratee x metric scores, both user axes in the order of `user_ids`"""
+    user_ids: np.ndarray        # (users,) user ids, sorted
+    metric_names: list[str]     # in the order of the metric axis
+    scores: np.ndarray          # (users, users, metrics) float32, 0 where unscored
+    mask: np.ndarray            # (users, users, metrics) bool, True where scored
+
+
+class ReviewStats(NamedTuple):
+    """Statistics of every ratee (rows, in the order of `user_ids`) on every metric (columns). NaN where undefined"""
+    user_ids: np.ndarray
+    metric_names: list[str]
+    peer_count: np.ndarray      # (users, metrics) peer scores given
+    peer_mean: np.ndarray       # (users, metrics) mean of the raw peer scores
+    calibrated: np.ndarray      # (users, metrics) mean of the reviewer-normalized peer scores, on the raw scale
+    percentile: np.ndarray      # (users, metrics) percentile rank of `calibrated` among the ratees, 0-100
+    self_gap: np.ndarray        # (users, metrics) self score minus `peer_mean`
+    agreement: np.ndarray       # (metrics,) ICC(1) of the peer scores: 1 for reviewers agreeing, <=0 for noise
+    distribution: dict[int, np.ndarray]  # percentile -> (metrics,) of `calibrated` across the ratees
+
+
+def build_rating_cube(rows, user_ids, metric_ids, metric_names=None) -> RatingCube:
+    """
+    Scatters (user_id, ratee_id, metric_id, score) rows (an array, or chunks of rows) into a `RatingCube`. Ids that
+    aren't among `user_ids` / `metric_ids` (e.g. removed in the meantime) are dropped.
+    """
+    user_ids = np.asarray(sorted(user_ids), dtype=np.int64)
+    metric_order = np.argsort(metric_ids)
+    metric_ids = np.asarray(metric_ids, dtype=np.int64)[metric_order]
+    metric_names = [metric_names[idx] for idx in metric_order] if metric_names is not None else list(metric_ids)
+    scores = np.zeros((len(user_ids), len(user_ids), len(metric_ids)), dtype=np.float32)
+    mask = np.zeros(scores.shape, dtype=bool)
+
+    chunks = [rows] if isinstance(rows, np.ndarray) else rows
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=np.float64).reshape(-1, 4)
+        if not len(chunk) or not len(user_ids) or not len(metric_ids):
+            continue
+        ids = chunk[:, :3].astype(np.int64)
+        reviewer = np.searchsorted(user_ids, ids[:, 0]).clip(max=len(user_ids) - 1)
+        ratee = np.searchsorted(user_ids, ids[:, 1]).clip(max=len(user_ids) - 1)
+        metric = np.searchsorted(metric_ids, ids[:, 2]).clip(max=len(metric_ids) - 1)
+        known = (user_ids[reviewer] == ids[:, 0]) & (user_ids[ratee] == ids[:, 1]) & (metric_ids[metric] == ids[:, 2])
+        reviewer, ratee, metric = reviewer[known], ratee[known], metric[known]
+        scores[reviewer, ratee, metric] = chunk[known, 3]
+        mask[reviewer, ratee, metric] = True
+    return RatingCube(user_ids, metric_names, scores, mask)
+
+
+def load_rating_cube() -> RatingCube:
+    """The scored ratings of the store as a `RatingCube`, read in one pass"""
+    storage = get_storage()
+    metric_map = storage.get_metric_to_id_map()
+    return build_rating_cube(storage.get_scored_rating_chunks(), storage.get_user_ids(), list(metric_map.values()),
+                             list(metric_map))
+
+
+def _mean(total, count):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def calibrate(cube: RatingCube, peer_mask) -> np.ndarray:
+    """
+    Z-scores of every peer score against the reviewer's own scores (over all their ratees and metrics), so that a
+    generous and a harsh reviewer rating alike relative to their habits count alike. Reviewers with fewer than two
+    scores, or giving the same score throughout, get 0 for all of theirs. Returns (users, users, metrics), 0 where
+    unscored.
+    """
+    # float32 throughout, with float64 sums, as these are the largest arrays of the whole computation
+    count = peer_mask.sum(axis=(1, 2))
+    mean = (cube.scores * peer_mask).sum(axis=(1, 2), dtype=np.float64) / np.maximum(count, 1)
+    deviation = cube.scores - mean.astype(np.float32)[:, None, None]
+    deviation *= peer_mask
+    std = np.sqrt(np.square(deviation).sum(axis=(1, 2), dtype=np.float64) / np.maximum(count, 1))
+    usable = (count > 1) & (std > 0)
+    scale = np.where(usable, 1 / np.where(usable, std, 1), 0).astype(np.float32)
+    deviation *= scale[:, None, None]
+    return deviation
+
+
+def percentile_ranks(values) -> np.ndarray:
+    """Percentile rank (0-100) of each row within its column, ties sharing their mid rank, NaN left out and kept as NaN"""
+    valid = ~np.isnan(values)
+    valid_count = valid.sum(axis=0)
+    # sort puts the NaN last, so the valid values of a column are its first `valid_count` ones
+    sorted_values = np.sort(values, axis=0)
+    ranks = np.empty(values.shape, dtype=np.float64)
+    for col in range(values.shape[1]):
+        column = sorted_values[:valid_count[col], col]
+        # Equal values span [left, right) of the sorted column, and each of them gets the middle of it
+        left = np.searchsorted(column, values[:, col], "left")
+        right = np.searchsorted(column, values[:, col], "right")
+        ranks[:, col] = (left + right - 1) / 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pct = np.where(valid_count > 1, ranks * 100 / np.maximum(valid_count - 1, 1), 50.0)
+    return np.where(valid, pct, np.nan)
+
+
+def icc1(scores, mask) -> np.ndarray:
+    """
+    One-way random effects ICC(1) per metric, of the ratees (groups) by their reviewers' scores, for unequal numbers
+    of reviewers per ratee. Takes (reviewers, ratees, metrics) scores and mask, and returns (metrics,)
+    """
+    scores = scores * mask
+    k = mask.sum(axis=0)                        # (ratees, metrics) scores per ratee
+    total = scores.sum(axis=0, dtype=np.float64)
+    total_sq = np.square(scores).sum(axis=0, dtype=np.float64)
+    rated = k > 0
+    groups = rated.sum(axis=0)                  # (metrics,) ratees with any score
+    n = k.sum(axis=0)
+    group_mean = total / np.maximum(k, 1)
+    grand_mean = total.sum(axis=0) / np.maximum(n, 1)
+    ss_between = (k * (group_mean - grand_mean) ** 2).sum(axis=0)
+    ss_within = (total_sq - k * group_mean ** 2).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ms_between = ss_between / (groups - 1)
+        ms_within = ss_within / (n - groups)
+        n0 = (n - (k ** 2).sum(axis=0) / n) / (groups - 1)
+        icc = (ms_between - ms_within) / (ms_between + (n0 - 1) * ms_within)
+    return np.where((groups > 1) & (n > groups), icc, np.nan)
+
+
+def compute_review_stats(cube: RatingCube) -> ReviewStats:
+    """All of `ReviewStats` off the cube, as whole-array operations"""
+    users = len(cube.user_ids)
+    is_self = np.eye(users, dtype=bool)[:, :, None]
+    peer_mask = cube.mask & ~is_self
+
+    peer_count = peer_mask.sum(axis=0)
+    peer_mean = _mean((cube.scores * peer_mask).sum(axis=0, dtype=np.float64), peer_count)
+
+    # The calibrated means are put back on the scale of the raw scores, by the overall mean and spread of them
+    peer_scores = cube.scores[peer_mask].astype(np.float64)
+    overall_mean = peer_scores.mean() if peer_scores.size else np.nan
+    overall_std = peer_scores.std() if peer_scores.size else np.nan
+    z_mean = _mean(calibrate(cube, peer_mask).sum(axis=0, dtype=np.float64), peer_count)
+    calibrated = overall_mean + z_mean * overall_std
+
+    diagonal = np.arange(users)
+    self_scores = np.where(cube.mask[diagonal, diagonal], cube.scores[diagonal, diagonal], np.nan)
+    rated_metrics = ~np.isnan(calibrated).all(axis=0)
+    distribution = {q: np.full(len(cube.metric_names), np.nan) for q in PERCENTILES}
+    if rated_metrics.any():
+        for q, values in zip(PERCENTILES, np.nanpercentile(calibrated[:, rated_metrics], PERCENTILES, axis=0)):
+            distribution[q][rated_metrics] = values
+    return ReviewStats(
+        user_ids=cube.user_ids,
+        metric_names=cube.metric_names,
+        peer_count=peer_count,
+        peer_mean=peer_mean,
+        calibrated=calibrated,
+        percentile=percentile_ranks(calibrated),
+        self_gap=self_scores - peer_mean,
+        agreement=icc1(cube.scores, peer_mask),
+        distribution=distribution,
+    )
+
+
+# Only the statistics get cached, as the cube itself takes users x users x metrics x 5 bytes
+@cached_query("ratings", "users", "metrics", storage_getter=get_storage)
+def get_review_stats() -> ReviewStats:
+    return compute_review_stats(load_rating_cube())
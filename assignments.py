@@ -0,0 +1,84 @@
+import heapq
+import random
+from collections import defaultdict
+from typing import Iterable, Mapping, NamedTuple
+
+
+class AssignmentPlan(NamedTuple):
+    # (reviewer_id, ratee_id) to be added on top of the existing assignments
+    pairs: list[tuple[int, int]]
+    # Ratee id -> number of reviewers short of the requested count, when the exclusions leave too few to pick from
+    shortfall: dict[int, int]
+
+
+def generate_assignments(user_ids: Iterable[int], reviewers_per_ratee: int | None,
+                         selective: Mapping[int, Iterable[int]] = None, exclusions: Iterable[tuple[int, int]] = (),
+                         existing: Iterable[tuple[int, int]] = (), seed=None) -> AssignmentPlan:
+    """
+    Picks the reviewers of each ratee, topping up the `existing` (reviewer_id, ratee_id) assignments.
+
+    The selective reviewers (reviewer id -> ratee ids) review exactly the ones assigned to them, exclusions or not, and
+    aren't reviewed by anyone. Everyone else reviews themselves, and gets `reviewers_per_ratee` peer reviewers out of the others, never
+    a reviewer that `exclusions` rules out for them. The reviewers get picked off a min-heap of their workload (peers
+    to review), with random tie-breaks, so that the load stays within one of even across the reviewers. With
+    `reviewers_per_ratee` as None, everyone reviews everyone, as with small teams.
+    """
+    rng = random.Random(seed)
+    selective = selective or {}
+    exclusions = set(exclusions)
+    pool = [user_id for user_id in user_ids if user_id not in selective]
+    pool_ids = set(pool)
+
+    assigned = set(existing)
+    pairs = []
+
+    def assign(reviewer_id, ratee_id):
+        if (reviewer_id, ratee_id) not in assigned:
+            assigned.add((reviewer_id, ratee_id))
+            pairs.append((reviewer_id, ratee_id))
+
+    for reviewer_id, ratee_ids in selective.items():
+        for ratee_id in ratee_ids:
+            assign(reviewer_id, ratee_id)
+    for user_id in pool:
+        assign(user_id, user_id)
+
+    if reviewers_per_ratee is None:
+        for reviewer_id in pool:
+            for ratee_id in pool:
+                if reviewer_id != ratee_id and (reviewer_id, ratee_id) not in exclusions:
+                    assign(reviewer_id, ratee_id)
+        return AssignmentPlan(pairs, {})
+
+    # Peer reviewers of each ratee, and peers to review of each reviewer, so far
+    reviewers_of = defaultdict(set)
+    load = dict.fromkeys(pool, 0)
+    for reviewer_id, ratee_id in assigned:
+        if reviewer_id != ratee_id and reviewer_id in pool_ids and ratee_id in pool_ids:
+            reviewers_of[ratee_id].add(reviewer_id)
+            load[reviewer_id] += 1
+
+    heap = [(count, rng.random(), reviewer_id) for reviewer_id, count in load.items()]
+    heapq.heapify(heap)
+    ratees = pool.copy()
+    rng.shuffle(ratees)
+
+    shortfall = {}
+    for ratee_id in ratees:
+        ratee_reviewers = reviewers_of[ratee_id]
+        needed = reviewers_per_ratee - len(ratee_reviewers)
+        # Popped ones go back once the ratee is done, so that none of them gets picked twice for it
+        popped = []
+        while needed > 0 and heap:
+            count, tie_break, reviewer_id = heapq.heappop(heap)
+            if reviewer_id != ratee_id and reviewer_id not in ratee_reviewers and (reviewer_id, ratee_id) not in exclusions:
+                assign(reviewer_id, ratee_id)
+                ratee_reviewers.add(reviewer_id)
+                count += 1
+                needed -= 1
+            popped.append((count, tie_break, reviewer_id))
+        for entry in popped:
+            heapq.heappush(heap, entry)
+        if needed > 0:
+            shortfall[ratee_id] = needed
+    return AssignmentPlan(pairs, shortfall)
@@ -0,0 +1,92 @@
+"""Time of the `analytics` statistics on a dense reviewer x ratee x metric cube, and how well calibration undoes bias.
+
+The scores are generated from a true quality per ratee x metric, plus a leniency per reviewer (some generous, some
+harsh) and noise. Calibration works when its scores correlate with the true quality better than the raw averages do.
+
+USAGE: python -m benchmarks.bench_analytics [--users 1000] [--metrics 10] [--density 0.1] [--repeat 3]
+"""
+import argparse
+import statistics
+import numpy as np
+from analytics import build_rating_cube, compute_review_stats, load_rating_cube, percentile_ranks
+from benchmarks.common import temporary_db, generate_users, generate_metrics, timer
+from db_storage import db_queries
+
+
+def generate_rating_rows(users, metrics, density, seed=0):
+    """(user_id, ratee_id, metric_id, score) rows with ids from 1, along with the true (users, metrics) quality"""
+    rng = np.random.default_rng(seed)
+    quality = rng.normal(6.0, 1.2, size=(users, metrics))
+    leniency = rng.normal(0.0, 1.5, size=users)
+    # Every ratee rates themselves, and is rated by a `density` share of the others
+    pairs = rng.random((users, users)) < density
+    np.fill_diagonal(pairs, True)
+    reviewer, ratee = np.nonzero(pairs)
+    reviewer = np.repeat(reviewer, metrics)
+    ratee = np.repeat(ratee, metrics)
+    metric = np.tile(np.arange(metrics), len(reviewer) // metrics)
+    scores = quality[ratee, metric] + leniency[reviewer] + rng.normal(0.0, 0.8, size=len(reviewer))
+    rows = np.column_stack([reviewer + 1, ratee + 1, metric + 1, np.clip(np.round(scores, 1), 1, 10)])
+    return rows, quality
+
+
+def correlation(values, truth):
+    valid = ~np.isnan(values)
+    return float(np.corrcoef(values[valid], truth[valid])[0, 1])
+
+
+def check_percentile_ties():
+    """Equal values share their mid rank, whatever the order of the rows, and NaN stays out of the ranking"""
+    values = np.array([[6.0, 1.0], [2.0, np.nan], [6.0, 1.0], [9.0, 1.0], [np.nan, 1.0]])
+    expected = np.array([[50.0, 50.0], [0.0, np.nan], [50.0, 50.0], [100.0, 50.0], [np.nan, 50.0]])
+    assert np.allclose(percentile_ranks(values), expected, equal_nan=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--metrics", type=int, default=10)
+    parser.add_argument("--density", type=float, default=0.1, help="Share of the peers rating each ratee")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db-users", type=int, default=100, help="Size of the DB round trip check (0 to skip)")
+    args = parser.parse_args()
+
+    check_percentile_ties()
+    rows, quality = generate_rating_rows(args.users, args.metrics, args.density)
+    user_ids, metric_ids = list(range(1, args.users + 1)), list(range(1, args.metrics + 1))
+    build_times, compute_times = [], []
+    for _ in range(args.repeat):
+        results = {}
+        with timer(results, "build"):
+            cube = build_rating_cube(rows, user_ids, metric_ids)
+        with timer(results, "compute"):
+            stats = compute_review_stats(cube)
+        build_times.append(results["build"])
+        compute_times.append(results["compute"])
+
+    print(f"{args.users} x {args.users} x {args.metrics} cube, {len(rows):,} ratings "
+          f"({cube.scores.nbytes / 2 ** 20:.0f}MB scores, {cube.mask.nbytes / 2 ** 20:.0f}MB mask)")
+    print(f"    build from rows  {statistics.median(build_times) * 1000:>9.1f}ms")
+    print(f"    statistics       {statistics.median(compute_times) * 1000:>9.1f}ms")
+    print(f"    correlation with the true quality: raw {correlation(stats.peer_mean, quality):.3f}, "
+          f"calibrated {correlation(stats.calibrated, quality):.3f}")
+    print(f"    agreement (ICC1) per metric: {' '.join(f'{value:.2f}' for value in stats.agreement)}")
+    print(f"    mean self - peer gap: {np.nanmean(stats.self_gap):+.2f}")
+
+    if args.db_users:
+        # The same statistics off the DB, through `load_rating_cube`
+        db_rows, _ = generate_rating_rows(args.db_users, args.metrics, min(1.0, args.density * 5), seed=1)
+        with temporary_db():
+            db_queries.insert_all_data(user_data=generate_users(args.db_users),
+                                       metric_data=generate_metrics(args.metrics),
+                                       rating_data=[(int(r), int(e), int(m), float(s)) for r, e, m, s in db_rows])
+            results = {}
+            with timer(results, "load"):
+                db_cube = load_rating_cube()
+        expected = build_rating_cube(db_rows, range(1, args.db_users + 1), range(1, args.metrics + 1))
+        assert np.array_equal(db_cube.mask, expected.mask) and np.allclose(db_cube.scores, expected.scores)
+        print(f"    DB round trip of {len(db_rows):,} ratings ({args.db_users} users): {results['load'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Time and workload spread of `generate_assignments` for large rosters, with same-manager exclusions.
+
+USAGE: python -m benchmarks.bench_assignments [--users 1000 10000] [--reviewers-per-ratee 5] [--team-size 10]
+"""
+import argparse
+from assignments import generate_assignments
+from benchmarks.common import timer
+
+
+def same_team_exclusions(user_ids, team_size):
+    # Nobody reviews the ones sharing their manager, i.e. the consecutive `team_size` ids
+    return {(reviewer_id, ratee_id) for start in range(0, len(user_ids), team_size)
+            for reviewer_id in user_ids[start:start + team_size] for ratee_id in user_ids[start:start + team_size]
+            if reviewer_id != ratee_id}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--reviewers-per-ratee", type=int, default=5)
+    parser.add_argument("--team-size", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'exclusions':>11} {'pairs':>9} {'time':>9} {'load min/max':>13} {'short':>6}")
+    for count in args.users:
+        user_ids = list(range(1, count + 1))
+        exclusions = same_team_exclusions(user_ids, args.team_size)
+        results = {}
+        with timer(results, "generate"):
+            plan = generate_assignments(user_ids, args.reviewers_per_ratee, exclusions=exclusions, seed=0)
+
+        loads = dict.fromkeys(user_ids, 0)
+        for reviewer_id, ratee_id in plan.pairs:
+            if reviewer_id != ratee_id:
+                loads[reviewer_id] += 1
+        print(f"{count:>8} {len(exclusions):>11} {len(plan.pairs):>9} {results['generate'] * 1000:>7.0f}ms "
+              f"{min(loads.values()):>6}/{max(loads.values()):<6} {len(plan.shortfall):>6}")
+
+
+if __name__ == "__main__":
+    main()
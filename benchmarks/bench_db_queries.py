@@ -0,0 +1,184 @@
+"""Timings of the storage functions against generated organizations, and how they scale with them.
+
+Every size (users) gets a few sprints, i.e. sprint DBs of their own, each one further along: with 3 sprints, a third,
+two thirds and all of the assigned reviews are in. Each function gets timed a few times per sprint, the cached ones
+both cold (the cache invalidated first) and warm. The scaling exponent of a function is the slope of log(time) over
+log(users) between the two largest sizes: ~0 for a lookup, ~1 for a scan, and ~2 for a quadratic access path, which
+fails the run when above `--max-exponent`. The functions are those of `db_storage.storage`, against a SQLite file (the
+`db_queries` functions) or, with `--storage memory`, the in-memory store.
+
+USAGE: python -m benchmarks.bench_db_queries [--users 10 1000 10000] [--sprints 3] [--metrics 10]
+                                             [--reviewers-per-ratee 5] [--repeat 5] [--storage sqlite]
+                                             [--output <temp dir>/bench_db_queries.json]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from db_storage.cache import invalidate
+from registry import load_registry
+from bootstrap import assign_reviews
+from benchmarks.common import temporary_storage, generate_users, generate_metrics
+
+# Timings below this (seconds) are left out of the scaling exponents, as they are mostly noise and fixed overhead
+MIN_SCALING_SECONDS = 0.001
+
+
+def measure(func, repeat, before=None) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def timed_once(func) -> list[float]:
+    # For the writes that can only be done once per sprint
+    return measure(func, 1)
+
+
+def generate_ratings(pairs, metric_ids, completion, rng) -> list[tuple]:
+    """Ratings on every metric of a `completion` share of the (reviewer_id, ratee_id) assignments"""
+    pairs = sorted(pairs)
+    done = rng.sample(pairs, round(len(pairs) * completion))
+    return [(reviewer_id, ratee_id, metric_id, float(rng.randint(1, 10)))
+            for reviewer_id, ratee_id in done for metric_id in metric_ids]
+
+
+def bench_sprint(users, metrics, completion, args, seed) -> dict[str, list[float]]:
+    """Timings by benchmark name, on one sprint's store"""
+    rng = random.Random(seed)
+    timings = {}
+    with temporary_storage(args.storage) as storage:
+        timings["insert_all_data (roster)"] = timed_once(
+            lambda: storage.insert_all_data(user_data=users, metric_data=metrics, upsert=True))
+        timings["get_assignment_inputs"] = measure(storage.get_assignment_inputs, args.repeat)
+        # `assign_reviews` is `get_assignment_inputs`, the assignment itself, and `save_assignments`
+        plan = assign_reviews(args.reviewers_per_ratee, seed=seed)
+        timings["save_assignments (replace)"] = timed_once(lambda: storage.save_assignments(plan.pairs, replace=True))
+
+        pairs = storage.get_assignment_inputs().existing
+        metric_ids = list(storage.get_metric_to_id_map().values())
+        ratings = generate_ratings(pairs, metric_ids, completion, rng)
+        timings["insert_all_data (ratings)"] = timed_once(lambda: storage.insert_all_data(rating_data=ratings))
+        # The same rows again, i.e. every one of them a conflict, as with resubmits
+        timings["insert_all_data (ratings, upsert)"] = timed_once(
+            lambda: storage.insert_all_data(rating_data=ratings, upsert=True))
+
+        registry = load_registry()
+        user_ids = sorted(registry.id_user_mapping)
+        reviewer_id = user_ids[len(user_ids) // 2]
+        # Logged in by now: the same share of the users as the reviews in
+        logged_in = user_ids[:max(1, round(len(user_ids) * completion))]
+        timings["register_browser"] = timed_once(
+            lambda: [storage.register_browser(user_id, f"browser-{user_id}") for user_id in logged_in])
+
+        def cold(*tables):
+            return lambda: invalidate(*tables)
+
+        timings["get_registry_rows"] = measure(storage.get_registry_rows, args.repeat)
+        timings["get_user_to_id_map"] = measure(storage.get_user_to_id_map, args.repeat)
+        timings["get_metric_to_id_map"] = measure(storage.get_metric_to_id_map, args.repeat)
+        timings["get_metric_id"] = measure(lambda: storage.get_metric_id(metrics[-1][0]), args.repeat)
+        timings["get_reviewer_by_browser"] = measure(
+            lambda: storage.get_reviewer_by_browser(f"browser-{logged_in[-1]}"), args.repeat)
+        timings["get_browser_by_user"] = measure(lambda: storage.get_browser_by_user(logged_in[-1]), args.repeat)
+        timings["get_initialized_user_requests"] = measure(storage.get_initialized_user_requests, args.repeat)
+        timings["ratings_exist"] = measure(storage.ratings_exist, args.repeat)
+        timings["get_schema_version"] = measure(storage.get_schema_version, args.repeat)
+        timings["get_data_versions"] = measure(storage.get_data_versions, args.repeat)
+
+        timings["get_reviewers_finalised_cols (cold)"] = measure(
+            lambda: storage.get_reviewers_finalised_cols(reviewer_id), args.repeat, cold("ratings"))
+        timings["get_reviewers_finalised_cols (warm)"] = measure(
+            lambda: storage.get_reviewers_finalised_cols(reviewer_id), args.repeat)
+        timings["get_review_progress (cold)"] = measure(storage.get_review_progress, args.repeat, cold("ratings"))
+        timings["get_counts_of_reviewed (cold)"] = measure(
+            lambda: storage.get_counts_of_reviewed(registry), args.repeat, cold("ratings"))
+        timings["get_counts_of_reviewed (warm)"] = measure(
+            lambda: storage.get_counts_of_reviewed(registry), args.repeat)
+        timings["get_average_scores (one, cold)"] = measure(
+            lambda: storage.get_average_scores([reviewer_id]), args.repeat, cold("ratings"))
+        timings["get_average_scores (all, cold)"] = measure(
+            lambda: storage.get_average_scores(user_ids), args.repeat, cold("ratings"))
+        timings["get_average_scores (all, warm)"] = measure(
+            lambda: storage.get_average_scores(user_ids), args.repeat)
+
+        timings["rebuild_rating_aggregates"] = timed_once(storage.rebuild_rating_aggregates)
+        timings["migrate_schema (up to date)"] = measure(storage.migrate_schema, args.repeat)
+        timings["delete_all_data"] = timed_once(storage.delete_all_data)
+    return timings
+
+
+def scaling_exponents(results) -> dict[str, dict[str, float]]:
+    """{benchmark: {sprint: exponent}} between the two largest sizes, of the medians above `MIN_SCALING_SECONDS`"""
+    medians = {}
+    for row in results:
+        medians.setdefault((row["benchmark"], row["sprint"]), {})[row["users"]] = row["median_ms"] / 1000
+    exponents = {}
+    for (benchmark, sprint), by_size in medians.items():
+        sizes = sorted(by_size)
+        if len(sizes) < 2:
+            continue
+        small, large = sizes[-2], sizes[-1]
+        if by_size[large] < MIN_SCALING_SECONDS or by_size[small] <= 0:
+            continue
+        exponent = math.log(by_size[large] / by_size[small]) / math.log(large / small)
+        exponents.setdefault(benchmark, {})[str(sprint)] = round(exponent, 2)
+    return exponents
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 1_000, 10_000])
+    parser.add_argument("--sprints", type=int, default=3)
+    parser.add_argument("--metrics", type=int, default=10)
+    parser.add_argument("--reviewers-per-ratee", type=int, default=5, help="0 for everyone reviewing everyone")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-exponent", type=float, default=1.7,
+                        help="Scaling exponent beyond which a function counts as a regression")
+    parser.add_argument("--storage", choices=["sqlite", "memory"], default="sqlite")
+    parser.add_argument("--output", default=os.path.join(tempfile.gettempdir(), "bench_db_queries.json"))
+    args = parser.parse_args()
+    args.reviewers_per_ratee = args.reviewers_per_ratee or None
+
+    metrics = generate_metrics(args.metrics)
+    results = []
+    for count in sorted(args.users):
+        users = generate_users(count)
+        for sprint in range(1, args.sprints + 1):
+            completion = sprint / args.sprints
+            timings = bench_sprint(users, metrics, completion, args, seed=sprint)
+            print(f"{count} users, sprint {sprint} ({completion:.0%} reviewed)")
+            for benchmark, seconds in timings.items():
+                median = statistics.median(seconds)
+                results.append({"benchmark": benchmark, "users": count, "sprint": sprint, "completion": completion,
+                                "runs": len(seconds), "median_ms": median * 1000, "min_ms": min(seconds) * 1000})
+                print(f"    {benchmark:<42} {median * 1000:>10.3f}ms")
+
+    exponents = scaling_exponents(results)
+    superlinear = {benchmark: by_sprint for benchmark, by_sprint in exponents.items()
+                   if max(by_sprint.values()) > args.max_exponent}
+    with open(args.output, "w") as file:
+        json.dump({"params": vars(args), "results": results, "scaling_exponents": exponents,
+                   "superlinear": superlinear}, file, indent=2)
+
+    print(f"Scaling exponents ({sorted(args.users)[-2:]} users), by sprint:")
+    for benchmark, by_sprint in sorted(exponents.items()):
+        flag = "  <-- above --max-exponent" if benchmark in superlinear else ""
+        print(f"    {benchmark:<42} {' '.join(f'{value:>5.2f}' for value in by_sprint.values())}{flag}")
+    print(f"Results written to {args.output}")
+    if superlinear:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
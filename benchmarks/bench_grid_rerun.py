@@ -0,0 +1,60 @@
+"""Rerun latency of the review grid against team size, for the whole page and for one ratee column (fragment).
+
+USAGE: python -m benchmarks.bench_grid_rerun [--team-sizes 8 20 40] [--reruns 5]
+"""
+import argparse
+import statistics
+import time
+from streamlit.testing.v1 import AppTest
+from benchmarks.common import temporary_db, generate_users, generate_metrics, seed_app_db, HeadlessBrowsers
+
+
+def column_script(reviewer, ratee):
+    # Renders a single ratee column, i.e. what a fragment rerun does when typing into that column
+    import streamlit as st
+    from ui import create_ratee_column
+    st.const_vars["input_save"].setdefault(reviewer, {"finalised": []})
+    create_ratee_column(reviewer, ratee, False)
+
+
+def median_rerun(app_test, reruns, edit_key):
+    timings = []
+    for idx in range(reruns):
+        app_test.text_input(key=edit_key).input(str(1 + idx % 9))
+        start = time.perf_counter()
+        app_test.run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--team-sizes", type=int, nargs="+", default=[8, 20, 40])
+    parser.add_argument("--metrics", type=int, default=10)
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'team':>6} {'widgets':>8} {'page rerun':>12} {'column rerun':>13}")
+    for team_size in args.team_sizes:
+        users = generate_users(team_size)
+        reviewer_name, reviewer = users[0]
+        ratee = users[1][1]
+        edit_key = f"{ratee}_mab"  # Second metric's shorthand, as named by `generate_metrics`
+        with temporary_db(), HeadlessBrowsers() as browsers:
+            seed_app_db(users, generate_metrics(args.metrics))
+            page = browsers.use(AppTest.from_file("metric_review.py", default_timeout=120), "bench-browser")
+            page.run()
+            page.selectbox[0].select(reviewer_name).run()
+            page.button(key="confirm").click().run()
+            page_latency = median_rerun(page, args.reruns, edit_key)
+
+            column = browsers.use(AppTest.from_function(column_script, args=(reviewer_name, ratee), default_timeout=120),
+                                  "bench-browser")
+            column.run()
+            column_latency = median_rerun(column, args.reruns, edit_key)
+
+        print(f"{team_size:>6} {team_size * args.metrics:>8} {page_latency * 1000:>10.1f}ms {column_latency * 1000:>11.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Rows/sec of `insert_all_data` when seeding a large roster, against the former row-by-row inserts.
+
+USAGE: python -m benchmarks.bench_insert_all_data [--users 10000] [--metrics 10]
+"""
+import argparse
+from db_storage import db_queries
+from db_storage.sqlite3_db_helper import SQLiteSession as SQLite3
+from benchmarks.common import temporary_db, generate_users, generate_metrics, timer
+
+
+def seed_row_by_row(users, metrics, ratings):
+    with SQLite3(db_queries.DB_PATH) as (_, cursor):
+        for row in users:
+            cursor.execute(db_queries.get_insert_sql(db_queries.INSERT_USER_SQL), row)
+        for row in metrics:
+            cursor.execute(db_queries.get_insert_sql(db_queries.INSERT_METRIC_SQL), row)
+        for row in ratings:
+            cursor.execute(db_queries.get_insert_sql(db_queries.INSERT_RATING_SQL), row)
+
+
+def seed_bulk(users, metrics, ratings, upsert=False):
+    db_queries.insert_all_data(user_data=users, metric_data=metrics, rating_data=ratings, upsert=upsert)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--metrics", type=int, default=10)
+    args = parser.parse_args()
+
+    users = generate_users(args.users)
+    metrics = generate_metrics(args.metrics)
+    # Every user rates themselves on every metric, i.e. users x metrics rating rows
+    ratings = [(user_id, user_id, metric_id, float(1 + (user_id + metric_id) % 10))
+               for user_id in range(1, args.users + 1) for metric_id in range(1, args.metrics + 1)]
+    total_rows = len(users) + len(metrics) + len(ratings)
+
+    results = {}
+    with temporary_db():
+        with timer(results, "row-by-row"):
+            seed_row_by_row(users, metrics, ratings)
+    with temporary_db():
+        with timer(results, "executemany"):
+            seed_bulk(users, metrics, ratings)
+        # The same rows again hit every unique key, which is the resubmit path
+        with timer(results, "executemany (upsert, all conflicts)"):
+            seed_bulk(users, metrics, ratings, upsert=True)
+
+    print(f"Seeding {args.users} users x {args.metrics} metrics ({total_rows} rows)")
+    for name, elapsed in results.items():
+        print(f"    {name:<38} {elapsed:8.3f}s  {total_rows / elapsed:12,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from types import SimpleNamespace
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+import metric_utils
+from db_storage import db_queries
+from db_storage.sqlite3_db_helper import close_pool
+from db_storage.cache import close_probe
+from db_storage.drafts import shutdown_draft_writer
+from db_storage.storage import StorageBackend, create_storage, get_storage, set_storage
+from registry import load_registry
+from bootstrap import assign_reviews
+from sessions import get_session_registry
+
+
+@contextmanager
+def temporary_db():
+    """Point `db_queries` at a fresh database file with the app schema, and remove it afterwards."""
+    saved_path = db_queries.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_queries.DB_PATH = os.path.join(tmp_dir, "benchmark.db")
+        try:
+            db_queries.initialize_tables_for_db()
+            yield db_queries.DB_PATH
+        finally:
+            # The edits staged by the grids get written while the DB is still there
+            shutdown_draft_writer()
+            close_pool(db_queries.DB_PATH)
+            close_probe(db_queries.DB_PATH)
+            db_queries.DB_PATH = saved_path
+
+
+@contextmanager
+def temporary_storage(backend="sqlite") -> StorageBackend:
+    """Swaps the store for a fresh one of `backend`: "sqlite" for a `temporary_db`, or "memory" for no disk at all"""
+    with temporary_db() if backend == "sqlite" else nullcontext():
+        storage = create_storage(backend)
+        if not storage.exists():
+            storage.initialize()
+        previous = set_storage(storage)
+        try:
+            yield storage
+        finally:
+            set_storage(previous)
+
+
+def generate_users(count):
+    return [(f"User {idx:05d}", f"user{idx:05d}") for idx in range(count)]
+
+
+def generate_metrics(count):
+    # The words start with base-26 letters of the index, so that the initials (the metric shorthand) stay unique
+    return [(f"Metric {chr(97 + idx // 26)}x {chr(97 + idx % 26)}x", "") for idx in range(count)]
+
+
+@contextmanager
+def timer(results, key):
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
+
+
+def make_request(browser_id, refresh_id) -> SimpleNamespace:
+    """Stand-in for the tornado request, carrying just the cookie and header that `metric_utils` reads"""
+    return SimpleNamespace(_cookies={"ajs_anonymous_id": SimpleNamespace(_value=browser_id)},
+                           headers=SimpleNamespace(_dict={"Sec-Websocket-Key": refresh_id}))
+
+
+class HeadlessBrowsers:
+    """
+    Lets `AppTest` runs act as distinct browsers: `metric_utils.get_request_obj` is swapped for one that builds the
+    request of the browser set on the session (`use`), and the `streamlit run` check of `metric_review.py` is satisfied.
+    """
+
+    SESSION_KEY = "headless_browser"
+
+    def use(self, app_test, browser_id, refresh_id=None) -> AppTest:
+        app_test.session_state[self.SESSION_KEY] = (browser_id, refresh_id or f"refresh-{browser_id}")
+        return app_test
+
+    def _get_request_obj(self):
+        return make_request(*st.session_state[self.SESSION_KEY])
+
+    def __enter__(self):
+        self._saved = metric_utils.get_request_obj, sys.orig_argv
+        metric_utils.get_request_obj = self._get_request_obj
+        sys.orig_argv = ["streamlit", "run", "metric_review.py"]
+        return self
+
+    def __exit__(self, *exc_info):
+        metric_utils.get_request_obj, sys.orig_argv = self._saved
+
+
+def seed_app_db(users, metrics, reviewers_per_ratee=None) -> None:
+    """Seeds the users and metrics into the current store, assigns the reviews (everyone to everyone by default), and
+    readies the app to run on it without any prompt"""
+    get_storage().insert_all_data(user_data=users, metric_data=metrics)
+    assign_reviews(reviewers_per_ratee, seed=0)
+    load_registry()
+    get_session_registry().clear()
+    st.const_vars = {"db_verified": "True", "input_save": {}}
+
+
+def percentiles(samples, quantiles=(50, 95, 99)) -> dict[str, float]:
+    """{"p50": ..., ...} of `samples`, nearest-rank, as `instrumentation.Histogram` computes them"""
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {f"p{q}": samples[min(len(samples) - 1, len(samples) * q // 100)] for q in quantiles}
+
+
+def rss_bytes() -> int:
+    """Resident memory of the process (the peak one where /proc isn't available)"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
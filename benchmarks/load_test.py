@@ -0,0 +1,278 @@
+"""Deadline-day load: N reviewers at once on one DB, each logging in, filling in the grid and submitting it.
+
+Every reviewer is an `AppTest` session of `metric_review.py` in a process of its own (AppTest runs can't overlap
+within a process), with a browser (`ajs_anonymous_id`) of its own. It picks its name and confirms it
+(`store_selection`), fills in each ratee's column, clicks its "Done" button (the validation and
+`confirmation_dialog`), and submits the review the way the dialog's Confirm does, through the submission writer of its
+process. So the reviewers contend for the DB as the processes of a multi-process deployment do. The results get
+compared against the baseline stored for the same scenario, and the run fails on a regression.
+
+With `--storage memory`, every reviewer's process gets an in-memory store of its own, seeded alike, which takes the disk
+and the DB contention out of the timings to leave those of the app itself.
+
+USAGE: python -m benchmarks.load_test [--reviewers 10] [--users 40] [--metrics 10] [--reviewers-per-ratee 5]
+                                      [--storage sqlite] [--save-baseline] [--tolerance 0.25] [--output results.json]
+                                      [--instrumentation] [--sql-profile]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+import instrumentation
+from benchmarks.common import temporary_storage, generate_users, generate_metrics, seed_app_db, HeadlessBrowsers, \
+    percentiles, rss_bytes
+from db_storage import db_queries, profiler
+from db_storage.storage import create_storage, get_storage, set_storage
+from handler import submit_review
+from registry import get_registry, load_registry
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "metric_review.py")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "load_test.json")
+# Seconds a single script run of a session may take, which is well beyond anything but a stalled app
+RUN_TIMEOUT = 120
+# Result -> whether a lower value is the better one, for the results compared against the baseline
+COMPARED = {"rerun_p95_ms": True, "submit_p95_ms": True, "submits_per_second": False, "rss_per_session_mb": True,
+            "lock_errors": True}
+LOCK_ERROR_MESSAGES = ("database is locked", "database table is locked", "SQLITE_BUSY")
+
+
+class ReviewerRun:
+    """One simulated reviewer, going through the whole review"""
+
+    def __init__(self, browsers, idx, name):
+        self.name = name
+        self.rng = random.Random(idx)
+        self.app = browsers.use(AppTest.from_file(APP_PATH, default_timeout=RUN_TIMEOUT), f"load-browser-{idx}")
+        self.rerun_seconds = []
+        self.submit_seconds = []
+        self.lock_errors = 0
+        self.errors = []
+
+    def _error(self, message):
+        if any(text in message for text in LOCK_ERROR_MESSAGES):
+            self.lock_errors += 1
+        else:
+            self.errors.append(message)
+
+    def run_app(self):
+        start = time.perf_counter()
+        self.app.run()
+        self.rerun_seconds.append(time.perf_counter() - start)
+        for exception in self.app.exception:
+            self._error(exception.message)
+
+    def review(self):
+        try:
+            self.run_app()
+            self.app.selectbox[0].select(self.name)
+            self.run_app()
+            self.app.button(key="confirm").click()
+            self.run_app()
+
+            registry = get_registry()
+            metrics = registry.metric_id_mapping
+            for ratee in registry.review_sets[self.name].values():
+                values = {f"{ratee}_{metric_shrt}": str(self.rng.randint(1, 10)) for metric_shrt in metrics}
+                for key, value in values.items():
+                    self.app.text_input(key=key).input(value)
+                self.run_app()
+                self.app.button(key=ratee).click()
+                self.run_app()
+
+                start = time.perf_counter()
+                try:
+                    submit_review(self.name, ratee, metrics, values)
+                except Exception as err:
+                    self._error(f"{type(err).__name__}: {err}")
+                else:
+                    self.submit_seconds.append(time.perf_counter() - start)
+            self.run_app()
+        except Exception as err:
+            # e.g. a widget missing off the page, which leaves this reviewer's run incomplete
+            self._error(f"{type(err).__name__}: {err}")
+
+
+def run_reviewer(db_path, idx, name, args, start_barrier, results_queue):
+    """Process of one reviewer, on the DB seeded by the parent process (or on a store of its own, seeded alike)"""
+    if args.instrumentation:
+        instrumentation.enable()
+    if args.sql_profile:
+        profiler.enable()
+    set_storage(create_storage(args.storage))
+    storage = get_storage()
+    if args.storage == "sqlite":
+        db_queries.DB_PATH = db_path
+        load_registry()
+        st.const_vars = {"db_verified": "True", "input_save": {}}
+    else:
+        storage.initialize()
+        seed_app_db(generate_users(args.users), generate_metrics(args.metrics), args.reviewers_per_ratee)
+    with HeadlessBrowsers() as browsers:
+        reviewer = ReviewerRun(browsers, idx, name)
+        rss_before = rss_bytes()
+        start_barrier.wait()
+        reviewer.review()
+        rss_after = rss_bytes()
+    storage_stats = storage.stats()
+    storage.close()
+    results_queue.put({
+        "rerun_seconds": reviewer.rerun_seconds, "submit_seconds": reviewer.submit_seconds,
+        "lock_errors": reviewer.lock_errors, "errors": reviewer.errors, "rss_growth": max(0, rss_after - rss_before),
+        "writer": storage_stats,
+        # Raw samples, so that the percentiles can be taken over all the reviewers
+        "phases": {name: list(histogram.recent) for name, histogram in instrumentation.timings.global_phases.items()},
+        "sql": profiler.profiler.summary() if profiler.is_enabled() else [],
+    })
+    # Both come back in the results, instead of getting printed and exported on exit
+    profiler.disable()
+    instrumentation.disable()
+
+
+def merge_sql(summaries) -> list[dict]:
+    merged = {}
+    for row in (row for summary in summaries for row in summary):
+        total = merged.setdefault(row["statement"], {"statement": row["statement"], "calls": 0, "total_ms": 0.0,
+                                                     "max_ms": 0.0, "rows": 0, "plan": row["plan"]})
+        total["calls"] += row["calls"]
+        total["total_ms"] += row["total_ms"]
+        total["max_ms"] = max(total["max_ms"], row["max_ms"])
+        total["rows"] += row["rows"]
+    return sorted(merged.values(), key=lambda row: -row["total_ms"])
+
+
+def run_load(args) -> dict:
+    users = generate_users(args.users)
+    context = multiprocessing.get_context("spawn")
+    with temporary_storage(args.storage):
+        db_path = db_queries.DB_PATH
+        seed_app_db(users, generate_metrics(args.metrics), args.reviewers_per_ratee)
+        start_barrier = context.Barrier(args.reviewers + 1)
+        results_queue = context.Queue()
+        processes = [context.Process(target=run_reviewer, args=(db_path, idx, name, args, start_barrier, results_queue),
+                                     name=f"reviewer-{idx}")
+                     for idx, (name, _) in enumerate(users[:args.reviewers])]
+        for process in processes:
+            process.start()
+        # Timed from when every reviewer is ready to go
+        start_barrier.wait()
+        start = time.perf_counter()
+        reviewers = [results_queue.get() for _ in processes]
+        elapsed = time.perf_counter() - start
+        for process in processes:
+            process.join()
+
+    rerun_seconds = [seconds for reviewer in reviewers for seconds in reviewer["rerun_seconds"]]
+    submit_seconds = [seconds for reviewer in reviewers for seconds in reviewer["submit_seconds"]]
+    errors = [error for reviewer in reviewers for error in reviewer["errors"]]
+    results = {
+        "seconds": elapsed,
+        "reruns": len(rerun_seconds),
+        **{f"rerun_{q}_ms": value * 1000 for q, value in percentiles(rerun_seconds).items()},
+        "submits": len(submit_seconds),
+        "submits_per_second": len(submit_seconds) / elapsed,
+        **{f"submit_{q}_ms": value * 1000 for q, value in percentiles(submit_seconds).items()},
+        "lock_errors": sum(reviewer["lock_errors"] for reviewer in reviewers),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "rss_per_session_mb": sum(reviewer["rss_growth"] for reviewer in reviewers) / len(reviewers) / 2 ** 20,
+        "writer_max_wait_ms": max(reviewer["writer"].get("max_wait_seconds", 0.0) for reviewer in reviewers) * 1000,
+        "writer_max_commit_ms": max(reviewer["writer"].get("max_commit_seconds", 0.0) for reviewer in reviewers) * 1000,
+    }
+    if args.instrumentation:
+        samples = {}
+        for reviewer in reviewers:
+            for name, seconds in reviewer["phases"].items():
+                samples.setdefault(name, []).extend(seconds)
+        results["phases_ms"] = {name: {q: value * 1000 for q, value in percentiles(seconds).items()}
+                                for name, seconds in sorted(samples.items())}
+    if args.sql_profile:
+        results["sql"] = merge_sql(reviewer["sql"] for reviewer in reviewers)[:10]
+    return results
+
+
+def scenario_key(args) -> str:
+    key = f"reviewers={args.reviewers} users={args.users} metrics={args.metrics} k={args.reviewers_per_ratee}"
+    return key if args.storage == "sqlite" else f"{key} storage={args.storage}"
+
+
+def find_regressions(results, baseline, tolerance) -> list[str]:
+    regressions = []
+    for key, lower_is_better in COMPARED.items():
+        if key not in results or key not in baseline:
+            continue
+        current, base = results[key], baseline[key]
+        if key == "lock_errors":
+            regressed = current > base
+        elif lower_is_better:
+            regressed = current > base * (1 + tolerance)
+        else:
+            regressed = current < base * (1 - tolerance)
+        if regressed:
+            regressions.append(f"{key}: {current:.2f} against the baseline's {base:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reviewers", type=int, default=10, help="Reviewers working at once")
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--metrics", type=int, default=10)
+    parser.add_argument("--reviewers-per-ratee", type=int, default=5, help="0 for everyone reviewing everyone")
+    parser.add_argument("--storage", choices=["sqlite", "memory"], default="sqlite",
+                        help="memory for a store per reviewer, without any disk I/O")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the scenario's baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Fraction a result may be worse by")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--instrumentation", action="store_true", help="Include the per-phase timings")
+    parser.add_argument("--sql-profile", action="store_true", help="Include the costliest SQL statements")
+    args = parser.parse_args()
+    args.reviewers = min(args.reviewers, args.users)
+    args.reviewers_per_ratee = args.reviewers_per_ratee or None
+
+    # Turned on in the reviewers' processes only, and not for the seeding here
+    results = run_load(args)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    print(f"{scenario_key(args)}: {results['seconds']:.1f}s")
+    print(f"  reruns  {results['reruns']:>6}  p50 {results.get('rerun_p50_ms', 0):>8.1f}ms  "
+          f"p95 {results.get('rerun_p95_ms', 0):>8.1f}ms  p99 {results.get('rerun_p99_ms', 0):>8.1f}ms")
+    print(f"  submits {results['submits']:>6}  p50 {results.get('submit_p50_ms', 0):>8.1f}ms  "
+          f"p95 {results.get('submit_p95_ms', 0):>8.1f}ms  {results['submits_per_second']:.1f}/s")
+    print(f"  lock errors {results['lock_errors']}, other errors {results['errors']}, "
+          f"{results['rss_per_session_mb']:.1f}MB per session")
+    print(f"  writer: max wait {results['writer_max_wait_ms']:.1f}ms, max commit {results['writer_max_commit_ms']:.1f}ms")
+    for error in results["error_samples"]:
+        print(f"    {error}")
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baselines = json.load(file)
+    key = scenario_key(args)
+    if args.save_baseline:
+        baselines[key] = {name: results[name] for name in COMPARED if name in results}
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif key in baselines:
+        regressions = find_regressions(results, baselines[key], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regression against the baseline")
+    else:
+        print(f"No baseline for the scenario in {args.baseline} (store one with --save-baseline)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from config import REVIEWERS_PER_RATEE
+from assignments import generate_assignments, AssignmentPlan
+from db_storage.storage import get_storage
+from db_storage.migrations import REVIEW_ASSIGNMENTS_VERSION
+from registry import load_registry, Registry
+from roster import config_roster, Roster
+
+
+def assign_reviews(reviewers_per_ratee=REVIEWERS_PER_RATEE, replace=False, seed=None) -> AssignmentPlan:
+    """Assigns the reviewers of everyone not fully assigned yet, or of everyone anew when replacing"""
+    storage = get_storage()
+    inputs = storage.get_assignment_inputs()
+    plan = generate_assignments(inputs.user_ids, reviewers_per_ratee, inputs.selective, inputs.exclusions,
+                                existing=() if replace else inputs.existing, seed=seed)
+    storage.save_assignments(plan.pairs, replace)
+    return plan
+
+
+def seed_db(roster: Roster = None, reviewers_per_ratee=REVIEWERS_PER_RATEE) -> Registry:
+    # Inserts users name and username (shorthand), the metric data with name and description, and the review
+    # assignments and exclusions, of the roster (or the one declared in config.py) onto the DB in one transaction
+    roster = roster if roster is not None else config_roster()
+    get_storage().insert_all_data(user_data=roster.users, metric_data=roster.metrics,
+                                  assignment_data=roster.assignments, exclusion_data=roster.exclusions, upsert=True)
+    assign_reviews(reviewers_per_ratee)
+    # Builds the user and metric lookups, e.g. {username: id, username2: id2, ...}, from the freshly seeded DB
+    return load_registry()
+
+
+def init_db(roster: Roster = None, reviewers_per_ratee=REVIEWERS_PER_RATEE) -> Registry:
+    """Creates the DB at its latest schema version, and seeds it"""
+    get_storage().initialize()
+    return seed_db(roster, reviewers_per_ratee)
+
+
+def reset_db(roster: Roster = None, reviewers_per_ratee=REVIEWERS_PER_RATEE) -> Registry:
+    """Deletes all the data of the existing DB (reviews and logins included), and seeds it again"""
+    storage = get_storage()
+    storage.check_exists()
+    storage.migrate_schema()
+    storage.delete_all_data()
+    return seed_db(roster, reviewers_per_ratee)
+
+
+def resume_db() -> Registry:
+    """Continues on the existing DB in the state that it is in, once brought to the latest schema version"""
+    storage = get_storage()
+    storage.check_exists()
+    schema_version = storage.get_schema_version()
+    storage.migrate_schema()
+    if schema_version < REVIEW_ASSIGNMENTS_VERSION:
+        # The selective reviewers used to be read off config.py on every run, and now live in the DB along with the rest.
+        # The assignments got backfilled without them, so they get redone by the rule the DB was created with
+        storage.insert_all_data(assignment_data=config_roster().assignments, upsert=True)
+        assign_reviews(reviewers_per_ratee=None, replace=True)
+    return load_registry()
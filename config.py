@@ -1,5 +1,9 @@
 DB_NAME = "sprint_06-06-2024.db"
 
+# Where the app keeps its data (see `db_storage/storage.py`): "sqlite" for the DB_NAME file, shared by every process and
+# kept across restarts, or "memory" for a store within the process, gone once it exits (for trials and benchmarks)
+STORAGE_BACKEND = "sqlite"
+
 # List of evaluation metrics. Change it as per need
 # NOTE: You need to make sure that the initials of each word joined is always unique
 # ....: as the intials get used to identify the fields uniquely
@@ -32,18 +36,47 @@ REVIEWERS_SHORTHAND = {
     "Vivek Tripathi": "vivek",
 }
 
-REVIEWERS_SHORTHAND_REV = {v: k for k, v in REVIEWERS_SHORTHAND.items()}
-
 # If a reviewer need to be assigned only some person to review and not all. Also, those who won't be rated either
 SELECTIVE_REVIEWERS = {
     "nischey": ["rohan"]
 }
 
-for rev in SELECTIVE_REVIEWERS:
-    if rev not in REVIEWERS_SHORTHAND_REV:
-        raise Exception(f"SELECTIVE_REVIEWER with shorthand {rev} doesn't match the expected REVIEWER_SHORTHAND names")
-    else:
-        for assigned in SELECTIVE_REVIEWERS[rev]:
-            if assigned not in REVIEWERS_SHORTHAND_REV:
-                raise Exception(f"SELECTIVE_REVIEWER with shorthand '{rev}' has unmatched assigned name '{assigned}' which is "
-                                "not as per the expected REVIEWER_SHORTHAND names")
+# Reviewers that each one gets, besides themselves. None makes everyone review everyone, which suits a small team,
+# while bigger ones need a number here, or it makes O(n^2) ratings (see `python manage.py assign`)
+REVIEWERS_PER_RATEE = None
+
+# Who shouldn't review whom (e.g. reviewers reporting to the same manager as the ratee). Same shape as the above
+REVIEW_EXCLUSIONS = {}
+
+# NOTE: The entries above get validated when seeded onto the DB (see `roster.py`), and not on import.
+# ....: For bigger rosters, load them from CSV/JSONL/TOML files with `python manage.py load-roster` instead
+
+# Timing of each phase of the script runs, listed at `?admin=metrics` (see `instrumentation.py`). Next to free while off,
+# and can also be turned on with the environment variable METRIC_REVIEW_INSTRUMENTATION=1
+INSTRUMENTATION_ENABLED = False
+# File the timings get written to on exit (Prometheus text, or a JSON summary for a .json path), and the port serving
+# them at /metrics for Prometheus to scrape (None for no endpoint)
+INSTRUMENTATION_EXPORT_PATH = "phase_timings.prom"
+INSTRUMENTATION_PORT = None
+# Token the timings page takes, as `?admin=metrics&token=<ADMIN_TOKEN>` (or METRIC_REVIEW_ADMIN_TOKEN in the environment).
+# The page is off while there is none
+ADMIN_TOKEN = None
+
+# Profiling of every statement run through `SQLiteSession` (see `db_storage/profiler.py`), with a summary printed on
+# exit. Also turned on with the environment variable METRIC_REVIEW_SQL_PROFILING=1. Statements taking at least
+# SLOW_QUERY_MS get appended to SLOW_QUERY_LOG (None for no log)
+SQL_PROFILING = False
+SLOW_QUERY_MS = 50
+SLOW_QUERY_LOG = "slow_queries.log"
+
+# Sprint DBs next to the DB_NAME one, which the trends across sprints get read from (see `db_storage/trends.py`), and
+# the date format in their names. Every sprint but the current one (DB_NAME) is closed, and its results get cached in
+# TRENDS_CACHE_DB_NAME (kept out of the pattern)
+SPRINT_DB_PATTERN = "sprint_*.db"
+SPRINT_DATE_FORMAT = "%d-%m-%Y"
+TRENDS_CACHE_DB_NAME = "trends_cache.db"
+
+# Seconds the cells typed into the review grids wait before being saved as drafts (see `db_storage/drafts.py`), so that
+# the edits in between get written together, in one transaction. Drafts are restored on the next login, even after a
+# restart of the server (unless on the "memory" STORAGE_BACKEND)
+DRAFT_FLUSH_SECONDS = 2
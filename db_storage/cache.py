@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+from functools import wraps
+from db_storage.sqlite3_db_helper import connect
+
+# Results kept per cached function, the least recently used ones getting evicted first
+CACHE_SIZE = 256
+
+DATA_VERSIONS_SQL = """
+    SELECT name, version FROM data_versions;
+"""
+
+
+class DataVersionProbe:
+    """
+    Tells the current `data_versions` of a DB as cheaply as possible. The probe keeps a connection of its own that
+    never writes, so its `PRAGMA data_version` changes exactly when some other connection (of any process) has
+    committed, and the versions table only gets read again then.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._versions = {}
+
+    def get_versions(self) -> dict[str, int]:
+        with self._lock:
+            if self._conn is None:
+                self._conn = connect(self.db_path)
+            data_version = self._conn.execute("PRAGMA data_version;").fetchone()[0]
+            if data_version != self._data_version:
+                self._versions = dict(self._conn.execute(DATA_VERSIONS_SQL).fetchall())
+                self._data_version = data_version
+            return self._versions
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn, self._data_version = None, None
+
+
+_probes: dict[str, DataVersionProbe] = {}
+_probes_lock = threading.Lock()
+
+
+def get_probe(db_path) -> DataVersionProbe:
+    probe = _probes.get(db_path)
+    if probe is None:
+        with _probes_lock:
+            probe = _probes.setdefault(db_path, DataVersionProbe(db_path))
+    return probe
+
+
+def close_probe(db_path) -> None:
+    with _probes_lock:
+        probe = _probes.pop(db_path, None)
+    if probe is not None:
+        probe.close()
+
+
+# Bumped by `invalidate`, for the changes that the `data_versions` triggers don't see. A bump is a read-modify-write,
+# which two threads doing at once could merge into one, hence the lock. Looking up one generation needs none
+_generations: dict[str, int] = {}
+_generations_lock = threading.Lock()
+_caches: dict[str, "VersionedCache"] = {}
+
+
+def invalidate(*tables) -> None:
+    """Makes every cached result depending on any of `tables` stale, in this process"""
+    with _generations_lock:
+        for table in tables:
+            _generations[table] = _generations.get(table, 0) + 1
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+class VersionedCache:
+    """LRU of results, each one stored along with the versions of the tables it was computed from"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return True, entry[1]
+            self._stats["misses"] += 1
+            if entry is not None:
+                self._stats["stale"] += 1
+            return False, None
+
+    def put(self, key, versions, value) -> None:
+        with self._lock:
+            self._entries[key] = (versions, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {**self._stats, "size": len(self._entries)}
+
+
+def _make_key(args, kwargs):
+    args = tuple(tuple(arg) if isinstance(arg, list) else frozenset(arg) if isinstance(arg, set) else arg for arg in args)
+    return args + tuple(sorted(kwargs.items())) if kwargs else args
+
+
+def cached_query(*tables, db_path_getter=None, storage_getter=None, maxsize=CACHE_SIZE):
+    """
+    Caches the results of a read function until any of `tables` gets written to, by whichever process. Checking that
+    costs a `PRAGMA data_version` on each call, so new submissions show up right away. The cached values are shared
+    among the callers, and hence must not be mutated. Functions reading through a `storage.StorageBackend` pass
+    `storage_getter` instead of `db_path_getter`, and go by its `get_data_versions`.
+    """
+    def decorator(func):
+        cache = VersionedCache(maxsize)
+        _caches[func.__qualname__] = cache
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if storage_getter is not None:
+                source = storage_getter()
+                data_versions = source.get_data_versions()
+            else:
+                source = db_path_getter()
+                data_versions = get_probe(source).get_versions()
+            versions = tuple((data_versions.get(table), _generations.get(table, 0)) for table in tables)
+            key = (source, *_make_key(args, kwargs))
+            found, value = cache.get(key, versions)
+            if not found:
+                value = func(*args, **kwargs)
+                cache.put(key, versions, value)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        wrapper.cache_stats = cache.stats
+        return wrapper
+    return decorator
@@ -1,8 +1,14 @@
 import os
+import json
+import math
+import time
+from typing import NamedTuple
 from db_storage.sqlite3_db_helper import SQLiteSession as SQLite3
+from db_storage.migrations import apply_migrations, get_schema_version, REBUILD_RATING_AGGREGATES_SQL, \
+    RECOUNT_ASSIGNMENT_RATINGS_SQL, REBUILD_REVIEW_PROGRESS_SQL
+from db_storage.cache import cached_query, get_probe, invalidate
 from exceptions import DatabaseDoesNotExist
-from config import DB_NAME, REVIEWERS_SHORTHAND, SELECTIVE_REVIEWERS, METRIC_DESCRIPTIVE
-import streamlit as st
+from config import DB_NAME
 
 
 intial_table_queries = """
@@ -47,13 +53,51 @@ def get_db_path(DB_NAME) -> str:
 DB_PATH = get_db_path(DB_NAME)
 
 
+def get_current_db_path() -> str:
+    # Looked up on each call, as `DB_PATH` gets pointed elsewhere by the benchmarks
+    return DB_PATH
+
+
 def initialize_tables_for_db() -> None:
     with SQLite3(DB_PATH) as (_, cursor):
         cursor.executescript(intial_table_queries)
+    apply_migrations(DB_PATH)
+
+
+# The summary tables aren't versioned, so a rebuild bumps the versions of the tables they are derived from, for the
+# cached results of every process to be read again
+BUMP_SUMMARY_VERSIONS_SQL = """
+    UPDATE data_versions SET version = version + 1 WHERE name IN ('ratings', 'assignments');
+"""
+
+
+def rebuild_rating_aggregates() -> None:
+    """Recomputes `rating_aggregates` and `review_progress` from scratch out of the `ratings` and `assignments` rows"""
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute("DELETE FROM rating_aggregates;")
+        cursor.execute(REBUILD_RATING_AGGREGATES_SQL)
+        # The recount goes through the triggers onto `review_progress`, which then gets rebuilt over anyway
+        cursor.execute(RECOUNT_ASSIGNMENT_RATINGS_SQL)
+        cursor.execute("DELETE FROM review_progress;")
+        cursor.execute(REBUILD_REVIEW_PROGRESS_SQL)
+        cursor.execute(BUMP_SUMMARY_VERSIONS_SQL)
+    # The results cached by this process go as well, whatever versions its probe reads next
+    invalidate("ratings", "assignments")
+
+
+def migrate_schema() -> int:
+    """Brings an existing database up to the latest schema version, and returns that version"""
+    return apply_migrations(DB_PATH)
+
+
+def get_db_schema_version() -> int:
+    with SQLite3(DB_PATH) as (_, cursor):
+        return get_schema_version(cursor)
 
 
 def delete_all_db_data() -> None:
-    tables = ['users', 'metrics', 'ratings', 'user_auth']
+    tables = ['users', 'metrics', 'ratings', 'rating_aggregates', 'user_auth', 'review_assignments', 'review_exclusions',
+              'assignments', 'review_progress', 'drafts']
     with SQLite3(DB_PATH) as (_, cursor):
         for table in tables:
             cursor.execute("""
@@ -72,14 +116,16 @@ def check_if_db_exists() -> None:
         raise DatabaseDoesNotExist(f"Database '{DB_NAME}' does not exist.")
 
 
+INITIALIZED_USER_REQUESTS_SQL = """
+    SELECT users.name, user_auth.browser_uuid
+    FROM user_auth
+    JOIN users ON user_auth.user_id = users.id;
+"""
+
+
 def get_initialized_user_requests() -> dict[str, str]:
-    query = """
-        SELECT users.name, user_auth.browser_uuid
-        FROM user_auth
-        JOIN users ON user_auth.user_id = users.id;
-    """
     with SQLite3(DB_PATH) as (_, cursor):
-        cursor.execute(query)
+        cursor.execute(INITIALIZED_USER_REQUESTS_SQL)
         rows = cursor.fetchall()
 
     result = {}
@@ -89,11 +135,54 @@ def get_initialized_user_requests() -> dict[str, str]:
     return result
 
 
+REVIEWER_BY_BROWSER_SQL = """
+    SELECT users.name
+    FROM user_auth
+    JOIN users ON user_auth.user_id = users.id
+    WHERE user_auth.browser_uuid=?;
+"""
+
+BROWSER_BY_USER_SQL = """
+    SELECT browser_uuid FROM user_auth WHERE user_id=? LIMIT 1;
+"""
+
+# A single statement runs under the DB write lock, so the check and the insert are atomic across processes as well
+REGISTER_BROWSER_SQL = """
+    INSERT INTO user_auth (user_id, browser_uuid)
+    SELECT ?1, ?2
+    WHERE NOT EXISTS (SELECT 1 FROM user_auth WHERE user_id=?1 OR browser_uuid=?2);
+"""
+
+
+def get_reviewer_by_browser(browser_id) -> str | None:
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(REVIEWER_BY_BROWSER_SQL, (browser_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def get_browser_by_user(user_id) -> str | None:
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(BROWSER_BY_USER_SQL, (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def register_browser(user_id, browser_id) -> bool:
+    """Ties the browser to the user, unless either of them is already registered. Returns whether it got tied"""
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(REGISTER_BROWSER_SQL, (user_id, browser_id))
+        return cursor.rowcount == 1
+
+
+METRIC_ID_SQL = """
+    SELECT id from metrics where name=?;
+"""
+
+
 def get_metric_id(metric_name) -> int:
     with SQLite3(DB_PATH) as (_, cursor):
-        cursor.execute("""
-            SELECT id from metrics where name=?;
-        """, metric_name)
+        cursor.execute(METRIC_ID_SQL, (metric_name,))
         row = cursor.fetchone()
         if row:
             return row[0]
@@ -101,167 +190,444 @@ def get_metric_id(metric_name) -> int:
             raise Exception(f"Metric with name '{metric_name}' does not exist.")
 
 
-def insert_all_data(user_data=(), metric_data=(), rating_data=(), auth_data=()) -> None:
+INSERT_USER_SQL = """
+    INSERT INTO users (
+        name, username
+    ) VALUES (?, ?)"""
+
+INSERT_METRIC_SQL = """
+    INSERT INTO metrics (
+        name, description
+    ) VALUES (?, ?)"""
+
+INSERT_RATING_SQL = """
+    INSERT INTO ratings (
+        user_id, ratee_id, metric_id, score
+    ) VALUES (?, ?, ?, ?)"""
+
+INSERT_AUTH_SQL = """
+    INSERT INTO user_auth (
+        user_id, browser_uuid
+    ) VALUES (?, ?)"""
+
+# Review assignments and exclusions come in by usernames, which get resolved to the user ids within the same statement
+INSERT_REVIEW_ASSIGNMENT_SQL = """
+    INSERT INTO review_assignments (
+        reviewer_id, ratee_id
+    ) SELECT reviewer.id, ratee.id FROM users reviewer, users ratee WHERE reviewer.username = ? AND ratee.username = ?"""
+
+INSERT_EXCLUSION_SQL = """
+    INSERT INTO review_exclusions (
+        reviewer_id, ratee_id
+    ) SELECT reviewer.id, ratee.id FROM users reviewer, users ratee WHERE reviewer.username = ? AND ratee.username = ?"""
+
+# Conflict clauses used in the upsert mode, so that a resubmit leaves the table as if it was written once
+UPSERT_CLAUSES = {
+    INSERT_USER_SQL: " ON CONFLICT DO NOTHING;",
+    INSERT_METRIC_SQL: " ON CONFLICT(name) DO UPDATE SET description=excluded.description;",
+    INSERT_RATING_SQL: " ON CONFLICT(user_id, ratee_id, metric_id) DO UPDATE SET score=excluded.score;",
+    INSERT_AUTH_SQL: " ON CONFLICT DO NOTHING;",
+    INSERT_REVIEW_ASSIGNMENT_SQL: " ON CONFLICT DO NOTHING;",
+    INSERT_EXCLUSION_SQL: " ON CONFLICT DO NOTHING;",
+}
+
+
+def get_insert_sql(insert_sql, upsert=False) -> str:
+    return insert_sql + (UPSERT_CLAUSES[insert_sql] if upsert else ";")
+
+
+def insert_all_data(user_data=(), metric_data=(), rating_data=(), auth_data=(), assignment_data=(), exclusion_data=(),
+                    upsert=False) -> None:
     """
-    Inserts data into users, metrics, ratings, and user_auth tables.
+    Inserts data into users, metrics, ratings, user_auth, review_assignments and review_exclusions tables, all within a
+    single transaction.
+    Each table gets one `executemany` with a constant statement, so SQLite prepares it once and reuses it for every row.
 
     Parameters:
-        db_path (str): Path to the SQLite database.
-        user_data (tuple): (username, name, description)
-        metric_data (tuple): (name,)
-        rating_data (tuple): (user_id, ratee_id, metric_id, score)
+        user_data (iterable): of (name, username)
+        metric_data (iterable): of (name, description)
+        rating_data (iterable): of (user_id, ratee_id, metric_id, score)
         auth_data (tuple): (user_id, browser_uuid)
+        assignment_data (iterable): of (reviewer username, ratee username). Usernames not in the users are skipped
+        exclusion_data (iterable): of (reviewer username, ratee username), same as `assignment_data`
+        upsert (bool): Resolve conflicts on the unique keys instead of raising `sqlite3.IntegrityError`.
+            Ratings get their score replaced, metrics their description, and the others are left untouched
 
     Example:
         insert_all_data(
-            db_path="mydb.sqlite",
-            user_data=("jdoe", "John Doe"),
-            metric_data=("helpfulness", "Colleague is helpful to you and others"),
-            rating_data=(1, 2, 1, 8.5),
+            user_data=[("John Doe", "jdoe")],
+            metric_data=[("helpfulness", "Colleague is helpful to you and others")],
+            rating_data=[(1, 2, 1, 8.5)],
             auth_data=(1, "550e8400-e29b-41d4-a716-446655440000")
         )
     """
     with SQLite3(DB_PATH) as (_, cursor):
         if user_data:
-            for name, username in user_data:
-                # Insert into users table
-                cursor.execute("""
-                    INSERT INTO users (
-                        name, username
-                    ) VALUES (?, ?);""", (name, username))
+            # Insert into users table
+            cursor.executemany(get_insert_sql(INSERT_USER_SQL, upsert), user_data)
 
         if metric_data:
-            for metric, desc in metric_data:
-                # Insert into metrics table
-                cursor.execute("""
-                    INSERT INTO metrics (
-                        name, description
-                    ) VALUES (?, ?);""", (metric, desc))
+            # Insert into metrics table
+            cursor.executemany(get_insert_sql(INSERT_METRIC_SQL, upsert), metric_data)
 
         if rating_data:
-            for user_id, ratee_id, metric_id, score in rating_data:
-                # Insert into ratings
-                cursor.execute("""
-                    INSERT INTO ratings (
-                        user_id, ratee_id, metric_id, score
-                    ) VALUES (?, ?, ?, ?);""", (user_id, ratee_id, metric_id, score))
+            # Insert into ratings
+            cursor.executemany(get_insert_sql(INSERT_RATING_SQL, upsert), rating_data)
 
         if auth_data:
             # Insert into user_auth
-            cursor.execute("""
-                INSERT INTO user_auth (
-                    user_id, browser_uuid
-                ) VALUES (?, ?);""", auth_data)
+            cursor.execute(get_insert_sql(INSERT_AUTH_SQL, upsert), auth_data)
+
+        if assignment_data:
+            # Insert into review_assignments
+            cursor.executemany(get_insert_sql(INSERT_REVIEW_ASSIGNMENT_SQL, upsert), assignment_data)
+
+        if exclusion_data:
+            # Insert into review_exclusions
+            cursor.executemany(get_insert_sql(INSERT_EXCLUSION_SQL, upsert), exclusion_data)
+
+
+USER_TO_ID_SQL = """
+    SELECT username, id from users;
+"""
+
+METRIC_TO_ID_SQL = """
+    SELECT name, id from metrics ORDER BY id;
+"""
+
+# The users, the metrics and the assignments in a single read, to build the registry from
+REGISTRY_ROWS_SQL = """
+    SELECT 'user', id, username, name from users
+    UNION ALL
+    SELECT 'metric', id, name, NULL from metrics
+    UNION ALL
+    SELECT 'assignment', reviewer_id, ratee_id, NULL from assignments
+    ORDER BY 2, 3;
+"""
+
+# Everything that the assignment engine works off, in a single read
+ASSIGNMENT_INPUTS_SQL = """
+    SELECT 'user', id, NULL from users
+    UNION ALL
+    SELECT 'selective', reviewer_id, ratee_id from review_assignments
+    UNION ALL
+    SELECT 'exclusion', reviewer_id, ratee_id from review_exclusions
+    UNION ALL
+    SELECT 'assigned', reviewer_id, ratee_id from assignments
+    ORDER BY 2, 3;
+"""
+
+INSERT_ASSIGNMENTS_SQL = """
+    INSERT OR IGNORE INTO assignments (reviewer_id, ratee_id) VALUES (?, ?);
+"""
+
+RATINGS_EXIST_SQL = """
+    SELECT EXISTS(SELECT 1 FROM ratings);
+"""
+
+# Read in the order of `idx_ratings_ratee_metric`, which holds every column asked for, so the table rows are never visited
+SCORED_RATINGS_SQL = """
+    SELECT user_id, ratee_id, metric_id, score FROM ratings WHERE score IS NOT NULL ORDER BY ratee_id, metric_id;
+"""
+
+USER_IDS_SQL = """
+    SELECT id FROM users ORDER BY id;
+"""
+
+REVIEWERS_FINALISED_COLS_SQL = """
+    SELECT DISTINCT u.username
+    FROM ratings r, users u
+    ON r.ratee_id = u.id
+    WHERE r.user_id=?;
+"""
+
+# Progress of every reviewer with anything assigned, off the counts that the triggers keep in `review_progress`
+REVIEW_PROGRESS_SQL = """
+    SELECT reviewer_id, assigned, rated, (SELECT COUNT(*) FROM metrics)
+    FROM review_progress
+    WHERE assigned > 0;
+"""
+
+
+class AssignmentInputs(NamedTuple):
+    user_ids: list[int]
+    selective: dict[int, list[int]]
+    exclusions: set[tuple[int, int]]
+    existing: set[tuple[int, int]]
+
+
+def get_assignment_inputs() -> AssignmentInputs:
+    """The users, the review assignments (of the selective reviewers), the exclusions, and the current assignments"""
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(ASSIGNMENT_INPUTS_SQL)
+        rows = cursor.fetchall()
+    inputs = AssignmentInputs([], {}, set(), set())
+    for kind, reviewer_id, ratee_id in rows:
+        if kind == 'user':
+            inputs.user_ids.append(reviewer_id)
+        elif kind == 'selective':
+            inputs.selective.setdefault(reviewer_id, []).append(ratee_id)
+        elif kind == 'exclusion':
+            inputs.exclusions.add((reviewer_id, ratee_id))
+        else:
+            inputs.existing.add((reviewer_id, ratee_id))
+    return inputs
+
+
+def save_assignments(pairs, replace=False) -> None:
+    """Adds the (reviewer_id, ratee_id) assignments, or replaces all of the existing ones with them"""
+    with SQLite3(DB_PATH) as (_, cursor):
+        if replace:
+            cursor.execute("DELETE FROM assignments;")
+        cursor.executemany(INSERT_ASSIGNMENTS_SQL, pairs)
+
+
+def ratings_exist() -> bool:
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(RATINGS_EXIST_SQL)
+        return bool(cursor.fetchone()[0])
+
+
+def get_scored_rating_chunks(chunk_size=65536):
+    """Yields the (user_id, ratee_id, metric_id, score) rows of the scored ratings, `chunk_size` rows at a time"""
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(SCORED_RATINGS_SQL)
+        while rows := cursor.fetchmany(chunk_size):
+            yield rows
+
+
+def get_user_ids() -> list[int]:
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(USER_IDS_SQL)
+        return [row[0] for row in cursor.fetchall()]
 
 
 def get_user_to_id_map() -> dict[str, int]:
     with SQLite3(DB_PATH) as (_, cursor):
-        cursor.execute("""
-            SELECT username, id from users;
-        """)
+        cursor.execute(USER_TO_ID_SQL)
         rows = cursor.fetchall()
         return dict(rows)
 
 
+def get_registry_rows() -> tuple[list[tuple[int, str, str]], dict[str, int], dict[str, list[str]]]:
+    """Returns the (id, username, name) rows of the users and the {name: id} of the metrics, in the order of their ids,
+    along with the {reviewer username: [ratee usernames]} of the assignments"""
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(REGISTRY_ROWS_SQL)
+        rows = cursor.fetchall()
+    user_rows = [(id, username, name) for kind, id, username, name in rows if kind == 'user']
+    metric_full_to_id_map = {name: id for kind, id, name, _ in rows if kind == 'metric'}
+    id_user_mapping = {id: username for id, username, _ in user_rows}
+    assignments = {}
+    for kind, reviewer_id, ratee_id, _ in rows:
+        if kind == 'assignment':
+            assignments.setdefault(id_user_mapping[reviewer_id], []).append(id_user_mapping[ratee_id])
+    return user_rows, metric_full_to_id_map, assignments
+
+
 def get_metric_to_id_map() -> dict[str, int]:
     with SQLite3(DB_PATH) as (_, cursor):
-        cursor.execute("""
-            SELECT name, id from metrics;
-        """)
+        cursor.execute(METRIC_TO_ID_SQL)
         rows = cursor.fetchall()
         return dict(rows)
 
 
+@cached_query("ratings", "users", db_path_getter=get_current_db_path)
 def get_reviewers_finalised_cols(reviewer_id) -> list[str]:
     with SQLite3(DB_PATH) as (_, cursor):
-        cursor.execute("""
-            SELECT DISTINCT u.name
-            FROM ratings r, users u
-            ON r.ratee_id = u.id
-            WHERE r.user_id=?;
-        """, (reviewer_id,))
+        cursor.execute(REVIEWERS_FINALISED_COLS_SQL, (reviewer_id,))
         rows = cursor.fetchall()
-        return [REVIEWERS_SHORTHAND[it[0]] for it in rows]
+        return [it[0] for it in rows]
+
+
+UPSERT_DRAFT_SQL = """
+    INSERT INTO drafts (user_id, ratee_id, metric_id, value, updated_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, ratee_id, metric_id) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at;
+"""
 
+DELETE_DRAFT_SQL = """
+    DELETE FROM drafts WHERE user_id=? AND ratee_id=? AND metric_id=?;
+"""
+
+DELETE_RATEE_DRAFTS_SQL = """
+    DELETE FROM drafts WHERE user_id=? AND ratee_id=?;
+"""
+
+# A range of the primary key, i.e. only the reviewer's own cells get read
+DRAFTS_SQL = """
+    SELECT ratee_id, metric_id, value FROM drafts WHERE user_id=?;
+"""
 
-def fetch_the_count_on_ids() -> dict[int, int]:
-    # Fetch the count of users (only on ids) that has been reviewed by a reviewer (including themselves)
+
+def save_drafts(draft_rows) -> None:
+    """Writes the (user_id, ratee_id, metric_id, value) cells in one transaction, an empty value removing the cell's"""
+    now = time.time()
     with SQLite3(DB_PATH) as (_, cursor):
-        cursor.execute("""
-            SELECT user_id, COUNT(ratee_id)
-            FROM ratings
-            GROUP BY user_id;
-        """)
-        rows = cursor.fetchall()
-        return dict(rows)
+        cursor.executemany(UPSERT_DRAFT_SQL, [(*row[:3], row[3], now) for row in draft_rows if row[3] != ""])
+        cursor.executemany(DELETE_DRAFT_SQL, [tuple(row[:3]) for row in draft_rows if row[3] == ""])
 
 
-@st.cache_data
-def get_average_scores(id_list) -> dict[int, dict[str, dict[int, str]]]:
-    reviewers_ratings = {}
-    for id in id_list:
-        reviewers_ratings[id] = {}
-        with SQLite3(DB_PATH) as (_, cursor):
-            cursor.execute(f"""
-                SELECT metrics.name, AVG(ratings.score)
-                FROM metrics, ratings
-                ON metrics.id = ratings.metric_id
-                WHERE ratings.ratee_id={id} AND ratings.user_id<>{id}
-                GROUP BY ratings.metric_id;
-            """)
-            rows = cursor.fetchall()
-            reviewers_ratings[id]["ratings"] = dict(rows)
-
-            cursor.execute(f"""
-                SELECT metrics.name,ratings.score
-                FROM metrics, ratings
-                ON metrics.id = ratings.metric_id
-                WHERE ratings.ratee_id={id} AND ratings.user_id={id}
-                GROUP BY ratings.metric_id;
-            """)
-            rows = cursor.fetchall()
-            reviewers_ratings[id]["self_rating"] = dict(rows)
-    return reviewers_ratings
+def get_drafts(user_id) -> dict[tuple[int, int], str]:
+    """{(ratee_id, metric_id): value} of the reviewer's drafts"""
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(DRAFTS_SQL, (user_id,))
+        return {(ratee_id, metric_id): value for ratee_id, metric_id, value in cursor.fetchall()}
+
+
+def delete_drafts(user_id, ratee_id) -> None:
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(DELETE_RATEE_DRAFTS_SQL, (user_id, ratee_id))
+
+
+class ReviewProgress(NamedTuple):
+    reviewer_id: int
+    assigned: int   # Ratees assigned
+    rated: int      # Rating rows submitted on them, i.e. `metrics` per ratee once done
+    metrics: int
+
+
+@cached_query("ratings", "assignments", "metrics", db_path_getter=get_current_db_path)
+def get_review_progress() -> list[ReviewProgress]:
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(REVIEW_PROGRESS_SQL)
+        return [ReviewProgress(*row) for row in cursor.fetchall()]
+
+
+def get_data_versions() -> dict[str, int]:
+    """Version of each table in `data_versions`, which changes with any write on that table"""
+    return get_probe(DB_PATH).get_versions()
 
 
-@st.cache_data
-def count_permissible_by_users():
-    user_to_id_map: dict = eval(st.const_vars["initialization_choices"])["user_id_mapping"]
-    mapping_to_reviewers_ids = {}
-    selective_reviewers_ids = []
+class ScoreStats(NamedTuple):
+    """Peer score statistics of a ratee on one metric. Unrated (NULL) scores are left out of all of them."""
+    count: int
+    mean: float | None
+    minimum: float | None
+    maximum: float | None
+    stddev: float | None
 
-    all_being_reviewed = list(REVIEWERS_SHORTHAND.values())
-    all_being_reviewed_ids = [user_to_id_map[reviewer] for reviewer in all_being_reviewed]
 
-    for reviewer in all_being_reviewed:
-        mapping_to_reviewers_ids[user_to_id_map[reviewer]] = all_being_reviewed_ids
+def get_score_stats(count, total, total_sq, minimum, maximum) -> ScoreStats:
+    """`ScoreStats` off the sums that a `rating_aggregates` row keeps"""
+    mean = total / count if count else None
+    stddev = math.sqrt(max(total_sq / count - mean * mean, 0.0)) if count else None
+    return ScoreStats(count, mean, minimum, maximum, stddev)
 
-    # Overwrite with Selective Reviewers
-    for reviewer in SELECTIVE_REVIEWERS:
-        reviewer_id = user_to_id_map[reviewer]
-        mapping_to_reviewers_ids[reviewer_id] = [user_to_id_map[reviewee] for reviewee in SELECTIVE_REVIEWERS[reviewer]]
-        selective_reviewers_ids.append(reviewer_id)
-    return mapping_to_reviewers_ids, selective_reviewers_ids
 
+# Reads the pre-aggregated peer and self rows (`is_self`) of each ratee x metric off `rating_aggregates`, which the
+# triggers on `ratings` keep current. The ids go in as a single JSON array so the statement text stays the same
+# whatever the number of ratees, and its prepared plan gets reused
+AVERAGE_SCORES_SQL = """
+    SELECT rating_aggregates.ratee_id, metrics.name, rating_aggregates.is_self, rating_aggregates.scored,
+           rating_aggregates.total, rating_aggregates.total_sq, rating_aggregates.minimum, rating_aggregates.maximum
+    FROM rating_aggregates
+    JOIN metrics ON metrics.id = rating_aggregates.metric_id
+    WHERE rating_aggregates.ratee_id IN (SELECT value FROM json_each(?));
+"""
+
+
+@cached_query("ratings", "metrics", db_path_getter=get_current_db_path)
+def get_average_scores(id_list) -> dict[int, dict[str, dict[str, float | ScoreStats]]]:
+    """
+    Scores of the given ratees, fetched with a single query over `rating_aggregates`.
+
+    Returns:
+        {ratee_id: {
+            "ratings": {metric_name: peer average},
+            "self_rating": {metric_name: self score},
+            "peer_stats": {metric_name: ScoreStats},
+        }}
+    """
+    reviewers_ratings = {id: {"ratings": {}, "self_rating": {}, "peer_stats": {}} for id in id_list}
+    if not reviewers_ratings:
+        return reviewers_ratings
+
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(AVERAGE_SCORES_SQL, (json.dumps(list(reviewers_ratings)),))
+        rows = cursor.fetchall()
 
-def get_counts_of_reviewed():
-    initialization_choices = eval(st.const_vars["initialization_choices"])
-    user_to_id_map: dict = initialization_choices["user_id_mapping"]
-    user_to_id_map_rev = {v: k for k, v in user_to_id_map.items()}
+    for ratee_id, metric, is_self, count, total, total_sq, minimum, maximum in rows:
+        ratee_ratings = reviewers_ratings[ratee_id]
+        stats = get_score_stats(count, total, total_sq, minimum, maximum)
+        if is_self:
+            ratee_ratings["self_rating"][metric] = stats.mean
+            continue
+        ratee_ratings["ratings"][metric] = stats.mean
+        ratee_ratings["peer_stats"][metric] = stats
+    return reviewers_ratings
 
-    id_mapping_to_review, selective_reviewers_ids = count_permissible_by_users()
-    id_count_mapping = fetch_the_count_on_ids()
 
-    not_started = [user_to_id_map_rev[id].capitalize() for id in (set(id_mapping_to_review) - set(id_count_mapping))]
+def get_counts_of_reviewed(registry, review_progress=None) -> tuple[list[str], list[tuple[str, int]], list[str]]:
+    """Splits the reviewers into not started, pending (with the count of ratees left) and completed, named as in the
+    `registry.Registry`. Only the ratings on their assigned ratees count. The `review_progress` (of a store) is read off
+    the DB unless given"""
+    not_started = []
     pending_reviewers = []
     completed_users = []
 
-    for id in id_count_mapping:
-        to_review_count = len(id_mapping_to_review[id]) * len(METRIC_DESCRIPTIVE)
-        if id in selective_reviewers_ids and id_count_mapping[id] == to_review_count:
-            completed_users.append(user_to_id_map_rev[id].capitalize())
-        elif id_count_mapping[id] == (to_review_count - len(SELECTIVE_REVIEWERS) * len(METRIC_DESCRIPTIVE)):
-            completed_users.append(user_to_id_map_rev[id].capitalize())
+    for progress in review_progress if review_progress is not None else get_review_progress():
+        name = registry.id_user_mapping[progress.reviewer_id].capitalize()
+        if not progress.rated:
+            not_started.append(name)
+        elif progress.rated >= progress.assigned * progress.metrics:
+            completed_users.append(name)
         else:
-            pending_reviewers.append((user_to_id_map_rev[id].capitalize(), (to_review_count - id_count_mapping[id]) // len(METRIC_DESCRIPTIVE) - len(SELECTIVE_REVIEWERS)))
+            # A ratee's ratings come in all at once, on every metric
+            pending_reviewers.append((name, progress.assigned - progress.rated // progress.metrics))
     return not_started, pending_reviewers, completed_users
+
+
+# Rows fetched at a time by the exports, which is all they hold in memory
+EXPORT_CHUNK_SIZE = 10_000
+
+# The filters go in as JSON arrays (NULL for no filter), so there is one statement whatever the filters. The ratings
+# get read in the order of `idx_ratings_ratee_metric`, which covers all of their columns
+EXPORT_RATINGS_SQL = """
+    SELECT reviewer.username, reviewer.name, ratee.username, ratee.name, metrics.name, ratings.score,
+           ratings.user_id IS ratings.ratee_id
+    FROM ratings
+    JOIN users reviewer ON reviewer.id = ratings.user_id
+    JOIN users ratee ON ratee.id = ratings.ratee_id
+    JOIN metrics ON metrics.id = ratings.metric_id
+    WHERE (?1 IS NULL OR ratee.username IN (SELECT value FROM json_each(?1)))
+      AND (?2 IS NULL OR reviewer.username IN (SELECT value FROM json_each(?2)))
+      AND (?3 IS NULL OR metrics.name IN (SELECT value FROM json_each(?3)))
+    ORDER BY ratings.ratee_id, ratings.metric_id;
+"""
+
+# Off `rating_aggregates`, as `get_average_scores` reads them
+EXPORT_AGGREGATES_SQL = """
+    SELECT ratee.username, ratee.name, metrics.name, rating_aggregates.is_self, rating_aggregates.scored,
+           rating_aggregates.total, rating_aggregates.total_sq, rating_aggregates.minimum, rating_aggregates.maximum
+    FROM rating_aggregates
+    JOIN users ratee ON ratee.id = rating_aggregates.ratee_id
+    JOIN metrics ON metrics.id = rating_aggregates.metric_id
+    WHERE (?1 IS NULL OR ratee.username IN (SELECT value FROM json_each(?1)))
+      AND (?2 IS NULL OR metrics.name IN (SELECT value FROM json_each(?2)))
+    ORDER BY rating_aggregates.ratee_id, rating_aggregates.metric_id, rating_aggregates.is_self;
+"""
+
+
+def _json_filter(values):
+    return json.dumps(list(values)) if values is not None else None
+
+
+def iter_export_ratings(ratees=None, reviewers=None, metrics=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the ratings, `chunk_size` rows at a time, as (reviewer username, reviewer name, ratee username, ratee name,
+    metric name, score, is_self) rows. The filters are lists of usernames / metric names, None for all of them. The
+    whole export reads from a single snapshot of the DB, however long it takes
+    """
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(EXPORT_RATINGS_SQL, (_json_filter(ratees), _json_filter(reviewers), _json_filter(metrics)))
+        while rows := cursor.fetchmany(chunk_size):
+            yield [(*row[:6], bool(row[6])) for row in rows]
+
+
+def iter_export_aggregates(ratees=None, metrics=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields (ratee username, ratee name, metric name, is_self, *ScoreStats) rows, `chunk_size` rows at a time"""
+    with SQLite3(DB_PATH) as (_, cursor):
+        cursor.execute(EXPORT_AGGREGATES_SQL, (_json_filter(ratees), _json_filter(metrics)))
+        while rows := cursor.fetchmany(chunk_size):
+            yield [(ratee, ratee_name, metric, bool(is_self), *get_score_stats(*sums))
+                   for ratee, ratee_name, metric, is_self, *sums in rows]
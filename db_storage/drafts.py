@@ -0,0 +1,126 @@
+import atexit
+import threading
+from db_storage.storage import get_storage
+from config import DRAFT_FLUSH_SECONDS
+
+
+class DraftWriter:
+    """
+    Saves the cells of the review grids as they get edited, debounced: `stage` only keeps the latest value of the cell,
+    and a background thread writes whatever got staged within `flush_seconds` of the first edit in one go. So a burst of
+    edits costs a single write, of the cells that changed (each one once), whatever the size of the grid.
+    """
+
+    def __init__(self, flush_seconds=DRAFT_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        # (user_id, ratee_id, metric_id) -> value, of the edits not written yet
+        self._pending: dict[tuple[int, int, int], str] = {}
+        self._cond = threading.Condition()
+        # Held while writing, so that a submitted ratee's drafts can't be written back after `discard` removed them
+        self._write_lock = threading.Lock()
+        self._stopped = False
+        self._stats = {"staged": 0, "flushes": 0, "cells_written": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._run, name="draft-writer", daemon=True)
+        self._thread.start()
+
+    def stage(self, user_id, ratee_id, metric_id, value) -> None:
+        """Records the cell's new value ("" for a cleared cell), to be written with the next flush"""
+        with self._cond:
+            self._pending[(user_id, ratee_id, metric_id)] = value
+            self._stats["staged"] += 1
+            self._cond.notify()
+
+    def get_drafts(self, user_id) -> dict[tuple[int, int], str]:
+        """{(ratee_id, metric_id): value} of the reviewer's drafts, the edits not written yet included"""
+        with self._write_lock:
+            drafts = get_storage().get_drafts(user_id)
+            with self._cond:
+                for (pending_user_id, ratee_id, metric_id), value in self._pending.items():
+                    if pending_user_id == user_id:
+                        drafts[(ratee_id, metric_id)] = value
+        return {key: value for key, value in drafts.items() if value != ""}
+
+    def discard(self, user_id, ratee_id) -> None:
+        """Drops the reviewer's drafts of the ratee, written or not, once the review of the ratee got submitted"""
+        with self._write_lock:
+            with self._cond:
+                for key in [key for key in self._pending if key[:2] == (user_id, ratee_id)]:
+                    del self._pending[key]
+            get_storage().delete_drafts(user_id, ratee_id)
+
+    def flush(self) -> None:
+        """Writes the edits staged so far"""
+        with self._write_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                get_storage().save_drafts([(*key, value) for key, value in pending.items()])
+            except Exception:
+                # Kept for the next flush, unless edited again in the meantime
+                with self._cond:
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+                    self._stats["failed"] += 1
+                raise
+        with self._cond:
+            self._stats["flushes"] += 1
+            self._stats["cells_written"] += len(pending)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "pending": len(self._pending)}
+
+    def shutdown(self, timeout=None) -> None:
+        """Writes the edits staged so far and stops the writer thread"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception:
+            # Lost along with the process, as the drafts are only a convenience. Run on exit and on teardowns, which
+            # shouldn't fail over them
+            pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                # The window starts at the first edit, so edits coming in non-stop still get written every so often
+                self._cond.wait_for(lambda: self._stopped, timeout=self.flush_seconds)
+                if self._stopped:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # Retried in the next window. The drafts are only a convenience, and never worth failing the app over
+                pass
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_draft_writer() -> DraftWriter:
+    """The process-wide draft writer, started on first use and flushed on interpreter exit"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = DraftWriter()
+                atexit.register(_writer.shutdown)
+    return _writer
+
+
+def shutdown_draft_writer(timeout=None) -> None:
+    """Writes the staged edits and stops the writer, if it got started. The next edit starts a new one"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        atexit.unregister(writer.shutdown)
+        writer.shutdown(timeout)
@@ -0,0 +1,392 @@
+import math
+import sqlite3
+import threading
+from concurrent.futures import Future
+from db_storage.db_queries import AssignmentInputs, ReviewProgress, get_score_stats, EXPORT_CHUNK_SIZE
+from db_storage.migrations import LATEST_SCHEMA_VERSION
+from db_storage.storage import StorageBackend
+
+# Tables whose versions `get_data_versions` tells, as the `data_versions` of a DB does
+VERSIONED_TABLES = ("users", "metrics", "ratings", "user_auth", "review_assignments", "assignments")
+
+# Stand-in for an unrated (NULL) score, which keeps every score a float
+UNRATED = math.nan
+
+
+class MemoryStorage(StorageBackend):
+    """
+    A store living in the process only, for the tests and benchmarks that shouldn't touch the disk, or a single-process
+    app that doesn't need to keep its reviews. The ids are positions in the user and metric lists (from 1, as the DB
+    hands them out), and the ratings are a {reviewer id: score} dict per ratee x metric, next to the same per ratee x
+    metric x is_self sums that `rating_aggregates` keeps, updated along with every write. All of it is behind one lock,
+    writes being all or nothing as the DB transactions are.
+    """
+
+    name = ":memory:"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._created = False
+        self._versions = dict.fromkeys(VERSIONED_TABLES, 0)
+        self._clear()
+
+    def _clear(self):
+        # Users and metrics: id - 1 -> value
+        self._usernames: list[str] = []
+        self._user_names: list[str] = []
+        self._user_ids: dict[str, int] = {}           # username -> id
+        self._user_name_ids: dict[str, int] = {}      # name -> id
+        self._metric_names: list[str] = []
+        self._metric_descriptions: list[str | None] = []
+        self._metric_ids: dict[str, int] = {}
+        # (ratee_id, metric_id) -> {reviewer_id: score}, in the order they came in
+        self._ratings: dict[tuple[int, int], dict[int, float]] = {}
+        # (ratee_id, metric_id, is_self) -> [rating rows, scored, total, total_sq, minimum, maximum]
+        self._aggregates: dict[tuple[int, int, bool], list] = {}
+        # reviewer_id -> {ratee_id: rating rows}
+        self._rated: dict[int, dict[int, int]] = {}
+        self._browser_by_user: dict[int, str] = {}
+        self._user_by_browser: dict[str, int] = {}
+        self._selective: dict[int, set[int]] = {}
+        self._exclusions: set[tuple[int, int]] = set()
+        self._assignments: dict[int, set[int]] = {}
+        # user_id -> {(ratee_id, metric_id): value}
+        self._drafts: dict[int, dict[tuple[int, int], str]] = {}
+
+    def _bump(self, *tables):
+        for table in tables:
+            self._versions[table] += 1
+
+    # Lifecycle
+
+    def exists(self) -> bool:
+        return self._created
+
+    def initialize(self) -> None:
+        self._created = True
+
+    def migrate_schema(self) -> int:
+        return LATEST_SCHEMA_VERSION
+
+    def get_schema_version(self) -> int:
+        return LATEST_SCHEMA_VERSION
+
+    def delete_all_data(self) -> None:
+        # The versions carry on, so that whatever got cached off the old data turns stale
+        with self._lock:
+            self._clear()
+            self._bump(*VERSIONED_TABLES)
+
+    def rebuild_rating_aggregates(self) -> None:
+        with self._lock:
+            self._aggregates.clear()
+            self._rated.clear()
+            for (ratee_id, metric_id), scores in self._ratings.items():
+                for reviewer_id, score in scores.items():
+                    self._add_to_aggregates(reviewer_id, ratee_id, metric_id, score)
+            self._bump("ratings", "assignments")
+
+    def get_data_versions(self) -> dict[str, int]:
+        return dict(self._versions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._usernames), "metrics": len(self._metric_names),
+                    "ratings": sum(len(scores) for scores in self._ratings.values())}
+
+    # Users, metrics and assignments
+
+    def insert_all_data(self, user_data=(), metric_data=(), rating_data=(), auth_data=(), assignment_data=(),
+                        exclusion_data=(), upsert=False) -> None:
+        """
+        As `db_queries.insert_all_data`. Conflicts on the unique keys raise `sqlite3.IntegrityError` (unless upserting),
+        as the DB does, before anything got written
+        """
+        with self._lock:
+            user_data, metric_data, rating_data = list(user_data), list(metric_data), list(rating_data)
+            if not upsert:
+                self._check_unique(user_data, metric_data, rating_data, auth_data)
+            for score in (row[3] for row in rating_data):
+                if score is not None and not 1 <= score <= 10:
+                    raise sqlite3.IntegrityError("CHECK constraint failed: score >= 1 AND score <= 10")
+
+            if user_data:
+                for name, username in user_data:
+                    if username not in self._user_ids and name not in self._user_name_ids:
+                        self._usernames.append(username)
+                        self._user_names.append(name)
+                        self._user_ids[username] = self._user_name_ids[name] = len(self._usernames)
+                self._bump("users")
+            if metric_data:
+                for name, description in metric_data:
+                    if name in self._metric_ids:
+                        self._metric_descriptions[self._metric_ids[name] - 1] = description
+                    else:
+                        self._metric_names.append(name)
+                        self._metric_descriptions.append(description)
+                        self._metric_ids[name] = len(self._metric_names)
+                self._bump("metrics")
+            if rating_data:
+                self._upsert_ratings(rating_data)
+            if auth_data:
+                user_id, browser_id = auth_data
+                if user_id not in self._browser_by_user and browser_id not in self._user_by_browser:
+                    self._register(user_id, browser_id)
+            if assignment_data:
+                for reviewer_id, ratee_id in self._resolve_pairs(assignment_data):
+                    self._selective.setdefault(reviewer_id, set()).add(ratee_id)
+                self._bump("review_assignments")
+            if exclusion_data:
+                self._exclusions.update(self._resolve_pairs(exclusion_data))
+
+    def _check_unique(self, user_data, metric_data, rating_data, auth_data):
+        usernames = [username for _, username in user_data]
+        names = [name for name, _ in user_data]
+        metrics = [name for name, _ in metric_data]
+        keys = [tuple(row[:3]) for row in rating_data]
+        conflicts = (
+            ("users.username", usernames, self._user_ids),
+            ("users.name", names, self._user_name_ids),
+            ("metrics.name", metrics, self._metric_ids),
+            ("ratings.user_id, ratings.ratee_id, ratings.metric_id", keys, set(self._iter_rating_keys(keys))),
+        )
+        for column, values, existing in conflicts:
+            if len(set(values)) != len(values) or any(value in existing for value in values):
+                raise sqlite3.IntegrityError(f"UNIQUE constraint failed: {column}")
+        if auth_data and self._browser_by_user.get(auth_data[0]) == auth_data[1]:
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: user_auth.user_id, user_auth.browser_uuid")
+
+    def _iter_rating_keys(self, keys):
+        """The ones of `keys` (user_id, ratee_id, metric_id) rated already"""
+        for user_id, ratee_id, metric_id in keys:
+            ratings = self._ratings.get((ratee_id, metric_id))
+            if ratings is not None and user_id in ratings:
+                yield user_id, ratee_id, metric_id
+
+    def _resolve_pairs(self, username_pairs):
+        # Usernames not among the users are skipped, as the DB's insert-select does
+        for reviewer, ratee in username_pairs:
+            if reviewer in self._user_ids and ratee in self._user_ids:
+                yield self._user_ids[reviewer], self._user_ids[ratee]
+
+    def get_registry_rows(self):
+        with self._lock:
+            user_rows = [(idx, username, name)
+                         for idx, (username, name) in enumerate(zip(self._usernames, self._user_names), 1)]
+            assignments = {}
+            for reviewer_id, ratee_ids in sorted(self._assignments.items()):
+                if ratee_ids:
+                    assignments[self._usernames[reviewer_id - 1]] = [self._usernames[ratee_id - 1]
+                                                                     for ratee_id in sorted(ratee_ids)]
+            return user_rows, dict(self._metric_ids), assignments
+
+    def get_user_ids(self) -> list[int]:
+        return list(range(1, len(self._usernames) + 1))
+
+    def get_user_to_id_map(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._user_ids)
+
+    def get_metric_to_id_map(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._metric_ids)
+
+    def get_metric_id(self, metric_name) -> int:
+        try:
+            return self._metric_ids[metric_name]
+        except KeyError:
+            raise Exception(f"Metric with name '{metric_name}' does not exist.") from None
+
+    def get_assignment_inputs(self) -> AssignmentInputs:
+        with self._lock:
+            return AssignmentInputs(
+                user_ids=self.get_user_ids(),
+                selective={reviewer_id: sorted(ratee_ids)
+                           for reviewer_id, ratee_ids in sorted(self._selective.items())},
+                exclusions=set(self._exclusions),
+                existing={(reviewer_id, ratee_id) for reviewer_id, ratee_ids in self._assignments.items()
+                          for ratee_id in ratee_ids},
+            )
+
+    def save_assignments(self, pairs, replace=False) -> None:
+        with self._lock:
+            if replace:
+                self._assignments.clear()
+            for reviewer_id, ratee_id in pairs:
+                self._assignments.setdefault(reviewer_id, set()).add(ratee_id)
+            self._bump("assignments")
+
+    # Auth
+
+    def _register(self, user_id, browser_id):
+        self._browser_by_user[user_id] = browser_id
+        self._user_by_browser[browser_id] = user_id
+        self._bump("user_auth")
+
+    def get_reviewer_by_browser(self, browser_id) -> str | None:
+        user_id = self._user_by_browser.get(browser_id)
+        return self._user_names[user_id - 1] if user_id is not None else None
+
+    def get_browser_by_user(self, user_id) -> str | None:
+        return self._browser_by_user.get(user_id)
+
+    def register_browser(self, user_id, browser_id) -> bool:
+        with self._lock:
+            if user_id in self._browser_by_user or browser_id in self._user_by_browser:
+                return False
+            self._register(user_id, browser_id)
+            return True
+
+    def get_initialized_user_requests(self) -> dict[str, str]:
+        with self._lock:
+            return {self._user_names[user_id - 1]: browser_id for user_id, browser_id in self._browser_by_user.items()}
+
+    # Ratings
+
+    def _add_to_aggregates(self, reviewer_id, ratee_id, metric_id, score):
+        aggregate = self._aggregates.setdefault((ratee_id, metric_id, reviewer_id == ratee_id),
+                                                [0, 0, 0.0, 0.0, None, None])
+        aggregate[0] += 1
+        if not math.isnan(score):
+            aggregate[1] += 1
+            aggregate[2] += score
+            aggregate[3] += score * score
+            aggregate[4] = score if aggregate[4] is None else min(aggregate[4], score)
+            aggregate[5] = score if aggregate[5] is None else max(aggregate[5], score)
+        rated = self._rated.setdefault(reviewer_id, {})
+        rated[ratee_id] = rated.get(ratee_id, 0) + 1
+
+    def _replace_in_aggregates(self, reviewer_id, ratee_id, metric_id, old_score, score):
+        is_self = reviewer_id == ratee_id
+        aggregate = self._aggregates[(ratee_id, metric_id, is_self)]
+        if not math.isnan(old_score):
+            aggregate[1] -= 1
+            aggregate[2] -= old_score
+            aggregate[3] -= old_score * old_score
+        if not math.isnan(score):
+            aggregate[1] += 1
+            aggregate[2] += score
+            aggregate[3] += score * score
+        # The minimum and maximum can't be taken back, so they get recomputed off the ratee's scores on the metric
+        kept = [value for other_id, value in self._ratings[(ratee_id, metric_id)].items()
+                if (other_id == ratee_id) == is_self and not math.isnan(value)]
+        aggregate[4], aggregate[5] = (min(kept), max(kept)) if kept else (None, None)
+
+    def _upsert_ratings(self, rating_rows):
+        for user_id, ratee_id, metric_id, score in rating_rows:
+            score = UNRATED if score is None else float(score)
+            scores = self._ratings.setdefault((ratee_id, metric_id), {})
+            old_score = scores.get(user_id)
+            scores[user_id] = score
+            if old_score is None:
+                self._add_to_aggregates(user_id, ratee_id, metric_id, score)
+            else:
+                self._replace_in_aggregates(user_id, ratee_id, metric_id, old_score, score)
+        self._bump("ratings")
+
+    def submit_ratings(self, rating_rows) -> Future:
+        future = Future()
+        try:
+            self.insert_all_data(rating_data=rating_rows, upsert=True)
+        except Exception as err:
+            future.set_exception(err)
+        else:
+            future.set_result(None)
+        return future
+
+    def ratings_exist(self) -> bool:
+        return bool(self._ratings)
+
+    def get_reviewers_finalised_cols(self, reviewer_id) -> list[str]:
+        with self._lock:
+            return [self._usernames[ratee_id - 1] for ratee_id in self._rated.get(reviewer_id, ())]
+
+    def _iter_ratings(self):
+        """(user_id, ratee_id, metric_id, score) of all the ratings, in the order of (ratee_id, metric_id)"""
+        for ratee_id, metric_id in sorted(self._ratings):
+            for user_id, score in self._ratings[(ratee_id, metric_id)].items():
+                yield user_id, ratee_id, metric_id, score
+
+    def get_scored_rating_chunks(self, chunk_size=65536):
+        with self._lock:
+            rows = [row for row in self._iter_ratings() if not math.isnan(row[3])]
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+
+    def iter_export_ratings(self, ratees=None, reviewers=None, metrics=None, chunk_size=EXPORT_CHUNK_SIZE):
+        ratees, reviewers, metrics = (set(values) if values is not None else None
+                                      for values in (ratees, reviewers, metrics))
+        with self._lock:
+            rows = []
+            for user_id, ratee_id, metric_id, score in self._iter_ratings():
+                reviewer, ratee, metric = self._usernames[user_id - 1], self._usernames[ratee_id - 1], \
+                    self._metric_names[metric_id - 1]
+                if (ratees is None or ratee in ratees) and (reviewers is None or reviewer in reviewers) \
+                        and (metrics is None or metric in metrics):
+                    rows.append((reviewer, self._user_names[user_id - 1], ratee, self._user_names[ratee_id - 1], metric,
+                                 None if math.isnan(score) else score, user_id == ratee_id))
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+
+    # Drafts
+
+    def save_drafts(self, draft_rows) -> None:
+        with self._lock:
+            for user_id, ratee_id, metric_id, value in draft_rows:
+                if value != "":
+                    self._drafts.setdefault(user_id, {})[(ratee_id, metric_id)] = value
+                else:
+                    self._drafts.get(user_id, {}).pop((ratee_id, metric_id), None)
+
+    def get_drafts(self, user_id) -> dict[tuple[int, int], str]:
+        with self._lock:
+            return dict(self._drafts.get(user_id, {}))
+
+    def delete_drafts(self, user_id, ratee_id) -> None:
+        with self._lock:
+            drafts = self._drafts.get(user_id, {})
+            for key in [key for key in drafts if key[0] == ratee_id]:
+                del drafts[key]
+
+    # Aggregates
+
+    def get_average_scores(self, id_list):
+        reviewers_ratings = {id: {"ratings": {}, "self_rating": {}, "peer_stats": {}} for id in id_list}
+        with self._lock:
+            for ratee_id, ratee_ratings in reviewers_ratings.items():
+                for metric_id, metric in enumerate(self._metric_names, 1):
+                    for is_self in (False, True):
+                        aggregate = self._aggregates.get((ratee_id, metric_id, is_self))
+                        if aggregate is None:
+                            continue
+                        stats = get_score_stats(*aggregate[1:])
+                        if is_self:
+                            ratee_ratings["self_rating"][metric] = stats.mean
+                        else:
+                            ratee_ratings["ratings"][metric] = stats.mean
+                            ratee_ratings["peer_stats"][metric] = stats
+        return reviewers_ratings
+
+    def get_review_progress(self) -> list[ReviewProgress]:
+        with self._lock:
+            progress = []
+            for reviewer_id, ratee_ids in sorted(self._assignments.items()):
+                if ratee_ids:
+                    rated = self._rated.get(reviewer_id, {})
+                    progress.append(ReviewProgress(reviewer_id, len(ratee_ids),
+                                                   sum(rated.get(ratee_id, 0) for ratee_id in ratee_ids),
+                                                   len(self._metric_names)))
+            return progress
+
+    def iter_export_aggregates(self, ratees=None, metrics=None, chunk_size=EXPORT_CHUNK_SIZE):
+        ratees, metrics = (set(values) if values is not None else None for values in (ratees, metrics))
+        with self._lock:
+            rows = []
+            for ratee_id, metric_id, is_self in sorted(self._aggregates):
+                ratee, metric = self._usernames[ratee_id - 1], self._metric_names[metric_id - 1]
+                if (ratees is None or ratee in ratees) and (metrics is None or metric in metrics):
+                    aggregate = self._aggregates[(ratee_id, metric_id, is_self)]
+                    rows.append((ratee, self._user_names[ratee_id - 1], metric, is_self,
+                                 *get_score_stats(*aggregate[1:])))
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
@@ -0,0 +1,315 @@
+import sqlite3
+from db_storage.sqlite3_db_helper import SQLiteSession as SQLite3
+
+
+# Sums of `ratings` per ratee x metric, split in peer and self ratings. `rating_rows` counts every rating row while
+# `scored` only counts those having a score, which is what the mean, sums and min/max are over
+RATING_AGGREGATES_TABLE = """
+CREATE TABLE IF NOT EXISTS rating_aggregates (
+    ratee_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    is_self INTEGER NOT NULL,
+    rating_rows INTEGER NOT NULL,
+    scored INTEGER NOT NULL,
+    total REAL NOT NULL,
+    total_sq REAL NOT NULL,
+    minimum REAL,
+    maximum REAL,
+    PRIMARY KEY (ratee_id, metric_id, is_self)
+) WITHOUT ROWID;
+"""
+
+# Recomputes the whole table from `ratings`. Also used to backfill it on the migration
+REBUILD_RATING_AGGREGATES_SQL = """
+    INSERT INTO rating_aggregates (ratee_id, metric_id, is_self, rating_rows, scored, total, total_sq, minimum, maximum)
+    SELECT ratee_id, metric_id, user_id IS ratee_id, COUNT(*), COUNT(score), COALESCE(SUM(score), 0),
+           COALESCE(SUM(score * score), 0), MIN(score), MAX(score)
+    FROM ratings
+    GROUP BY ratee_id, metric_id, user_id IS ratee_id;
+"""
+
+# Adds the `{row}` (NEW or OLD) rating onto its aggregate
+_ADD_RATING = """
+    INSERT INTO rating_aggregates (ratee_id, metric_id, is_self, rating_rows, scored, total, total_sq, minimum, maximum)
+    VALUES ({row}.ratee_id, {row}.metric_id, {row}.user_id IS {row}.ratee_id, 1, {row}.score IS NOT NULL,
+            COALESCE({row}.score, 0), COALESCE({row}.score * {row}.score, 0), {row}.score, {row}.score)
+    ON CONFLICT (ratee_id, metric_id, is_self) DO UPDATE SET
+        rating_rows = rating_rows + 1,
+        scored = scored + excluded.scored,
+        total = total + excluded.total,
+        total_sq = total_sq + excluded.total_sq,
+        minimum = MIN(COALESCE(minimum, excluded.minimum), COALESCE(excluded.minimum, minimum)),
+        maximum = MAX(COALESCE(maximum, excluded.maximum), COALESCE(excluded.maximum, maximum));
+"""
+
+# Takes the `{row}` rating off its aggregate. The min/max only get looked up again (through idx_ratings_ratee_metric)
+# when the removed score was the min/max itself, and an aggregate left without any rating row is dropped
+_REMOVE_RATING = """
+    UPDATE rating_aggregates SET
+        rating_rows = rating_rows - 1,
+        scored = scored - ({row}.score IS NOT NULL),
+        total = total - COALESCE({row}.score, 0),
+        total_sq = total_sq - COALESCE({row}.score * {row}.score, 0),
+        minimum = CASE WHEN {row}.score IS NULL OR {row}.score > minimum THEN minimum ELSE (
+            SELECT MIN(score) FROM ratings
+            WHERE ratee_id = {row}.ratee_id AND metric_id = {row}.metric_id AND (user_id IS ratee_id) = is_self
+        ) END,
+        maximum = CASE WHEN {row}.score IS NULL OR {row}.score < maximum THEN maximum ELSE (
+            SELECT MAX(score) FROM ratings
+            WHERE ratee_id = {row}.ratee_id AND metric_id = {row}.metric_id AND (user_id IS ratee_id) = is_self
+        ) END
+    WHERE ratee_id = {row}.ratee_id AND metric_id = {row}.metric_id AND is_self = ({row}.user_id IS {row}.ratee_id);
+    DELETE FROM rating_aggregates
+    WHERE ratee_id = {row}.ratee_id AND metric_id = {row}.metric_id AND is_self = ({row}.user_id IS {row}.ratee_id)
+        AND rating_rows = 0;
+"""
+
+RATING_AGGREGATES_SCHEMA = f"""
+{RATING_AGGREGATES_TABLE}
+
+CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_insert AFTER INSERT ON ratings
+BEGIN
+    {_ADD_RATING.format(row="NEW")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_delete AFTER DELETE ON ratings
+BEGIN
+    {_REMOVE_RATING.format(row="OLD")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_update AFTER UPDATE OF user_id, ratee_id, metric_id, score ON ratings
+BEGIN
+    {_REMOVE_RATING.format(row="OLD")}
+    {_ADD_RATING.format(row="NEW")}
+END;
+
+DELETE FROM rating_aggregates;
+{REBUILD_RATING_AGGREGATES_SQL}
+"""
+
+# Tables having a version number that any insert, update or delete on them bumps. Reading the versions is one tiny
+# lookup, which tells whether anything derived from a table needs to be queried again, from any process
+# Tables versioned by migration 4. The tables added later on get versioned by their own migration
+VERSIONED_TABLES = ("users", "metrics", "ratings", "user_auth")
+
+
+def _version_triggers(table) -> str:
+    return "".join(f"""
+CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()} AFTER {event} ON {table}
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+END;
+""" for event in ("INSERT", "UPDATE", "DELETE"))
+
+
+DATA_VERSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+""" + "".join(f"""
+INSERT OR IGNORE INTO data_versions (name) VALUES ('{table}');
+{_version_triggers(table)}""" for table in VERSIONED_TABLES)
+
+
+# Who reviews whom, for the reviewers that only review the ones assigned to them (and aren't reviewed by anyone else)
+REVIEW_ASSIGNMENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_assignments (
+    reviewer_id INTEGER NOT NULL,
+    ratee_id INTEGER NOT NULL,
+    PRIMARY KEY (reviewer_id, ratee_id),
+    FOREIGN KEY (reviewer_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (ratee_id) REFERENCES users(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO data_versions (name) VALUES ('review_assignments');
+""" + _version_triggers("review_assignments")
+
+
+# Who reviews whom, as generated by `assignments.py` out of the users, the `review_assignments` and the
+# `review_exclusions`. Existing DBs keep the rule they had so far: everyone reviews everyone, themselves included, but
+# the selective reviewers, who review only the ones assigned to them, and aren't reviewed by anyone else
+ASSIGNMENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assignments (
+    reviewer_id INTEGER NOT NULL,
+    ratee_id INTEGER NOT NULL,
+    PRIMARY KEY (reviewer_id, ratee_id),
+    FOREIGN KEY (reviewer_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (ratee_id) REFERENCES users(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS review_exclusions (
+    reviewer_id INTEGER NOT NULL,
+    ratee_id INTEGER NOT NULL,
+    PRIMARY KEY (reviewer_id, ratee_id),
+    FOREIGN KEY (reviewer_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (ratee_id) REFERENCES users(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO assignments (reviewer_id, ratee_id)
+    SELECT reviewer_id, ratee_id FROM review_assignments;
+INSERT OR IGNORE INTO assignments (reviewer_id, ratee_id)
+    SELECT reviewer.id, ratee.id FROM users reviewer, users ratee
+    WHERE reviewer.id NOT IN (SELECT reviewer_id FROM review_assignments)
+        AND ratee.id NOT IN (SELECT reviewer_id FROM review_assignments);
+
+INSERT OR IGNORE INTO data_versions (name) VALUES ('assignments');
+""" + _version_triggers("assignments")
+
+
+# Rating rows in on each assignment, and their totals per reviewer, so that the progress of every reviewer is a read
+# of one row each. Assignments that predate a rating get its rows counted in when added
+RECOUNT_ASSIGNMENT_RATINGS_SQL = """
+    UPDATE assignments SET rated = (
+        SELECT COUNT(*) FROM ratings WHERE user_id = assignments.reviewer_id AND ratee_id = assignments.ratee_id
+    );
+"""
+
+REBUILD_REVIEW_PROGRESS_SQL = """
+    INSERT INTO review_progress (reviewer_id, assigned, rated)
+    SELECT reviewer_id, COUNT(*), SUM(rated) FROM assignments GROUP BY reviewer_id;
+"""
+
+_COUNT_RATING = """
+    UPDATE assignments SET rated = rated {sign} 1 WHERE reviewer_id = {row}.user_id AND ratee_id = {row}.ratee_id;"""
+
+REVIEW_PROGRESS_SCHEMA = f"""
+ALTER TABLE assignments ADD COLUMN rated INTEGER NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS review_progress (
+    reviewer_id INTEGER PRIMARY KEY,
+    assigned INTEGER NOT NULL DEFAULT 0,
+    rated INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (reviewer_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+{RECOUNT_ASSIGNMENT_RATINGS_SQL}
+{REBUILD_REVIEW_PROGRESS_SQL}
+
+CREATE TRIGGER IF NOT EXISTS trg_ratings_progress_insert AFTER INSERT ON ratings
+BEGIN
+    {_COUNT_RATING.format(sign="+", row="NEW")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ratings_progress_delete AFTER DELETE ON ratings
+BEGIN
+    {_COUNT_RATING.format(sign="-", row="OLD")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ratings_progress_update AFTER UPDATE OF user_id, ratee_id ON ratings
+BEGIN
+    {_COUNT_RATING.format(sign="-", row="OLD")}
+    {_COUNT_RATING.format(sign="+", row="NEW")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_assignments_progress_insert AFTER INSERT ON assignments
+BEGIN
+    INSERT INTO review_progress (reviewer_id, assigned) VALUES (NEW.reviewer_id, 1)
+        ON CONFLICT(reviewer_id) DO UPDATE SET assigned = assigned + 1;
+    UPDATE assignments SET rated = (
+        SELECT COUNT(*) FROM ratings WHERE user_id = NEW.reviewer_id AND ratee_id = NEW.ratee_id
+    ) WHERE reviewer_id = NEW.reviewer_id AND ratee_id = NEW.ratee_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_assignments_progress_delete AFTER DELETE ON assignments
+BEGIN
+    UPDATE review_progress SET assigned = assigned - 1, rated = rated - OLD.rated WHERE reviewer_id = OLD.reviewer_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_assignments_progress_update AFTER UPDATE OF rated ON assignments
+BEGIN
+    UPDATE review_progress SET rated = rated + NEW.rated - OLD.rated WHERE reviewer_id = NEW.reviewer_id;
+END;
+
+-- The counts changing with every rating aren't a change of who reviews whom, which the version stands for
+DROP TRIGGER IF EXISTS trg_assignments_version_update;
+CREATE TRIGGER IF NOT EXISTS trg_assignments_version_update AFTER UPDATE OF reviewer_id, ratee_id ON assignments
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE name = 'assignments';
+END;
+"""
+
+
+# Cells of the review grids filled in but not submitted yet, as typed (so not necessarily valid scores), written by
+# `db_storage.drafts.DraftWriter`. Not versioned, as nothing gets derived from them
+DRAFTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    user_id INTEGER NOT NULL,
+    ratee_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, ratee_id, metric_id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (ratee_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (metric_id) REFERENCES metrics(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+"""
+
+
+# Schema changes on top of `intial_table_queries`, applied in order. The position in the tuple (starting at 1) is the
+# schema version it brings the DB to, which gets recorded in `PRAGMA user_version`. Only ever append to it
+MIGRATIONS = (
+    # 1: Covering index for the ratee side of `ratings` (averaging, per ratee x metric lookups). The reviewer side
+    # .. (user_id -> ratee_id -> metric_id) is already covered by the index of UNIQUE(user_id, ratee_id, metric_id)
+    """
+    CREATE INDEX IF NOT EXISTS idx_ratings_ratee_metric ON ratings (ratee_id, metric_id, user_id, score);
+    """,
+    # 2: `rating_aggregates`, kept current by the triggers on `ratings`
+    RATING_AGGREGATES_SCHEMA,
+    # 3: Lookup of the reviewer logged in on a browser. The primary key of `user_auth` only serves the user_id side
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_auth_browser ON user_auth (browser_uuid, user_id);
+    """,
+    # 4: `data_versions`, bumped by every write on the versioned tables
+    DATA_VERSIONS_SCHEMA,
+    # 5: `review_assignments`, in place of `config.SELECTIVE_REVIEWERS`
+    REVIEW_ASSIGNMENTS_SCHEMA,
+    # 6: `assignments` and `review_exclusions`, of the assignment engine
+    ASSIGNMENTS_SCHEMA,
+    # 7: `review_progress`, and the rating counts of the `assignments`, kept current by the triggers
+    REVIEW_PROGRESS_SCHEMA,
+    # 8: `drafts`, the unsubmitted cells of the review grids
+    DRAFTS_SCHEMA,
+)
+
+LATEST_SCHEMA_VERSION = len(MIGRATIONS)
+REVIEW_ASSIGNMENTS_VERSION = MIGRATIONS.index(REVIEW_ASSIGNMENTS_SCHEMA) + 1
+
+
+def get_schema_version(cursor) -> int:
+    cursor.execute("PRAGMA user_version;")
+    return cursor.fetchone()[0]
+
+
+def split_statements(script) -> list[str]:
+    """The statements of a migration script, each trigger with its body being one, to run them one at a time"""
+    statements, statement = [], ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ""
+    if statement.strip():
+        statements.append(statement.strip())
+    return statements
+
+
+def apply_migrations(db_path) -> int:
+    """
+    Applies the migrations that the DB at `db_path` is missing, each one in its own transaction. The version is read
+    again once holding the write lock, so that of the processes migrating the DB at once, only one applies each step
+    """
+    with SQLite3(db_path) as (conn, cursor):
+        version = get_schema_version(cursor)
+        while version < LATEST_SCHEMA_VERSION:
+            # `executescript` would commit before running, so the statements get run one by one within the transaction
+            cursor.execute("BEGIN IMMEDIATE;")
+            version = get_schema_version(cursor)
+            if version < LATEST_SCHEMA_VERSION:
+                for statement in split_statements(MIGRATIONS[version]):
+                    cursor.execute(statement)
+                version += 1
+                cursor.execute(f"PRAGMA user_version = {version};")
+            conn.commit()
+    return version
@@ -0,0 +1,230 @@
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from config import SQL_PROFILING, SLOW_QUERY_MS, SLOW_QUERY_LOG
+
+_enabled = SQL_PROFILING or os.environ.get("METRIC_REVIEW_SQL_PROFILING") == "1"
+
+# Statement shapes listed in the summary printed on exit, the costliest (by total time) first
+SUMMARY_ROWS = 25
+# Frames of these files are skipped when looking for the function that ran a statement
+_INTERNAL_FILES = {os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), "sqlite3_db_helper.py")}
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_PLANNED_RE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+def normalize_sql(sql) -> str:
+    """Statement shape: literals made into `?`, lists of placeholders collapsed, and whitespace squeezed"""
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _IN_LIST_RE.sub("IN (?, ...)", sql)
+    return _SPACE_RE.sub(" ", sql).strip().rstrip(";")
+
+
+def get_caller() -> str:
+    """`module.function` of the nearest frame outside of the DB session and the profiler, e.g. a `db_queries` function"""
+    frame = sys._getframe(1)
+    while frame is not None and os.path.abspath(frame.f_code.co_filename) in _INTERNAL_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}"
+
+
+class StatementStats:
+    __slots__ = ("calls", "seconds", "max_seconds", "rows", "params", "callers", "plan")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.params = 0
+        self.callers = Counter()
+        self.plan = None
+
+
+class SQLProfiler:
+    """Per-process statistics of every statement run through `SQLiteSession`, by statement shape"""
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_query_log=SLOW_QUERY_LOG):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self._lock = threading.Lock()
+        self.statements: dict[str, StatementStats] = {}
+
+    def is_new_shape(self, shape) -> bool:
+        return shape not in self.statements
+
+    def record(self, shape, seconds, rows, params, caller, plan=None) -> None:
+        with self._lock:
+            stats = self.statements.get(shape)
+            if stats is None:
+                stats = self.statements[shape] = StatementStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows
+            stats.params = max(stats.params, params)
+            stats.callers[caller] += 1
+            if plan is not None:
+                stats.plan = plan
+            if self.slow_query_log and seconds * 1000 >= self.slow_query_ms:
+                self._log_slow(shape, seconds, rows, params, caller)
+
+    def _log_slow(self, shape, seconds, rows, params, caller) -> None:
+        entry = {"at": time.strftime("%Y-%m-%dT%H:%M:%S"), "ms": round(seconds * 1000, 3), "caller": caller,
+                 "statement": shape, "params": params, "rows": rows, "pid": os.getpid()}
+        with open(self.slow_query_log, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+
+    def summary(self) -> list[dict]:
+        with self._lock:
+            return [{"statement": shape, "calls": stats.calls, "total_ms": stats.seconds * 1000,
+                     "mean_ms": stats.seconds * 1000 / stats.calls, "max_ms": stats.max_seconds * 1000,
+                     "rows": stats.rows, "params": stats.params, "callers": dict(stats.callers), "plan": stats.plan}
+                    for shape, stats in sorted(self.statements.items(), key=lambda item: -item[1].seconds)]
+
+    def format_summary(self, limit=SUMMARY_ROWS) -> str:
+        rows = self.summary()
+        lines = [f"SQL profile of process {os.getpid()}: {len(rows)} statement shapes",
+                 f"{'calls':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9} {'rows':>9}  caller / statement"]
+        for row in rows[:limit]:
+            callers = ", ".join(f"{caller} x{count}" for caller, count in Counter(row["callers"]).most_common(3))
+            lines.append(f"{row['calls']:>7} {row['total_ms']:>10.2f} {row['mean_ms']:>9.3f} {row['max_ms']:>9.3f} "
+                         f"{row['rows']:>9}  {callers}")
+            lines.append(f"{'':>49}{row['statement'][:120]}")
+            if row["plan"]:
+                lines.append(f"{'':>49}plan: {' | '.join(row['plan'])}")
+        return "\n".join(lines)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.statements.clear()
+
+
+profiler = SQLProfiler()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+class ProfilingCursor:
+    """
+    Stands in for the `sqlite3.Cursor` of a `SQLiteSession` while profiling. A statement's time covers its execution
+    and the fetching of its rows, so it gets recorded once the next statement starts, or the cursor gets closed.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pending = None
+
+    def __getattr__(self, name):
+        # rowcount, lastrowid, description, arraysize...
+        return getattr(self._cursor, name)
+
+    def _start(self, sql, params, many=False):
+        self._finish()
+        shape = normalize_sql(sql)
+        plan = None
+        if profiler.is_new_shape(shape) and _PLANNED_RE.match(sql):
+            plan = self._explain(sql, params[0] if many and params else params)
+        param_count = len(params) if not many else len(params) * (len(params[0]) if params else 0)
+        self._pending = [shape, param_count, get_caller(), plan, 0, time.perf_counter(), 0.0]
+
+    def _explain(self, sql, params):
+        try:
+            rows = self._cursor.connection.execute(f"EXPLAIN QUERY PLAN {sql}", params or ()).fetchall()
+        except Exception as err:
+            return [f"(not explained: {err})"]
+        return [row[-1] for row in rows]
+
+    def _elapsed(self):
+        # Time since the last call into the cursor, which is added onto the pending statement
+        started = self._pending[5]
+        self._pending[6] += time.perf_counter() - started
+
+    def _finish(self):
+        if self._pending is not None:
+            shape, param_count, caller, plan, rows, _, seconds = self._pending
+            self._pending = None
+            profiler.record(shape, seconds, rows, param_count, caller, plan)
+
+    def _run(self, method, *args):
+        try:
+            return method(*args)
+        finally:
+            self._elapsed()
+
+    def execute(self, sql, params=()):
+        self._start(sql, params)
+        self._run(self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        # Listed up front, so that the first row can be explained and the rows counted
+        seq_of_params = list(seq_of_params)
+        self._start(sql, seq_of_params, many=True)
+        self._run(self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def executescript(self, sql_script):
+        self._start(sql_script, ())
+        self._run(self._cursor.executescript, sql_script)
+        return self
+
+    def _fetched(self, method, *args):
+        if self._pending is None:
+            return method(*args)
+        self._pending[5] = time.perf_counter()
+        result = self._run(method, *args)
+        self._pending[4] += len(result) if isinstance(result, list) else int(result is not None)
+        return result
+
+    def fetchone(self):
+        return self._fetched(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetched(self._cursor.fetchmany, size if size is not None else self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._fetched(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+
+def record_commit(seconds) -> None:
+    """Commits are where a writer waits for the lock of the DB, so they get recorded as statements of their own"""
+    profiler.record("COMMIT", seconds, 0, 0, get_caller())
+
+
+@atexit.register
+def _print_summary_on_exit():
+    if _enabled and profiler.statements:
+        print(profiler.format_summary())
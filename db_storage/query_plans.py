@@ -0,0 +1,89 @@
+import re
+import sqlite3
+from db_storage import db_queries
+from db_storage.migrations import MIGRATIONS
+
+# Tables that grow faster than the roster (with the ratings, drafts and assignments of a sprint), and hence should
+# never be read through a full table scan. `users`, `metrics`, `user_auth` and `review_progress` stay roster-sized,
+# and the queries on them read every row by design
+GROWING_TABLES = ("ratings", "drafts", "rating_aggregates", "assignments", "review_assignments", "review_exclusions")
+
+# Statements that go through all of a growing table by design, by `*_SQL` constant or by the `db_queries` function
+# running them (for the SQL built inline), along with the reason
+INTENDED_FULL_SCANS = {
+    "RECOUNT_ASSIGNMENT_RATINGS_SQL": "recounts the ratings of every assignment",
+    "REBUILD_REVIEW_PROGRESS_SQL": "recomputes the progress of every reviewer from all the assignments",
+    "ASSIGNMENT_INPUTS_SQL": "the assignment engine works on all the assignments and exclusions at once",
+    "REGISTRY_ROWS_SQL": "the registry holds every assignment",
+    "EXPORT_AGGREGATES_SQL": "exports all the aggregates, unless filtered",
+    "db_queries.initialize_tables_for_db": "creates the schema, and backfills the tables added by the migrations",
+    "db_queries.migrate_schema": "backfills the tables added by the migrations",
+    "db_queries.rebuild_rating_aggregates": "clears the derived tables before recomputing them",
+    "db_queries.delete_all_db_data": "clears every table",
+    "db_queries.save_assignments": "clears all the assignments when replacing them",
+}
+
+_STATEMENT_RE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+_NEW_OLD_RE = re.compile(r"\b(?:NEW|OLD)\.\w+")
+
+
+def get_queries() -> dict[str, str]:
+    """All the statements declared in `db_queries`, i.e. its `*_SQL` constants that read or write rows"""
+    return {
+        name: sql for name, sql in vars(db_queries).items()
+        if name.endswith("_SQL") and isinstance(sql, str) and _STATEMENT_RE.match(sql)
+    }
+
+
+def get_trigger_statements(conn) -> dict[str, str]:
+    """The statements run by the triggers of the schema, by `<trigger>#<n>`, with their NEW/OLD columns as placeholders"""
+    statements = {}
+    for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name;"):
+        body = sql[sql.upper().index("BEGIN") + len("BEGIN"):sql.upper().rindex("END")]
+        for idx, statement in enumerate((part for part in body.split(";") if part.strip()), 1):
+            statements[f"{name}#{idx}"] = _NEW_OLD_RE.sub("?", statement)
+    return statements
+
+
+def create_schema_db() -> sqlite3.Connection:
+    """In-memory DB with the full current schema, to get the query plans against"""
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(db_queries.intial_table_queries)
+    for script in MIGRATIONS:
+        conn.executescript(script)
+    return conn
+
+
+def get_query_plan(conn, sql) -> list[str]:
+    # Every placeholder is bound to NULL, as only the plan is of interest and not the rows. Numbered ones (?1) can be
+    # used more than once, and take as many parameters as their highest number
+    numbered = [int(number) for number in re.findall(r"\?(\d+)", sql)]
+    parameters = max(numbered) if numbered else sql.count("?")
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def get_full_scans(plan, tables=GROWING_TABLES) -> list[str]:
+    """The steps of the plan that scan all of any of `tables`"""
+    # A scan that walks a covering index never touches the table rows, which is fine for the queries that aggregate
+    # over every reviewer. Any other SCAN (bare, or through a non-covering index) visits each row of the table
+    scan_pattern = re.compile(rf"^SCAN ({'|'.join(map(re.escape, tables))})\b(?! USING COVERING INDEX)")
+    return [step for step in plan if scan_pattern.search(step)]
+
+
+def find_full_scans(tables=GROWING_TABLES) -> tuple[dict[str, list[str]], int]:
+    """
+    Returns the statements of `db_queries` and of the triggers (by name) having an unintended full table scan on any
+    of `tables`, along with their plan, and the number of statements checked
+    """
+    conn = create_schema_db()
+    try:
+        statements = {**get_queries(), **get_trigger_statements(conn)}
+        full_scans = {}
+        for name, sql in statements.items():
+            plan = get_query_plan(conn, sql)
+            if name not in INTENDED_FULL_SCANS and get_full_scans(plan, tables):
+                full_scans[name] = plan
+        return full_scans, len(statements)
+    finally:
+        conn.close()
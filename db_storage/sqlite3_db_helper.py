@@ -1,24 +1,127 @@
 import sqlite3
+import threading
+import time
+from queue import LifoQueue, Empty, Full
+from db_storage import profiler
+
+
+# Pragmas applied once on every pooled connection. WAL lets readers run alongside the single writer,
+# `busy_timeout` makes a writer wait for the lock instead of failing straight away with `database is locked`,
+# and `synchronous=NORMAL` is durable enough under WAL while avoiding an fsync on every commit
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA busy_timeout=5000;",
+    "PRAGMA synchronous=NORMAL;",
+)
+
+# Number of idle connections kept open per database file
+POOL_SIZE = 8
+
+
+def connect(db_path) -> sqlite3.Connection:
+    """Open a connection with the pool pragmas applied. It may be handed across threads, but used by one at a time."""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Keeps long-lived connections to a single database file, handing each one to a single thread at a time."""
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self._idle = LifoQueue(maxsize=size)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return connect(self.db_path)
+
+    def release(self, conn) -> None:
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                # A connection that can't get out of its transaction is not to be handed out again
+                conn.close()
+                return
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path) -> ConnectionPool:
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_path, ConnectionPool(db_path))
+    return pool
+
+
+def close_pool(db_path=None) -> None:
+    """Close the idle connections of one database (or of all of them), e.g. before the file gets removed."""
+    with _pools_lock:
+        if db_path is None:
+            pools = list(_pools.values())
+            _pools.clear()
+        else:
+            pools = [_pools.pop(db_path)] if db_path in _pools else []
+    for pool in pools:
+        pool.close()
 
 
 class SQLiteSession:
+    """A pooled connection and a cursor on it, committed on exit. With profiling on, the cursor records every statement"""
+
     def __init__(self, db_path):
         self.db_path = db_path
         self.conn = None
         self.cursor = None
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
+        self.conn = get_pool(self.db_path).acquire()
         self.cursor = self.conn.cursor()
+        if profiler.is_enabled():
+            self.cursor = profiler.ProfilingCursor(self.cursor)
         return self.conn, self.cursor
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.conn is not None:
+        if self.conn is None:
+            return
+        try:
+            if self.cursor:
+                # Done ahead of the commit, so that the profiled statements don't take its time onto them
+                self.cursor.close()
+                self.cursor = None
             if exc_type:
                 self.conn.rollback()
             else:
-                self.conn.commit()
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
+                try:
+                    if profiler.is_enabled() and self.conn.in_transaction:
+                        started = time.perf_counter()
+                        self.conn.commit()
+                        profiler.record_commit(time.perf_counter() - started)
+                    else:
+                        self.conn.commit()
+                except Exception:
+                    # e.g. the DB stayed locked: the transaction is dropped rather than left open on the connection
+                    self.conn.rollback()
+                    raise
+        finally:
+            # The connection goes back to the pool instead of being closed
+            get_pool(self.db_path).release(self.conn)
+            self.conn = None
@@ -0,0 +1,318 @@
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Iterator
+from db_storage import db_queries
+from db_storage.db_queries import AssignmentInputs, ReviewProgress, ScoreStats, EXPORT_CHUNK_SIZE
+from exceptions import DatabaseDoesNotExist, InvalidStorageBackend
+
+
+class StorageBackend(ABC):
+    """
+    Everything the app, `bootstrap.py` and the benchmarks read and write: the users and metrics (the roster), the
+    review assignments, the browser logins (auth), the draft and submitted ratings, and the per ratee x metric
+    aggregates of the ratings. The users and metrics are referred to by their ids, as in the `db_queries` functions of
+    the same names, and the results come in the same shapes. `config.STORAGE_BACKEND` picks the implementation (see `get_storage`).
+    """
+
+    # Shown in the messages about the store, e.g. the DB file path
+    name: str
+
+    # Lifecycle
+
+    @abstractmethod
+    def exists(self) -> bool:
+        ...
+
+    def check_exists(self) -> None:
+        if not self.exists():
+            raise DatabaseDoesNotExist(f"Database '{self.name}' does not exist.")
+
+    @abstractmethod
+    def initialize(self) -> None:
+        """Creates the store at its latest schema version"""
+
+    @abstractmethod
+    def migrate_schema(self) -> int:
+        """Brings an existing store up to the latest schema version, and returns that version"""
+
+    @abstractmethod
+    def get_schema_version(self) -> int:
+        ...
+
+    @abstractmethod
+    def delete_all_data(self) -> None:
+        ...
+
+    @abstractmethod
+    def rebuild_rating_aggregates(self) -> None:
+        """Recomputes the aggregates and the review progress from the ratings and the assignments"""
+
+    @abstractmethod
+    def get_data_versions(self) -> dict[str, int]:
+        """Version of each table, which changes with any write on that table (by any process sharing the store)"""
+
+    def stats(self) -> dict:
+        """Counters of the store's own, e.g. of its background writer"""
+        return {}
+
+    def close(self) -> None:
+        """Writes whatever is still pending, and releases the store"""
+
+    # Users, metrics and assignments
+
+    @abstractmethod
+    def insert_all_data(self, user_data=(), metric_data=(), rating_data=(), auth_data=(), assignment_data=(),
+                        exclusion_data=(), upsert=False) -> None:
+        """As `db_queries.insert_all_data`, all or nothing"""
+
+    @abstractmethod
+    def get_registry_rows(self) -> tuple[list[tuple[int, str, str]], dict[str, int], dict[str, list[str]]]:
+        ...
+
+    @abstractmethod
+    def get_user_ids(self) -> list[int]:
+        ...
+
+    @abstractmethod
+    def get_user_to_id_map(self) -> dict[str, int]:
+        ...
+
+    @abstractmethod
+    def get_metric_to_id_map(self) -> dict[str, int]:
+        ...
+
+    @abstractmethod
+    def get_metric_id(self, metric_name) -> int:
+        ...
+
+    @abstractmethod
+    def get_assignment_inputs(self) -> AssignmentInputs:
+        ...
+
+    @abstractmethod
+    def save_assignments(self, pairs, replace=False) -> None:
+        ...
+
+    # Auth
+
+    @abstractmethod
+    def get_reviewer_by_browser(self, browser_id) -> str | None:
+        ...
+
+    @abstractmethod
+    def get_browser_by_user(self, user_id) -> str | None:
+        ...
+
+    @abstractmethod
+    def register_browser(self, user_id, browser_id) -> bool:
+        """Ties the browser to the user, unless either of them is already registered. Returns whether it got tied"""
+
+    @abstractmethod
+    def get_initialized_user_requests(self) -> dict[str, str]:
+        ...
+
+    # Ratings
+
+    @abstractmethod
+    def submit_ratings(self, rating_rows) -> Future:
+        """Upserts the (user_id, ratee_id, metric_id, score) rows of a review together. The future resolves to None"""
+
+    @abstractmethod
+    def ratings_exist(self) -> bool:
+        ...
+
+    @abstractmethod
+    def get_reviewers_finalised_cols(self, reviewer_id) -> list[str]:
+        ...
+
+    @abstractmethod
+    def get_scored_rating_chunks(self, chunk_size=65536) -> Iterator[list[tuple]]:
+        ...
+
+    @abstractmethod
+    def iter_export_ratings(self, ratees=None, reviewers=None, metrics=None,
+                            chunk_size=EXPORT_CHUNK_SIZE) -> Iterator[list[tuple]]:
+        ...
+
+    # Drafts
+
+    @abstractmethod
+    def save_drafts(self, draft_rows) -> None:
+        """Writes the (user_id, ratee_id, metric_id, value) cells together, an empty value removing the cell's draft"""
+
+    @abstractmethod
+    def get_drafts(self, user_id) -> dict[tuple[int, int], str]:
+        """{(ratee_id, metric_id): value} of the reviewer's drafts"""
+
+    @abstractmethod
+    def delete_drafts(self, user_id, ratee_id) -> None:
+        ...
+
+    # Aggregates
+
+    @abstractmethod
+    def get_average_scores(self, id_list) -> dict[int, dict[str, dict[str, float | ScoreStats]]]:
+        ...
+
+    @abstractmethod
+    def get_review_progress(self) -> list[ReviewProgress]:
+        ...
+
+    def get_counts_of_reviewed(self, registry) -> tuple[list[str], list[tuple[str, int]], list[str]]:
+        return db_queries.get_counts_of_reviewed(registry, self.get_review_progress())
+
+    @abstractmethod
+    def iter_export_aggregates(self, ratees=None, metrics=None, chunk_size=EXPORT_CHUNK_SIZE) -> Iterator[list[tuple]]:
+        ...
+
+
+class SQLiteStorage(StorageBackend):
+    """The SQLite file at `db_queries.DB_PATH`, through the `db_queries` functions and the submission writer"""
+
+    @property
+    def name(self) -> str:
+        return db_queries.get_current_db_path()
+
+    def exists(self) -> bool:
+        try:
+            db_queries.check_if_db_exists()
+        except DatabaseDoesNotExist:
+            return False
+        return True
+
+    def check_exists(self) -> None:
+        db_queries.check_if_db_exists()
+
+    def initialize(self) -> None:
+        db_queries.initialize_tables_for_db()
+
+    def migrate_schema(self) -> int:
+        return db_queries.migrate_schema()
+
+    def get_schema_version(self) -> int:
+        return db_queries.get_db_schema_version()
+
+    def delete_all_data(self) -> None:
+        db_queries.delete_all_db_data()
+
+    def rebuild_rating_aggregates(self) -> None:
+        db_queries.rebuild_rating_aggregates()
+
+    def get_data_versions(self) -> dict[str, int]:
+        return db_queries.get_data_versions()
+
+    def stats(self) -> dict:
+        from db_storage.writer import get_submission_writer
+        return get_submission_writer().stats()
+
+    def close(self) -> None:
+        from db_storage.drafts import shutdown_draft_writer
+        from db_storage.writer import shutdown_submission_writer
+        shutdown_draft_writer()
+        shutdown_submission_writer()
+
+    def insert_all_data(self, user_data=(), metric_data=(), rating_data=(), auth_data=(), assignment_data=(),
+                        exclusion_data=(), upsert=False) -> None:
+        db_queries.insert_all_data(user_data, metric_data, rating_data, auth_data, assignment_data, exclusion_data,
+                                   upsert)
+
+    def get_registry_rows(self):
+        return db_queries.get_registry_rows()
+
+    def get_user_ids(self) -> list[int]:
+        return db_queries.get_user_ids()
+
+    def get_user_to_id_map(self) -> dict[str, int]:
+        return db_queries.get_user_to_id_map()
+
+    def get_metric_to_id_map(self) -> dict[str, int]:
+        return db_queries.get_metric_to_id_map()
+
+    def get_metric_id(self, metric_name) -> int:
+        return db_queries.get_metric_id(metric_name)
+
+    def get_assignment_inputs(self) -> AssignmentInputs:
+        return db_queries.get_assignment_inputs()
+
+    def save_assignments(self, pairs, replace=False) -> None:
+        db_queries.save_assignments(pairs, replace)
+
+    def get_reviewer_by_browser(self, browser_id) -> str | None:
+        return db_queries.get_reviewer_by_browser(browser_id)
+
+    def get_browser_by_user(self, user_id) -> str | None:
+        return db_queries.get_browser_by_user(user_id)
+
+    def register_browser(self, user_id, browser_id) -> bool:
+        return db_queries.register_browser(user_id, browser_id)
+
+    def get_initialized_user_requests(self) -> dict[str, str]:
+        return db_queries.get_initialized_user_requests()
+
+    def submit_ratings(self, rating_rows) -> Future:
+        # Group-committed along with the other submissions of the process, by its single write connection
+        from db_storage.writer import get_submission_writer
+        return get_submission_writer().submit(rating_rows)
+
+    def ratings_exist(self) -> bool:
+        return db_queries.ratings_exist()
+
+    def get_reviewers_finalised_cols(self, reviewer_id) -> list[str]:
+        return db_queries.get_reviewers_finalised_cols(reviewer_id)
+
+    def get_scored_rating_chunks(self, chunk_size=65536):
+        return db_queries.get_scored_rating_chunks(chunk_size)
+
+    def iter_export_ratings(self, ratees=None, reviewers=None, metrics=None, chunk_size=EXPORT_CHUNK_SIZE):
+        return db_queries.iter_export_ratings(ratees, reviewers, metrics, chunk_size)
+
+    def save_drafts(self, draft_rows) -> None:
+        db_queries.save_drafts(draft_rows)
+
+    def get_drafts(self, user_id) -> dict[tuple[int, int], str]:
+        return db_queries.get_drafts(user_id)
+
+    def delete_drafts(self, user_id, ratee_id) -> None:
+        db_queries.delete_drafts(user_id, ratee_id)
+
+    def get_average_scores(self, id_list):
+        return db_queries.get_average_scores(id_list)
+
+    def get_review_progress(self) -> list[ReviewProgress]:
+        return db_queries.get_review_progress()
+
+    def iter_export_aggregates(self, ratees=None, metrics=None, chunk_size=EXPORT_CHUNK_SIZE):
+        return db_queries.iter_export_aggregates(ratees, metrics, chunk_size)
+
+
+def create_storage(backend) -> StorageBackend:
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "memory":
+        from db_storage.memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise InvalidStorageBackend(f"Unknown storage backend '{backend}', use one of: sqlite, memory")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """The process-wide store, of the `config.STORAGE_BACKEND` kind unless `set_storage` swapped it"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                from config import STORAGE_BACKEND
+                _storage = create_storage(STORAGE_BACKEND)
+    return _storage
+
+
+def set_storage(storage: StorageBackend | None) -> StorageBackend | None:
+    """Swaps the process-wide store (None to go back to the configured one), and returns the previous one"""
+    global _storage
+    with _storage_lock:
+        previous, _storage = _storage, storage
+    return previous
@@ -0,0 +1,233 @@
+import glob
+import json
+import os
+import pathlib
+import re
+import sqlite3
+from datetime import datetime
+from typing import NamedTuple
+from db_storage import db_queries
+from db_storage.db_queries import ScoreStats, get_score_stats
+from db_storage.sqlite3_db_helper import SQLiteSession as SQLite3
+from config import SPRINT_DB_PATTERN, SPRINT_DATE_FORMAT, TRENDS_CACHE_DB_NAME
+
+# Sprint DBs attached at once, within SQLite's limit of attached databases (10 by default)
+ATTACH_BATCH = 8
+
+# Per ratee x metric x sprint sums of the closed sprints, which never change once closed. The primary key clusters
+# the rows of a ratee's metric by sprint date, so a trend is a single range read
+TRENDS_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cached_sprints (
+    sprint TEXT PRIMARY KEY,
+    signature TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sprint_stats (
+    ratee TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    sprint_date TEXT NOT NULL,
+    sprint TEXT NOT NULL,
+    is_self INTEGER NOT NULL,
+    scored INTEGER NOT NULL,
+    total REAL NOT NULL,
+    total_sq REAL NOT NULL,
+    minimum REAL,
+    maximum REAL,
+    PRIMARY KEY (ratee, metric, sprint_date, sprint, is_self)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_sprint_stats_sprint ON sprint_stats (sprint);
+"""
+
+# Users and metrics are matched across the sprints by username and metric name, as their ids differ from DB to DB.
+# `{idx}` tells the sprint of a row within a batch, and `{schema}` is the sprint DB as attached
+_SPRINT_FILTERS = """
+    (?1 IS NULL OR ratee.username IN (SELECT value FROM json_each(?1)))
+    AND (?2 IS NULL OR metrics.name IN (SELECT value FROM json_each(?2)))"""
+
+_SPRINT_AGGREGATES_SELECT = """
+    SELECT {idx}, ratee.username, metrics.name, aggregates.is_self, aggregates.scored, aggregates.total,
+           aggregates.total_sq, aggregates.minimum, aggregates.maximum
+    FROM {schema}.rating_aggregates aggregates
+    JOIN {schema}.users ratee ON ratee.id = aggregates.ratee_id
+    JOIN {schema}.metrics metrics ON metrics.id = aggregates.metric_id
+    WHERE""" + _SPRINT_FILTERS
+
+# For the sprints that closed before `rating_aggregates` existed, and aren't migrated as they are only read
+_SPRINT_RATINGS_SELECT = """
+    SELECT {idx}, ratee.username, metrics.name, ratings.user_id IS ratings.ratee_id, COUNT(ratings.score),
+           COALESCE(SUM(ratings.score), 0), COALESCE(SUM(ratings.score * ratings.score), 0), MIN(ratings.score),
+           MAX(ratings.score)
+    FROM {schema}.ratings ratings
+    JOIN {schema}.users ratee ON ratee.id = ratings.ratee_id
+    JOIN {schema}.metrics metrics ON metrics.id = ratings.metric_id
+    WHERE""" + _SPRINT_FILTERS + """
+    GROUP BY ratings.ratee_id, ratings.metric_id, ratings.user_id IS ratings.ratee_id"""
+
+INSERT_SPRINT_STATS_SQL = """
+    INSERT INTO sprint_stats (ratee, metric, sprint_date, sprint, is_self, scored, total, total_sq, minimum, maximum)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+CACHED_SPRINTS_SQL = """
+    SELECT sprint, signature FROM cached_sprints;
+"""
+
+# Two statements, so that a filter by ratee reads the primary key ranges of those ratees only
+_CACHED_STATS_SELECT = """
+    SELECT ratee, metric, sprint_date, sprint, is_self, scored, total, total_sq, minimum, maximum
+    FROM sprint_stats
+    WHERE sprint IN (SELECT value FROM json_each(?1))
+      AND (?3 IS NULL OR metric IN (SELECT value FROM json_each(?3)))"""
+CACHED_STATS_SQL = _CACHED_STATS_SELECT + " AND ?2 IS NULL ORDER BY ratee, metric, sprint_date;"
+CACHED_STATS_BY_RATEE_SQL = _CACHED_STATS_SELECT + """
+      AND ratee IN (SELECT value FROM json_each(?2))
+    ORDER BY ratee, metric, sprint_date;"""
+
+
+class Sprint(NamedTuple):
+    name: str       # File name without the extension, e.g. sprint_06-06-2024
+    path: str
+    date: str       # ISO date out of the name, or "" when the name doesn't have one
+
+
+class TrendPoint(NamedTuple):
+    sprint: str
+    date: str
+    peer: ScoreStats
+    self_score: float | None
+
+
+def get_trends_cache_path() -> str:
+    return os.path.join(os.path.dirname(db_queries.DB_PATH), TRENDS_CACHE_DB_NAME)
+
+
+def parse_sprint_date(name) -> str:
+    match = re.search(r"\d+[-_.]\d+[-_.]\d+", name)
+    try:
+        return datetime.strptime(match.group(), SPRINT_DATE_FORMAT).date().isoformat() if match else ""
+    except ValueError:
+        return ""
+
+
+def list_sprints(directory=None) -> list[Sprint]:
+    """The sprint DBs next to the current one (or in `directory`), oldest first"""
+    directory = directory or os.path.dirname(db_queries.DB_PATH)
+    sprints = []
+    for path in glob.glob(os.path.join(directory, SPRINT_DB_PATTERN)):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if os.path.basename(path) != TRENDS_CACHE_DB_NAME:
+            sprints.append(Sprint(name, os.path.abspath(path), parse_sprint_date(name)))
+    return sorted(sprints, key=lambda sprint: (sprint.date, sprint.name))
+
+
+def is_closed(sprint) -> bool:
+    return sprint.path != os.path.abspath(db_queries.DB_PATH)
+
+
+def get_signature(sprint) -> str:
+    """Changes with any write onto the sprint DB, its WAL included, for a closed sprint that got reopened after all"""
+    parts = []
+    for path in (sprint.path, f"{sprint.path}-wal"):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+    return "/".join(parts)
+
+
+def read_sprint_stats(sprints, ratees=None, metrics=None) -> list[tuple]:
+    """
+    (sprint index, ratee, metric, is_self, scored, total, total_sq, minimum, maximum) rows of the sprints, read off
+    their DBs attached read-only `ATTACH_BATCH` at a time onto an in-memory connection, one query per batch
+    """
+    filters = (json.dumps(list(ratees)) if ratees is not None else None,
+               json.dumps(list(metrics)) if metrics is not None else None)
+    conn = sqlite3.connect(":memory:", uri=True)
+    batch_size = min(ATTACH_BATCH, conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED))
+    rows = []
+    try:
+        for start in range(0, len(sprints), batch_size):
+            batch = list(enumerate(sprints[start:start + batch_size], start))
+            selects = []
+            for idx, sprint in batch:
+                schema = f"sprint{idx - start}"
+                conn.execute(f"ATTACH DATABASE ? AS {schema};", (f"{pathlib.Path(sprint.path).as_uri()}?mode=ro",))
+                has_aggregates = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'rating_aggregates';")\
+                    .fetchone()
+                select = _SPRINT_AGGREGATES_SELECT if has_aggregates else _SPRINT_RATINGS_SELECT
+                selects.append(select.format(idx=idx, schema=schema))
+            try:
+                rows.extend(conn.execute(" UNION ALL ".join(selects), filters).fetchall())
+            finally:
+                for idx, _ in batch:
+                    conn.execute(f"DETACH DATABASE sprint{idx - start};")
+    finally:
+        conn.close()
+    return rows
+
+
+def cache_closed_sprints(sprints) -> None:
+    """Reads the closed sprints not cached yet (or changed since) onto the trends cache"""
+    cache_path = get_trends_cache_path()
+    with SQLite3(cache_path) as (_, cursor):
+        cursor.executescript(TRENDS_CACHE_SCHEMA)
+        cursor.execute(CACHED_SPRINTS_SQL)
+        cached = dict(cursor.fetchall())
+    signatures = {sprint.name: get_signature(sprint) for sprint in sprints}
+    stale = [sprint for sprint in sprints if cached.get(sprint.name) != signatures[sprint.name]]
+    if not stale:
+        return
+
+    rows = read_sprint_stats(stale)
+    with SQLite3(cache_path) as (_, cursor):
+        cursor.executemany("DELETE FROM sprint_stats WHERE sprint = ?;", [(sprint.name,) for sprint in stale])
+        cursor.executemany(INSERT_SPRINT_STATS_SQL, [(ratee, metric, stale[idx].date, stale[idx].name, *stats)
+                                                     for idx, ratee, metric, *stats in rows])
+        cursor.executemany("INSERT OR REPLACE INTO cached_sprints (sprint, signature) VALUES (?, ?);",
+                           [(sprint.name, signatures[sprint.name]) for sprint in stale])
+
+
+def read_cached_stats(sprints, ratees=None, metrics=None) -> list[tuple]:
+    """(ratee, metric, sprint date, sprint, is_self, *sums) rows of the cached sprints, in trend order"""
+    sql = CACHED_STATS_BY_RATEE_SQL if ratees is not None else CACHED_STATS_SQL
+    with SQLite3(get_trends_cache_path()) as (_, cursor):
+        cursor.execute(sql, (json.dumps([sprint.name for sprint in sprints]),
+                             json.dumps(list(ratees)) if ratees is not None else None,
+                             json.dumps(list(metrics)) if metrics is not None else None))
+        return cursor.fetchall()
+
+
+def get_trends(ratees=None, metrics=None, last=None, directory=None) -> dict[str, dict[str, list[TrendPoint]]]:
+    """
+    {ratee username: {metric name: [TrendPoint, ...]}} across the sprints, oldest first, for the given ratees and metrics
+    (None for all) and the `last` N sprints. The closed sprints come from the trends cache, filled in on first use,
+    while the current one is read live.
+    """
+    sprints = list_sprints(directory)
+    if last:
+        sprints = sprints[-last:]
+    closed = [sprint for sprint in sprints if is_closed(sprint)]
+    current = [sprint for sprint in sprints if not is_closed(sprint)]
+
+    rows = []
+    if closed:
+        cache_closed_sprints(closed)
+        rows.extend(read_cached_stats(closed, ratees, metrics))
+    for idx, ratee, metric, *stats in read_sprint_stats(current, ratees, metrics):
+        rows.append((ratee, metric, current[idx].date, current[idx].name, *stats))
+    rows.sort(key=lambda row: (row[0], row[1], row[2], row[3]))
+
+    trends = {}
+    points = {}
+    for ratee, metric, date, sprint, is_self, *sums in rows:
+        key = (ratee, metric, sprint)
+        point = points.get(key)
+        if point is None:
+            point = points[key] = [date, get_score_stats(0, 0.0, 0.0, None, None), None]
+            trends.setdefault(ratee, {}).setdefault(metric, []).append(key)
+        if is_self:
+            point[2] = get_score_stats(*sums).mean
+        else:
+            point[1] = get_score_stats(*sums)
+    return {ratee: {metric: [TrendPoint(key[2], *points[key]) for key in keys] for metric, keys in by_metric.items()}
+            for ratee, by_metric in trends.items()}
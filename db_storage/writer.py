@@ -0,0 +1,210 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import NamedTuple
+from db_storage import db_queries, profiler
+from db_storage.sqlite3_db_helper import connect
+
+# Submissions waiting beyond this many make `submit` give up, instead of piling up behind a stalled DB
+QUEUE_SIZE = 512
+# Most submissions committed together in one transaction
+BATCH_SIZE = 64
+# Seconds `submit` waits for a free slot in a full queue
+ENQUEUE_TIMEOUT = 5
+
+
+class Submission(NamedTuple):
+    rating_rows: list
+    future: Future
+    enqueued_at: float
+
+
+class SubmissionWriter:
+    """
+    Owns the single write connection for the rating submissions. Callers `submit` the rows of a review and get a
+    `Future` back, while a background thread drains the queue and group-commits whatever has piled up in one
+    transaction, so concurrent submissions don't contend for the SQLite write lock among themselves.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_path, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "submissions": 0, "failed": 0, "commit_seconds": 0.0, "max_commit_seconds": 0.0,
+                       "last_commit_seconds": 0.0, "max_wait_seconds": 0.0}
+        # What stopped the writer thread from starting, e.g. the DB failing to open
+        self._error = None
+        # Set once nothing is to be queued anymore: on shutdown, or once the thread stops. `submit` checks it and
+        # enqueues under the same lock, so no submission can land behind the `_STOP` left unwritten
+        self._stopped = False
+        self._state_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="submission-writer", daemon=True)
+        self._thread.start()
+
+    def is_alive(self) -> bool:
+        """Whether the writer still takes submissions"""
+        with self._state_lock:
+            return not self._stopped and self._thread.is_alive()
+
+    def submit(self, rating_rows) -> Future:
+        """Queues (user_id, ratee_id, metric_id, score) rows to be upserted together. The future resolves to None"""
+        future = Future()
+        with self._state_lock:
+            if self._stopped:
+                future.set_exception(self._get_stopped_error())
+                return future
+            try:
+                self._queue.put(Submission(list(rating_rows), future, time.perf_counter()), timeout=ENQUEUE_TIMEOUT)
+            except queue.Full:
+                future.set_exception(
+                    queue.Full(f"Too many submissions are waiting to be written ({self._queue.maxsize})"))
+        return future
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_commit_seconds"] = stats["commit_seconds"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def shutdown(self, timeout=None) -> None:
+        """Writes everything queued so far and stops the writer thread"""
+        with self._state_lock:
+            stopping, self._stopped = not self._stopped, True
+        if stopping and self._thread.is_alive():
+            self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _get_stopped_error(self) -> Exception:
+        if self._error is not None:
+            return RuntimeError(f"The submission writer failed to start: {self._error!r}")
+        return RuntimeError("The submission writer has been shut down")
+
+    def _fail_queued(self, err):
+        while True:
+            try:
+                submission = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if submission is not self._STOP:
+                submission.future.set_exception(err)
+
+    def _stop(self):
+        """Stops taking submissions, and fails the ones still queued"""
+        with self._state_lock:
+            self._stopped = True
+        self._fail_queued(self._get_stopped_error())
+
+    def _run(self):
+        try:
+            conn = connect(self.db_path)
+            insert_sql = db_queries.get_insert_sql(db_queries.INSERT_RATING_SQL, upsert=True)
+        except Exception as err:
+            self._error = err
+            self._stop()
+            return
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while batch[-1] is not self._STOP and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = batch[-1] is self._STOP
+                if stop:
+                    batch.pop()
+                if batch:
+                    self._write(conn, insert_sql, batch)
+                if stop:
+                    break
+        finally:
+            conn.close()
+            # Anything that made it onto the queue behind the `_STOP`, or past a failure, is never to be written
+            self._stop()
+
+    @staticmethod
+    def _upsert(conn, insert_sql, submissions):
+        """Writes the submissions in one transaction. With profiling on, the statements and the commit get recorded as
+        those of a `SQLiteSession` do, as this is where the submissions wait for the lock of the DB"""
+        if not profiler.is_enabled():
+            with conn:
+                for submission in submissions:
+                    conn.executemany(insert_sql, submission.rating_rows)
+            return
+        cursor = profiler.ProfilingCursor(conn.cursor())
+        try:
+            for submission in submissions:
+                cursor.executemany(insert_sql, submission.rating_rows)
+            cursor.close()
+            started = time.perf_counter()
+            conn.commit()
+            profiler.record_commit(time.perf_counter() - started)
+        except Exception:
+            cursor.close()
+            conn.rollback()
+            raise
+
+    def _write(self, conn, insert_sql, batch):
+        start = time.perf_counter()
+        try:
+            self._upsert(conn, insert_sql, batch)
+        except Exception:
+            # One bad submission shouldn't fail the rest of the batch, so each one gets retried on its own
+            failed = 0
+            for submission in batch:
+                try:
+                    self._upsert(conn, insert_sql, [submission])
+                except Exception as err:
+                    failed += 1
+                    submission.future.set_exception(err)
+                else:
+                    submission.future.set_result(None)
+        else:
+            failed = 0
+            for submission in batch:
+                submission.future.set_result(None)
+        elapsed = time.perf_counter() - start
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["submissions"] += len(batch) - failed
+            self._stats["failed"] += failed
+            self._stats["commit_seconds"] += elapsed
+            self._stats["last_commit_seconds"] = elapsed
+            self._stats["max_commit_seconds"] = max(self._stats["max_commit_seconds"], elapsed)
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], start - batch[0].enqueued_at)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_submission_writer() -> SubmissionWriter:
+    """The process-wide writer for `db_queries.DB_PATH`, started on first use and flushed on interpreter exit"""
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            # A writer that couldn't start (or got shut down) is replaced, so that a DB failing only for a while
+            # doesn't fail every later submission of the process
+            if _writer is None or not _writer.is_alive():
+                if _writer is not None:
+                    atexit.unregister(_writer.shutdown)
+                _writer = SubmissionWriter(db_queries.DB_PATH)
+                atexit.register(_writer.shutdown)
+    return _writer
+
+
+def shutdown_submission_writer(timeout=None) -> None:
+    """Writes everything queued and stops the writer, if it got started. The next submission starts a new one"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        atexit.unregister(writer.shutdown)
+        writer.shutdown(timeout)
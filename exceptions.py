@@ -4,3 +4,15 @@ class DatabaseDoesNotExist(BaseException):
 
 class TableExists(BaseException):
     pass
+
+
+class InvalidRoster(BaseException):
+    pass
+
+
+class InvalidExport(BaseException):
+    pass
+
+
+class InvalidStorageBackend(BaseException):
+    pass
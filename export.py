@@ -0,0 +1,103 @@
+import csv
+import json
+import os
+import sys
+from db_storage.db_queries import EXPORT_CHUNK_SIZE
+from db_storage.storage import get_storage
+from exceptions import InvalidExport
+
+RATING_COLUMNS = ("reviewer", "reviewer_name", "ratee", "ratee_name", "metric", "score", "is_self")
+AGGREGATE_COLUMNS = ("ratee", "ratee_name", "metric", "is_self", "count", "mean", "minimum", "maximum", "stddev")
+# Arrow types of the columns, for the columnar formats
+COLUMN_TYPES = {"score": "float64", "is_self": "bool", "count": "int64", "mean": "float64", "minimum": "float64",
+                "maximum": "float64", "stddev": "float64"}
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet", ".arrow": "arrow",
+           ".feather": "arrow"}
+
+
+def get_format(path, fmt=None) -> str:
+    """The export format asked for, or else the one of the file extension, and CSV for stdout"""
+    if not fmt:
+        fmt = "csv" if path == "-" else FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt not in set(FORMATS.values()):
+        raise InvalidExport(f"Unknown export format for '{path}', use one of: {', '.join(sorted(set(FORMATS.values())))}")
+    return fmt
+
+
+def write_csv(file, columns, chunks) -> int:
+    writer = csv.writer(file)
+    writer.writerow(columns)
+    count = 0
+    for chunk in chunks:
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+
+def write_jsonl(file, columns, chunks) -> int:
+    count = 0
+    for chunk in chunks:
+        file.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in chunk)
+        count += len(chunk)
+    return count
+
+
+def _import_pyarrow():
+    # pyarrow is only needed for the columnar formats (it comes along with streamlit, but isn't required by the app)
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise InvalidExport("The parquet and arrow formats need pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def write_columnar(path, fmt, columns, chunks) -> int:
+    """Parquet or Arrow IPC file, with a row group / record batch per chunk"""
+    pa = _import_pyarrow()
+    schema = pa.schema([(column, pa.type_for_alias(COLUMN_TYPES.get(column, "string"))) for column in columns])
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    count = 0
+    try:
+        for chunk in chunks:
+            batch = pa.record_batch([list(values) for values in zip(*chunk)], schema=schema)
+            if fmt == "parquet":
+                writer.write_batch(batch)
+            else:
+                writer.write(batch)
+            count += len(chunk)
+    finally:
+        writer.close()
+    return count
+
+
+def export_data(path, fmt=None, ratees=None, reviewers=None, metrics=None, aggregates=False,
+                chunk_size=EXPORT_CHUNK_SIZE) -> int:
+    """
+    Streams the ratings (with the names of the reviewers, ratees and metrics), or with `aggregates` the per ratee x
+    metric statistics of the peer and self scores, to `path` ("-" for stdout) in CSV, JSONL, Parquet or Arrow. Only a
+    chunk of rows is held in memory at a time. The filters are lists of usernames and metric names. Returns the number
+    of rows exported
+    """
+    fmt = get_format(path, fmt)
+    if aggregates:
+        if reviewers:
+            raise InvalidExport("The aggregates are across all the reviewers, and can't be filtered by reviewer")
+        columns, chunks = AGGREGATE_COLUMNS, get_storage().iter_export_aggregates(ratees, metrics, chunk_size)
+    else:
+        columns, chunks = RATING_COLUMNS, get_storage().iter_export_ratings(ratees, reviewers, metrics, chunk_size)
+
+    if fmt in ("parquet", "arrow"):
+        if path == "-":
+            raise InvalidExport(f"The {fmt} format can only be written to a file")
+        return write_columnar(path, fmt, columns, chunks)
+    write = write_csv if fmt == "csv" else write_jsonl
+    if path == "-":
+        return write(sys.stdout, columns, chunks)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        return write(file, columns, chunks)
@@ -1,33 +1,48 @@
 import streamlit as st
-from config import REVIEWERS_SHORTHAND
-from metric_utils import get_refresh_browser_ids
-from db_storage.db_queries import insert_all_data
-from init import get_initialization_choices
+from db_storage.storage import get_storage
+from db_storage.drafts import get_draft_writer
+from registry import get_registry
+from request_context import get_request_context
+from instrumentation import phase
+
+
+# Seconds the confirmation waits for the review to be written
+SUBMIT_TIMEOUT = 30
+
+
+def submit_review(reviewer, name, metrics, values):
+    """
+    Writes the scores `reviewer` has filled in (`values` by widget key, e.g. the session state) for the ratee `name`,
+    and marks the ratee as finalised. Raises whatever made the write fail
+    """
+    registry = get_registry()
+    user_id = registry.user_id_mapping[registry.reviewers_shorthand[reviewer]]
+    ratee_id = registry.user_id_mapping[name]
+    db_entry_list = []
+    for metric_shrt, metric_id in metrics.items():
+        val = values.get(f"{name}_{metric_shrt}", "")
+        db_entry_list.append([user_id, ratee_id, metric_id, float(val) if val != "" else None])
+    # The rows are written by the store (by the background writer, on SQLite), and the caller waits for the write
+    with phase("db.submit"):
+        get_storage().submit_ratings(db_entry_list).result(timeout=SUBMIT_TIMEOUT)
+    st.const_vars["input_save"][reviewer]["finalised"].append(name)
+    # The submitted scores take over from the drafts of the ratee
+    get_draft_writer().discard(user_id, ratee_id)
 
 
 @st.dialog("Confirm")
 def confirmation_dialog(msg, name, metrics):
     """Confirmation dialog for submitting the review."""
-    browser_id, refresh_id = get_refresh_browser_ids()
-    user_to_id_map, _ = get_initialization_choices()
     st.markdown(msg)
     button1, button2 = st.columns(2)
     if button1.button("Confirm", type="primary", use_container_width=True):
         st.session_state.confirm_dialog = True
-        db_entry_list = []
-        reviewer = st.const_vars["browser_reviewer"][browser_id]
-        st.const_vars["input_save"][reviewer]["finalised"].append(name)
-        user_id = user_to_id_map[REVIEWERS_SHORTHAND[reviewer]]
-        ratee_id = user_to_id_map[name]
-        metric_to_score = {}
-        for metric_shrt in metrics:
-            metric_id = metrics[metric_shrt]
-            key = f"{name}_{metric_shrt}"
-            val = st.session_state.get(key, "")
-            metric_to_score[metric_id] = float(val) if val != "" else None
-        for metric_id in metric_to_score:
-            db_entry_list.append([user_id, ratee_id, metric_id, metric_to_score[metric_id]])
-        insert_all_data(rating_data=db_entry_list)
+        reviewer = get_request_context().reviewer
+        try:
+            submit_review(reviewer, name, metrics, st.session_state)
+        except Exception as err:
+            st.error(f"Could not save the review for '{name.capitalize()}', please try again: {err}", icon=":material/error:")
+            return
         st.rerun()  # Closes the dialog box
     elif button2.button("Cancel", type="secondary", use_container_width=True):
         st.session_state.confirm_dialog = False
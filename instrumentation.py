@@ -0,0 +1,202 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import INSTRUMENTATION_ENABLED, INSTRUMENTATION_EXPORT_PATH, INSTRUMENTATION_PORT
+
+# Upper bounds (seconds) of the histogram buckets, as exported to Prometheus
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Latest timings kept per phase, which the percentiles get computed over
+RECENT_SAMPLES = 2048
+# Sessions whose own timings are kept, the least recently active ones getting dropped first
+MAX_SESSIONS = 256
+PERCENTILES = (50, 95, 99)
+METRIC_NAME = "metric_review_phase_seconds"
+
+# Shared by every `phase` while turned off, so that it costs a flag check and nothing else
+_NOOP = nullcontext()
+_enabled = INSTRUMENTATION_ENABLED or os.environ.get("METRIC_REVIEW_INSTRUMENTATION") == "1"
+_server = None
+
+
+class Histogram:
+    """Timings of one phase: cumulative bucket counts for Prometheus, and the latest samples for the percentiles"""
+    __slots__ = ("count", "total", "bucket_counts", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds) -> None:
+        self.count += 1
+        self.total += seconds
+        self.bucket_counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.recent.append(seconds)
+
+    def percentiles(self) -> dict[int, float]:
+        samples = sorted(self.recent)
+        if not samples:
+            return {}
+        return {q: samples[min(len(samples) - 1, len(samples) * q // 100)] for q in PERCENTILES}
+
+    def summary(self) -> dict:
+        return {"count": self.count, "total_seconds": self.total,
+                **{f"p{q}_seconds": value for q, value in self.percentiles().items()}}
+
+
+class PhaseTimings:
+    """Histograms per phase, globally and per Streamlit session"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.global_phases: dict[str, Histogram] = {}
+        self.session_phases: OrderedDict[str, dict[str, Histogram]] = OrderedDict()
+
+    def observe(self, session_id, name, seconds) -> None:
+        with self._lock:
+            self.global_phases.setdefault(name, Histogram()).observe(seconds)
+            if session_id is not None:
+                phases = self.session_phases.get(session_id)
+                if phases is None:
+                    phases = self.session_phases[session_id] = {}
+                    if len(self.session_phases) > MAX_SESSIONS:
+                        self.session_phases.popitem(last=False)
+                self.session_phases.move_to_end(session_id)
+                phases.setdefault(name, Histogram()).observe(seconds)
+
+    def summary(self, session_id=None) -> dict[str, dict]:
+        with self._lock:
+            phases = self.global_phases if session_id is None else self.session_phases.get(session_id, {})
+            return {name: histogram.summary() for name, histogram in sorted(phases.items())}
+
+    def prometheus_text(self) -> str:
+        lines = [f"# HELP {METRIC_NAME} Time spent in each phase of the review app's script runs",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        with self._lock:
+            for name, histogram in sorted(self.global_phases.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{METRIC_NAME}_bucket{{phase="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_sum{{phase="{name}"}} {histogram.total}')
+                lines.append(f'{METRIC_NAME}_count{{phase="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self.global_phases.clear()
+            self.session_phases.clear()
+
+
+timings = PhaseTimings()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+    start_metrics_server()
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def _get_session_id():
+    # Imported here, so that the module stays usable (and cheap) outside of the app as well
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+@contextmanager
+def _timed_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Also when the phase ends with `st.stop()` or `st.rerun()`, which raise
+        elapsed = time.perf_counter() - started
+        timings.observe(_get_session_id(), name, elapsed)
+
+
+def phase(name):
+    """Times the `with` block as the phase `name` of the current script run (or fragment run)"""
+    return _timed_phase(name) if _enabled else _NOOP
+
+
+def timed(name):
+    """Decorator timing each call of the function as the phase `name`"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _timed_phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export(path=INSTRUMENTATION_EXPORT_PATH) -> None:
+    """Writes the global timings to `path`: a JSON summary for a .json file, and Prometheus text otherwise"""
+    if path.endswith(".json"):
+        content = json.dumps(timings.summary(), indent=2)
+    else:
+        content = timings.prometheus_text()
+    # Written aside and moved in place, so that a scraper reading the file never sees it half written
+    with open(f"{path}.tmp", "w") as file:
+        file.write(content)
+    os.replace(f"{path}.tmp", path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = timings.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=INSTRUMENTATION_PORT) -> None:
+    """Serves the timings at http://localhost:<port>/metrics for Prometheus to scrape, once per process"""
+    global _server
+    if port is None or _server is not None:
+        return
+    try:
+        _server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    except OSError as e:
+        # e.g. another process of the app already serves on the port
+        print(f"Metrics endpoint not started on port {port}: {e}")
+        return
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+
+
+@atexit.register
+def _export_on_exit():
+    if _enabled and INSTRUMENTATION_EXPORT_PATH and timings.global_phases:
+        export()
+
+
+if _enabled:
+    start_metrics_server()
@@ -0,0 +1,258 @@
+"""Maintenance commands for the review database, run outside of the Streamlit app.
+
+USAGE: python manage.py <command> [options]
+"""
+import argparse
+import sys
+
+
+def init(args) -> int:
+    from bootstrap import init_db
+    from db_storage.db_queries import check_if_db_exists, get_current_db_path
+    from exceptions import DatabaseDoesNotExist
+
+    try:
+        check_if_db_exists()
+    except DatabaseDoesNotExist:
+        registry = init_db()
+        print(f"Created {get_current_db_path()} with {len(registry.user_id_mapping)} users and "
+              f"{len(registry.metric_id_mapping)} metrics")
+        return 0
+    print(f"{get_current_db_path()} already exists. Use `reset --yes` to start it over, or `resume` to continue on it")
+    return 1
+
+
+def reset(args) -> int:
+    from bootstrap import reset_db
+    from db_storage.db_queries import get_current_db_path
+
+    if not args.yes:
+        print(f"This deletes all the reviews and logins of {get_current_db_path()}. Pass --yes to go ahead")
+        return 1
+    registry = reset_db()
+    print(f"Reset {get_current_db_path()}, seeded with {len(registry.user_id_mapping)} users and "
+          f"{len(registry.metric_id_mapping)} metrics")
+    return 0
+
+
+def resume(args) -> int:
+    from bootstrap import resume_db
+    from db_storage.db_queries import get_current_db_path, get_initialized_user_requests
+
+    registry = resume_db()
+    print(f"Continuing on {get_current_db_path()}: {len(registry.user_id_mapping)} users, "
+          f"{len(registry.metric_id_mapping)} metrics, {len(get_initialized_user_requests())} reviewers logged in")
+    return 0
+
+
+def migrate(args) -> int:
+    from db_storage.db_queries import check_if_db_exists, migrate_schema
+    from db_storage.migrations import LATEST_SCHEMA_VERSION
+
+    check_if_db_exists()
+    print(f"Schema version: {migrate_schema()} (latest: {LATEST_SCHEMA_VERSION})")
+    return 0
+
+
+def load_roster(args) -> int:
+    import time
+    from bootstrap import init_db, reset_db, seed_db
+    from db_storage.db_queries import check_if_db_exists, get_current_db_path, get_registry_rows
+    from exceptions import DatabaseDoesNotExist
+    from roster import load_roster
+
+    if args.reset and not args.yes:
+        print(f"--reset deletes all the reviews and logins of {get_current_db_path()}. Pass --yes along to go ahead")
+        return 1
+    try:
+        check_if_db_exists()
+    except DatabaseDoesNotExist:
+        db_exists = False
+    else:
+        db_exists = True
+
+    started = time.perf_counter()
+    known_users, known_metrics = (), ()
+    if db_exists and not args.reset:
+        # The rows get checked against the users and metrics already in the DB, as they get added onto them
+        user_rows, metric_full_to_id_map, _ = get_registry_rows()
+        known_users = [(name, username) for _, username, name in user_rows]
+        known_metrics = metric_full_to_id_map
+    roster = load_roster(args.users, args.metrics, args.assignments, args.exclusions, known_users, known_metrics)
+    loaded = time.perf_counter()
+
+    if not db_exists:
+        registry = init_db(roster, args.reviewers_per_ratee)
+    elif args.reset:
+        registry = reset_db(roster, args.reviewers_per_ratee)
+    else:
+        registry = seed_db(roster, args.reviewers_per_ratee)
+    print(f"Loaded {len(roster.users)} users, {len(roster.metrics)} metrics, {len(roster.assignments)} review assignments "
+          f"and {len(roster.exclusions)} exclusions onto {get_current_db_path()} (validated in {loaded - started:.2f}s, "
+          f"seeded and assigned in {time.perf_counter() - loaded:.2f}s)")
+    print(f"The DB now has {len(registry.user_id_mapping)} users and {len(registry.metric_id_mapping)} metrics")
+    print_workload(registry)
+    return 0
+
+
+def print_workload(registry) -> None:
+    # Peers to review of each reviewer, leaving out the self reviews
+    loads = [len(ratee_ids - {reviewer_id}) for reviewer_id, ratee_ids in registry.review_id_sets.items()]
+    if loads:
+        print(f"Peers to review per reviewer: min {min(loads)}, max {max(loads)}, total {sum(loads)}")
+
+
+def assign(args) -> int:
+    import time
+    from bootstrap import assign_reviews
+    from db_storage.db_queries import check_if_db_exists, ratings_exist
+    from registry import load_registry
+
+    check_if_db_exists()
+    if args.replace and ratings_exist() and not args.yes:
+        print("Reviews have already been submitted, and replacing the assignments can leave some of them unassigned. "
+              "Pass --yes along to go ahead")
+        return 1
+    started = time.perf_counter()
+    plan = assign_reviews(args.reviewers_per_ratee, args.replace, args.seed)
+    print(f"{'Replaced the assignments with' if args.replace else 'Added'} {len(plan.pairs)} assignments "
+          f"in {time.perf_counter() - started:.2f}s")
+    print_workload(load_registry())
+    if plan.shortfall:
+        print(f"{len(plan.shortfall)} ratees are short of reviewers ({sum(plan.shortfall.values())} in all), "
+              f"as their exclusions leave too few to pick from")
+    return 0
+
+
+def check_query_plans(args) -> int:
+    from db_storage.query_plans import find_full_scans
+
+    full_scans, checked = find_full_scans()
+    for name, plan in full_scans.items():
+        print(f"FULL SCAN: {name}")
+        for step in plan:
+            print(f"    {step}")
+    print(f"{checked - len(full_scans)}/{checked} statements avoid full table scans")
+    return 1 if full_scans else 0
+
+
+def rebuild_aggregates(args) -> int:
+    from db_storage.db_queries import rebuild_rating_aggregates, check_if_db_exists
+
+    check_if_db_exists()
+    rebuild_rating_aggregates()
+    print("Rebuilt rating_aggregates and review_progress from the ratings and assignments tables")
+    return 0
+
+
+def export(args) -> int:
+    import time
+    from db_storage.db_queries import check_if_db_exists
+    from export import export_data
+
+    check_if_db_exists()
+    started = time.perf_counter()
+    count = export_data(args.output, args.format, args.ratee, args.reviewer, args.metric, args.aggregates,
+                        args.chunk_size)
+    if args.output != "-":
+        print(f"Exported {count} {'aggregate' if args.aggregates else 'rating'} rows to {args.output} "
+              f"in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+def trends(args) -> int:
+    from db_storage.trends import get_trends
+
+    for ratee, by_metric in get_trends(args.ratee, args.metric, args.last).items():
+        print(ratee)
+        for metric, points in by_metric.items():
+            means = " ".join(f"{point.peer.mean:.2f}" if point.peer.mean is not None else "-" for point in points)
+            print(f"    {metric:<30} {means}")
+    return 0
+
+
+def main(argv=None) -> int:
+    from config import REVIEWERS_PER_RATEE
+    from db_storage.db_queries import EXPORT_CHUNK_SIZE
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("init", help="Create and seed the DB from config.py, failing if it already exists") \
+        .set_defaults(func=init)
+    reset_parser = commands.add_parser("reset", help="Delete all the data of the DB, and seed it again from config.py")
+    reset_parser.add_argument("--yes", action="store_true", help="Confirm deleting the existing reviews and logins")
+    reset_parser.set_defaults(func=reset)
+    commands.add_parser("resume", help="Continue on the existing DB, migrating it to the latest schema") \
+        .set_defaults(func=resume)
+    commands.add_parser("migrate", help="Migrate the DB to the latest schema, and print its version") \
+        .set_defaults(func=migrate)
+    roster_parser = commands.add_parser("load-roster", help="Validate and load users, metrics and review assignments "
+                                                            "from CSV/JSONL/TOML files onto the DB, creating it if needed")
+    roster_parser.add_argument("--users", help="File of the users, with the fields: name, username")
+    roster_parser.add_argument("--metrics", help="File of the metrics, with the fields: name, description (optional)")
+    roster_parser.add_argument("--assignments", help="File of the review assignments, with the fields: reviewer, ratee "
+                                                     "(usernames)")
+    roster_parser.add_argument("--exclusions", help="File of who shouldn't review whom, with the fields: reviewer, ratee "
+                                                    "(usernames)")
+    roster_parser.add_argument("--reviewers-per-ratee", type=int, default=REVIEWERS_PER_RATEE,
+                               help="Reviewers assigned to each new ratee, besides themselves (default: "
+                                    "config.REVIEWERS_PER_RATEE, where None is everyone)")
+    roster_parser.add_argument("--reset", action="store_true", help="Delete all the data of the DB before loading")
+    roster_parser.add_argument("--yes", action="store_true", help="Confirm deleting the existing reviews and logins")
+    roster_parser.set_defaults(func=load_roster)
+    assign_parser = commands.add_parser("assign", help="Assign reviewers to the ratees short of them, balancing the "
+                                                       "workload of the reviewers")
+    assign_parser.add_argument("--reviewers-per-ratee", type=int, default=REVIEWERS_PER_RATEE,
+                               help="Reviewers of each ratee, besides themselves (default: config.REVIEWERS_PER_RATEE, "
+                                    "where None is everyone)")
+    assign_parser.add_argument("--replace", action="store_true", help="Drop the existing assignments, and assign anew")
+    assign_parser.add_argument("--yes", action="store_true", help="Confirm replacing once reviews have been submitted")
+    assign_parser.add_argument("--seed", type=int, help="Seed of the random tie-breaks, for a reproducible assignment")
+    assign_parser.set_defaults(func=assign)
+    commands.add_parser("check-query-plans", help="Fail if any statement of db_queries or of the triggers does a full scan of a "
+                                                  "growing table") \
+        .set_defaults(func=check_query_plans)
+    commands.add_parser("rebuild-aggregates", help="Recompute the rating_aggregates and review_progress tables from the "
+                                                   "raw ratings and assignments") \
+        .set_defaults(func=rebuild_aggregates)
+
+    export_parser = commands.add_parser("export", help="Stream the ratings (or their aggregates) to a CSV, JSONL, Parquet "
+                                                       "or Arrow file")
+    export_parser.add_argument("output", help="File to write, its extension telling the format (- for stdout, "
+                                                          "in CSV unless --format tells otherwise)")
+    export_parser.add_argument("--format", choices=["csv", "jsonl", "parquet", "arrow"],
+                               help="Format, when the extension doesn't tell it")
+    export_parser.add_argument("--ratee", action="append", help="Only the ratings of this ratee (username), repeatable")
+    export_parser.add_argument("--reviewer", action="append", help="Only the ratings by this reviewer (username), "
+                                                                   "repeatable")
+    export_parser.add_argument("--metric", action="append", help="Only the ratings on this metric (name), repeatable")
+    export_parser.add_argument("--aggregates", action="store_true", help="Peer and self statistics per ratee and "
+                                                                         "metric, instead of the raw ratings")
+    export_parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="Rows read and written at a time")
+    export_parser.set_defaults(func=export)
+
+    trends_parser = commands.add_parser("trends", help="Print the peer mean of each ratee and metric across the sprint "
+                                                       "DBs, oldest first")
+    trends_parser.add_argument("--ratee", action="append", help="Only this ratee (username), repeatable")
+    trends_parser.add_argument("--metric", action="append", help="Only this metric (name), repeatable")
+    trends_parser.add_argument("--last", type=int, help="Only the last N sprints")
+    trends_parser.set_defaults(func=trends)
+
+    args = parser.parse_args(argv)
+    from db_storage.storage import set_storage, SQLiteStorage
+    # The commands work on the DB file, whichever store `config.STORAGE_BACKEND` gives the app
+    set_storage(SQLiteStorage())
+    from exceptions import DatabaseDoesNotExist, InvalidRoster, InvalidExport
+    try:
+        return args.func(args)
+    except DatabaseDoesNotExist as e:
+        print(f"{e} Create it with `python manage.py init`")
+        return 1
+    except (InvalidRoster, InvalidExport) as e:
+        print(e)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
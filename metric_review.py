@@ -1,14 +1,15 @@
 import time
 import streamlit as st
-from config import REVIEWERS_SHORTHAND
-from db_storage.db_queries import insert_all_data, get_reviewers_finalised_cols, get_counts_of_reviewed, get_average_scores
+from db_storage.storage import get_storage
 import sys
 import re
 import pathlib
-from init import initialize_const_vars, initiated_request_verif, get_initialization_choices
-from metric_utils import get_refresh_browser_ids, get_reviewers_shorthand
+from init import initialize_const_vars, initiated_request_verif
+from request_context import get_request_context
 from template import get_self_review_css
-from ui import create_metric_mapping, create_remaining_review_watch
+from ui import create_metric_mapping, create_remaining_review_watch, get_review_watch_counts, create_instrumentation_view, \
+    is_admin_request
+from instrumentation import phase
 
 
 if __name__ == "__main__":
@@ -24,62 +25,69 @@ if __name__ == "__main__":
 
 # Streamlit page configuration
 st.set_page_config(page_title="Reviewer", page_icon="random", layout="wide", menu_items=None)
-initialize_const_vars("input_save", {})
-initiated_request_verif()
 
-# Initializes for global access, and also to verify if the Browser is in Incognito/Private Window,
-# which fails to get the 'ajs_anonymous_id' and requires a one time refresh
-browser_id, refresh_id = get_refresh_browser_ids()
-
-# Initializes browser access info, if not already present
-for c in REVIEWERS_SHORTHAND:
-    if c not in st.browser_access_info:
-        st.browser_access_info[c] = {}
-
-user_to_id_map, metric_shorthand_to_id_map = get_initialization_choices()
+# Timings of the app's phases, for the admins (see `instrumentation.py`). Without the token it's the usual page
+if st.query_params.get("admin") == "metrics" and is_admin_request():
+    create_instrumentation_view()
+    st.stop()
 
 
 def store_selection(*args, **kwargs):
     """Assign the selected reviewer name to the browser session."""
-    global browser_id
-    if "browser_reviewer" not in st.const_vars:
-        st.const_vars["browser_reviewer"] = {}
-
-    if browser_id in st.const_vars["browser_reviewer"]:
+    request = get_request_context()
+    if request.reviewer:
         st.warning("User is already logged in with a Reviewer Name. Resuming the session", icon=":material/warning:")
-    elif args[0] in st.const_vars["browser_reviewer"].values():
-        st.error(f"User as {args[0]} is already registered with the system. Use other as the Reviewer Name", icon=":material/error:")
     elif args[0]:
-        user_id = user_to_id_map[REVIEWERS_SHORTHAND[args[0]]]
-        st.const_vars["browser_reviewer"][browser_id] = args[0]
-        insert_all_data(auth_data=(user_id, browser_id))
+        user_id = request.registry.user_id_mapping[request.registry.reviewers_shorthand[args[0]]]
+        # Registering fails if another browser (possibly served by another process) has taken the name in the meantime
+        sessions = request.sessions
+        if sessions.is_registered(args[0], user_id) or not sessions.register(request.browser_id, args[0], user_id):
+            st.error(f"User as {args[0]} is already registered with the system. Use other as the Reviewer Name", icon=":material/error:")
+
+
+# Every phase below is timed as a part of the whole script run, `st.stop()` included
+with phase("run"):
+    with phase("init"):
+        initialize_const_vars("input_save", {})
+        initiated_request_verif()
+
+    # Browser ids and registry of this run, resolved once for the whole run. Also stops a Browser in an
+    # Incognito/Private Window, which fails to get the 'ajs_anonymous_id' and requires a one time refresh
+    with phase("request"):
+        request = get_request_context()
+        registry = request.registry
 
+    reviewer_sel = st.columns([1, 0.2])
 
-reviewer_sel = st.columns([1, 0.2])
+    with phase("login"):
+        reviewer = request.reviewer
 
-# Reviewer selection if not already assigned
-if not st.const_vars.get("browser_reviewer") or not st.const_vars["browser_reviewer"].get(browser_id):
-    with reviewer_sel[0]:
-        selection = st.selectbox(label="Reviewing User", options=REVIEWERS_SHORTHAND, index=None, label_visibility="collapsed",
-                                 placeholder="Select your Name")
+    # Reviewer selection if not already assigned
+    if not reviewer:
+        with reviewer_sel[0]:
+            selection = st.selectbox(label="Reviewing User", options=list(registry.reviewers_shorthand), index=None, label_visibility="collapsed",
+                                     placeholder="Select your Name")
 
-    with reviewer_sel[1]:
-        st.button("Confirm", key="confirm", on_click=store_selection, type="primary", args=(selection,))
+        with reviewer_sel[1]:
+            st.button("Confirm", key="confirm", on_click=store_selection, type="primary", args=(selection,))
 
-# Display reviewer identity and metric entry form
-if st.const_vars.get("browser_reviewer") and st.const_vars["browser_reviewer"].get(browser_id):
-    reviewer = st.const_vars["browser_reviewer"][browser_id]
-    st.markdown(get_self_review_css(reviewer), unsafe_allow_html=True)
-    all_to_review = get_reviewers_shorthand(reviewer)
-    user_to_id_map, metric_shorthand_to_id_map = get_initialization_choices()
-    reviewers_id = user_to_id_map[REVIEWERS_SHORTHAND[reviewer]]
-    st.const_vars["input_save"][reviewer] = {"finalised": get_reviewers_finalised_cols(reviewers_id)}
-    if reviewer in st.const_vars["input_save"] and sorted(all_to_review.values()) == sorted(st.const_vars["input_save"][reviewer]["finalised"]):
-        not_started, pending_reviewers, completed_users = get_counts_of_reviewed()
-        if not not_started and not pending_reviewers:
-            get_average_scores([])
-            st.stop()
+    # Display reviewer identity and metric entry form
+    if reviewer:
+        st.markdown(get_self_review_css(reviewer), unsafe_allow_html=True)
+        all_to_review = registry.review_sets[reviewer]
+        reviewers_id = request.reviewer_id
+        with phase("db.finalised_cols"):
+            finalised = get_storage().get_reviewers_finalised_cols(reviewers_id)
+            st.const_vars["input_save"][reviewer] = {"finalised": list(finalised)}
+        if reviewer in st.const_vars["input_save"] and sorted(all_to_review.values()) == sorted(st.const_vars["input_save"][reviewer]["finalised"]):
+            with phase("db.watch_counts"):
+                not_started, pending_reviewers, completed_users = get_review_watch_counts(registry)
+            if not not_started and not pending_reviewers:
+                with phase("db.average_scores"):
+                    get_storage().get_average_scores([])
+                st.stop()
+            else:
+                create_remaining_review_watch(registry)
         else:
-            create_remaining_review_watch(pending_reviewers, not_started)
-    else:
-        create_metric_mapping(reviewer, all_to_review)
+            with phase("render.grid"):
+                create_metric_mapping(reviewer, all_to_review)
@@ -0,0 +1,85 @@
+import threading
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+from db_storage.storage import get_storage
+from metric_utils import fetch_initials
+
+
+class Registry(NamedTuple):
+    """Immutable lookups over the users and metrics of the DB. Built once, and shared by every session and rerun"""
+    # Human-readable name <-> username (shorthand), as `config.REVIEWERS_SHORTHAND` and its reverse
+    reviewers_shorthand: Mapping[str, str]
+    reviewers_shorthand_rev: Mapping[str, str]
+    # username <-> user id
+    user_id_mapping: Mapping[str, int]
+    id_user_mapping: Mapping[int, str]
+    # Full metric name -> metric shorthand (initials), in the order of the metric ids
+    metric_initials: Mapping[str, str]
+    # Metric shorthand <-> metric id
+    metric_id_mapping: Mapping[str, int]
+    id_metric_mapping: Mapping[int, str]
+    # Reviewer name -> {name: username} of everyone assigned to the reviewer (usually including themselves)
+    review_sets: Mapping[str, Mapping[str, str]]
+    # Reviewer id -> ids of everyone assigned to the reviewer
+    review_id_sets: Mapping[int, frozenset[int]]
+
+
+def freeze(mapping) -> Mapping:
+    return MappingProxyType(dict(mapping))
+
+
+def build_registry(user_rows, metric_full_to_id_map, assignments) -> Registry:
+    """Builds the registry out of the (id, username, name) user rows, the {metric name: id} map, and the
+    {reviewer username: [ratee usernames]} of the assignments"""
+    reviewers_shorthand = {name: username for _, username, name in user_rows}
+    reviewers_shorthand_rev = {username: name for name, username in reviewers_shorthand.items()}
+    user_id_mapping = {username: id for id, username, _ in user_rows}
+    metric_initials = {metric: fetch_initials(metric) for metric in metric_full_to_id_map}
+    metric_id_mapping = {metric_initials[metric]: id for metric, id in metric_full_to_id_map.items()}
+
+    # Every user gets a review set, an empty one when nothing is assigned to them
+    review_sets, review_id_sets = {}, {}
+    for name, username in reviewers_shorthand.items():
+        ratees = assignments.get(username, ())
+        review_sets[name] = freeze({reviewers_shorthand_rev[ratee]: ratee for ratee in ratees})
+        review_id_sets[user_id_mapping[username]] = frozenset(user_id_mapping[ratee] for ratee in ratees)
+
+    return Registry(
+        reviewers_shorthand=freeze(reviewers_shorthand),
+        reviewers_shorthand_rev=freeze(reviewers_shorthand_rev),
+        user_id_mapping=freeze(user_id_mapping),
+        id_user_mapping=freeze({id: username for username, id in user_id_mapping.items()}),
+        metric_initials=freeze(metric_initials),
+        metric_id_mapping=freeze(metric_id_mapping),
+        id_metric_mapping=freeze({id: shorthand for shorthand, id in metric_id_mapping.items()}),
+        review_sets=freeze(review_sets),
+        review_id_sets=freeze(review_id_sets),
+    )
+
+
+_registry = None
+_registry_versions = None
+_registry_lock = threading.Lock()
+
+
+def get_roster_versions() -> tuple:
+    versions = get_storage().get_data_versions()
+    return versions.get("users"), versions.get("metrics"), versions.get("assignments")
+
+
+def load_registry() -> Registry:
+    """(Re)builds the registry from the DB with a single read, e.g. once the users and metrics have been seeded"""
+    global _registry, _registry_versions
+    with _registry_lock:
+        # The versions are taken before the read, so that a change racing with it gets picked on the next lookup
+        _registry_versions = get_roster_versions()
+        _registry = build_registry(*get_storage().get_registry_rows())
+    return _registry
+
+
+def get_registry() -> Registry:
+    # Also (re)loaded lazily, since Streamlit drops this module when its source changes while the DB stays as is,
+    # and the roster may have been reset or reloaded by `manage.py` while the app runs
+    if _registry is None or _registry_versions != get_roster_versions():
+        return load_registry()
+    return _registry
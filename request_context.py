@@ -0,0 +1,91 @@
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import metric_utils
+from registry import get_registry, Registry
+from sessions import get_session_registry, SessionRegistry
+
+# Attribute of the `ScriptRunContext` holding the context of its current run
+_CTX_ATTR = "_metric_review_request"
+
+PRIVATE_WINDOW_MESSAGE = "Currently Private or Incognito Tab requires a refresh of the page to start working"
+
+
+class RequestContext:
+    """
+    What a script run (or fragment run) needs to know of its request, resolved once per run: the browser id
+    (`ajs_anonymous_id` cookie) and the refresh id (`Sec-Websocket-Key`, which changes on a page refresh), along with
+    the registry and the session registry. The reviewer logged in on the browser, and whether the page was refreshed,
+    get looked up on first use.
+    """
+    __slots__ = ("browser_id", "refresh_id", "registry", "sessions", "_reviewer", "_page_refreshed")
+
+    def __init__(self, browser_id, refresh_id, registry: Registry, sessions: SessionRegistry):
+        self.browser_id = browser_id
+        self.refresh_id = refresh_id
+        self.registry = registry
+        self.sessions = sessions
+        self._reviewer = None
+        self._page_refreshed = None
+
+    @property
+    def reviewer(self) -> str | None:
+        # Kept once found only, as a browser without a reviewer may get registered later on in the run
+        if self._reviewer is None:
+            self._reviewer = self.sessions.get_reviewer(self.browser_id)
+        return self._reviewer
+
+    @property
+    def reviewer_id(self) -> int:
+        return self.registry.user_id_mapping[self.registry.reviewers_shorthand[self.reviewer]]
+
+    @property
+    def page_refreshed(self) -> bool | None:
+        """
+        Whether the page has been refreshed or a new browser is getting registered.
+
+            Returns: [None | True | False]:
+            .... None : A new browser entry detected
+            .... True : The existing browser had a page refresh
+            .... False: The page wasn't refreshed but the streamlit had re-executed
+        """
+        # Recording the refresh is what tells it, so it is done once per run. Kept in a tuple, as None is an answer too
+        if self._page_refreshed is None:
+            self._page_refreshed = (self.sessions.record_refresh(self.browser_id, self.refresh_id),)
+        return self._page_refreshed[0]
+
+
+def read_browser_ids(request) -> tuple[str | None, str | None]:
+    """(browser id, refresh id) of the tornado request, None for the ones it doesn't carry"""
+    try:
+        browser_id = request._cookies["ajs_anonymous_id"]._value
+    except (AttributeError, KeyError):
+        browser_id = None
+    try:
+        refresh_id = request.headers._dict["Sec-Websocket-Key"]
+    except (AttributeError, KeyError):
+        refresh_id = None
+    return browser_id, refresh_id
+
+
+def resolve_request_context() -> RequestContext:
+    browser_id, refresh_id = read_browser_ids(metric_utils.get_request_obj())
+    if browser_id is None:
+        # A private window (or a cleared cache) only gets its `ajs_anonymous_id` set on the first load, so there is
+        # no browser to tie a reviewer to until the page gets refreshed
+        st.error(PRIVATE_WINDOW_MESSAGE, icon=":material/error:")
+        st.stop()
+    return RequestContext(browser_id, refresh_id, get_registry(), get_session_registry())
+
+
+def get_request_context() -> RequestContext:
+    """The `RequestContext` of the current run, resolved on the first call within the run, including its callbacks"""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return resolve_request_context()
+    # Every run starts with a fresh `widget_ids_this_run` set on the reused `ScriptRunContext`, which marks the run
+    run_marker = ctx.widget_ids_this_run
+    memo = getattr(ctx, _CTX_ATTR, None)
+    if memo is None or memo[0] is not run_marker:
+        memo = (run_marker, resolve_request_context())
+        setattr(ctx, _CTX_ATTR, memo)
+    return memo[1]
@@ -0,0 +1,204 @@
+import csv
+import json
+import os
+import tomllib
+from typing import Iterable, Iterator, NamedTuple
+from config import METRIC_DESCRIPTIVE, REVIEWERS_SHORTHAND, SELECTIVE_REVIEWERS, REVIEW_EXCLUSIONS
+from exceptions import InvalidRoster
+from metric_utils import fetch_initials
+
+# Columns (CSV header / JSONL keys / TOML keys) of each kind of rows, all of them required but the optional ones
+USER_FIELDS = ("name", "username")
+METRIC_FIELDS = ("name", "description")
+ASSIGNMENT_FIELDS = ("reviewer", "ratee")
+EXCLUSION_FIELDS = ("reviewer", "ratee")
+OPTIONAL_FIELDS = {"description"}
+
+# Errors listed in the raised `InvalidRoster`, past which only their count is given
+MAX_REPORTED_ERRORS = 50
+
+
+class Roster(NamedTuple):
+    """Validated rows, ready for `insert_all_data`"""
+    users: list[tuple[str, str]]        # (name, username)
+    metrics: list[tuple[str, str]]      # (name, description)
+    assignments: list[tuple[str, str]]  # (reviewer username, ratee username)
+    exclusions: list[tuple[str, str]]   # (reviewer username, ratee username)
+
+
+def _clean(value) -> str:
+    # Runs of whitespace are collapsed, as the metric initials are taken word by word
+    return " ".join(str(value).split()) if value is not None else ""
+
+
+def _read_csv(path, table, fields) -> Iterator[tuple[str, dict]]:
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        reader = csv.DictReader(file)
+        missing = [field for field in fields if field not in (reader.fieldnames or ()) and field not in OPTIONAL_FIELDS]
+        if missing:
+            raise InvalidRoster(f"{path}: Missing the column(s) {', '.join(missing)} in the header")
+        for row in reader:
+            yield f"{path}:{reader.line_num}", row
+
+
+def _read_jsonl(path, table, fields) -> Iterator[tuple[str, dict]]:
+    with open(path, encoding="utf-8") as file:
+        for line_num, line in enumerate(file, start=1):
+            if line.strip():
+                try:
+                    yield f"{path}:{line_num}", json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise InvalidRoster(f"{path}:{line_num}: {e}")
+
+
+def _read_toml(path, table, fields) -> Iterator[tuple[str, dict]]:
+    # TOML can't be read row by row, but its `[[users]]`, `[[metrics]]`, `[[assignments]]` and `[[exclusions]]`
+    # arrays let a single file hold the whole roster
+    with open(path, "rb") as file:
+        rows = tomllib.load(file).get(table, [])
+    for idx, row in enumerate(rows):
+        yield f"{path}:{table}[{idx}]", row
+
+
+READERS = {".csv": _read_csv, ".jsonl": _read_jsonl, ".ndjson": _read_jsonl, ".toml": _read_toml}
+
+
+def read_rows(path, table, fields) -> Iterator[tuple[str, tuple[str, ...]]]:
+    """Streams the (location, values of `fields`) of the rows in the CSV, JSONL or TOML file, by its extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in READERS:
+        raise InvalidRoster(f"{path}: Unsupported file type '{extension}'. Expected one of {', '.join(READERS)}")
+
+    for location, row in READERS[extension](path, table, fields):
+        if not isinstance(row, dict):
+            raise InvalidRoster(f"{location}: Expected an object with the keys {', '.join(fields)}")
+        yield location, tuple(_clean(row.get(field)) for field in fields)
+
+
+class RosterValidator:
+    """
+    Checks the rows while they stream in, in a single pass: names and usernames unique, metric initials (the keys
+    of the review cells, see `fetch_initials`) unique, and assignments and exclusions only between known users.
+    Collects every error, so that a bad file gets reported in full at once.
+    """
+
+    def __init__(self, known_users=(), known_metrics=()):
+        self.errors = []
+        self.roster = Roster([], [], [], [])
+        # Username -> name, name -> username, and initials -> metric name, of the DB and the rows accepted so far
+        self._names = {}
+        self._usernames = {}
+        self._initials = {}
+        # What the rows have brought in, as a row repeating any of it is an error, unlike one repeating the DB
+        self._loaded_users = set()
+        self._loaded_metrics = set()
+        self._assignments = set()
+        self._exclusions = set()
+        for name, username in known_users:
+            self._names[username], self._usernames[name] = name, username
+        for metric in known_metrics:
+            self._initials[fetch_initials(metric)] = metric
+
+    def _error(self, location, msg) -> None:
+        self.errors.append(f"{location}: {msg}")
+
+    def add_user(self, location, name, username) -> None:
+        if not name or not username:
+            return self._error(location, "Both the name and the username are required")
+        if self._names.get(username, name) != name:
+            return self._error(location, f"Username '{username}' is already taken by '{self._names[username]}'")
+        if self._usernames.get(name, username) != username:
+            return self._error(location, f"Name '{name}' is already taken by the username '{self._usernames[name]}'")
+        if username in self._loaded_users:
+            return self._error(location, f"Duplicate user '{username}'")
+        self._loaded_users.add(username)
+        if username not in self._names:
+            self._names[username], self._usernames[name] = name, username
+            self.roster.users.append((name, username))
+
+    def add_metric(self, location, name, description) -> None:
+        if name in self._loaded_metrics:
+            return self._error(location, f"Duplicate metric '{name}'")
+        initials = fetch_initials(name)
+        if not initials:
+            return self._error(location, f"Metric '{name}' has no word starting with a letter to take initials from")
+        if self._initials.get(initials, name) != name:
+            return self._error(location, f"Metrics '{self._initials[initials]}' and '{name}' both shorten to '{initials}'")
+        self._initials[initials] = name
+        self._loaded_metrics.add(name)
+        # Also when in the DB already, for its description to get updated
+        self.roster.metrics.append((name, description))
+
+    def _check_pair(self, location, reviewer, ratee) -> bool:
+        unknown = [username for username in (reviewer, ratee) if username not in self._names]
+        if unknown:
+            self._error(location, f"Unknown username(s): {', '.join(repr(username) for username in unknown)}")
+        return not unknown
+
+    def add_assignment(self, location, reviewer, ratee) -> None:
+        if not self._check_pair(location, reviewer, ratee):
+            return
+        if (reviewer, ratee) in self._assignments:
+            return self._error(location, f"Duplicate assignment of '{ratee}' to '{reviewer}'")
+        self._assignments.add((reviewer, ratee))
+        self.roster.assignments.append((reviewer, ratee))
+
+    def add_exclusion(self, location, reviewer, ratee) -> None:
+        if not self._check_pair(location, reviewer, ratee):
+            return
+        if (reviewer, ratee) in self._exclusions:
+            return self._error(location, f"Duplicate exclusion of '{ratee}' for '{reviewer}'")
+        self._exclusions.add((reviewer, ratee))
+        self.roster.exclusions.append((reviewer, ratee))
+
+    def validate(self, users=(), metrics=(), assignments=(), exclusions=()) -> Roster:
+        """Runs the (location, values) rows through the checks, users first, and returns the accepted ones"""
+        for location, values in users:
+            self.add_user(location, *values)
+        for location, values in metrics:
+            self.add_metric(location, *values)
+        for location, values in assignments:
+            self.add_assignment(location, *values)
+        for location, values in exclusions:
+            self.add_exclusion(location, *values)
+
+        if self.errors:
+            reported = self.errors[:MAX_REPORTED_ERRORS]
+            if len(self.errors) > MAX_REPORTED_ERRORS:
+                reported.append(f"... and {len(self.errors) - MAX_REPORTED_ERRORS} more errors")
+            raise InvalidRoster("Invalid roster:\n" + "\n".join(reported))
+        return self.roster
+
+
+def _file_rows(path, table, fields) -> Iterable:
+    return read_rows(path, table, fields) if path else ()
+
+
+def load_roster(users_path=None, metrics_path=None, assignments_path=None, exclusions_path=None, known_users=(),
+                known_metrics=()) -> Roster:
+    """
+    Loads and validates the users, metrics, review assignments and exclusions from their files, any of which can be
+    left out.
+    `known_users` (name, username) and `known_metrics` (name) are the ones already in the DB, which the rows get
+    checked against as well.
+    """
+    return RosterValidator(known_users, known_metrics).validate(
+        users=_file_rows(users_path, "users", USER_FIELDS),
+        metrics=_file_rows(metrics_path, "metrics", METRIC_FIELDS),
+        assignments=_file_rows(assignments_path, "assignments", ASSIGNMENT_FIELDS),
+        exclusions=_file_rows(exclusions_path, "exclusions", EXCLUSION_FIELDS),
+    )
+
+
+def config_roster() -> Roster:
+    """The roster declared in `config.py`, validated the same way as the one of the files"""
+    return RosterValidator().validate(
+        users=((f"config.REVIEWERS_SHORTHAND['{name}']", (_clean(name), _clean(username)))
+               for name, username in REVIEWERS_SHORTHAND.items()),
+        metrics=((f"config.METRIC_DESCRIPTIVE['{name}']", (_clean(name), description))
+                 for name, description in METRIC_DESCRIPTIVE.items()),
+        assignments=((f"config.SELECTIVE_REVIEWERS['{reviewer}']", (reviewer, ratee))
+                     for reviewer, ratees in SELECTIVE_REVIEWERS.items() for ratee in ratees),
+        exclusions=((f"config.REVIEW_EXCLUSIONS['{reviewer}']", (reviewer, ratee))
+                    for reviewer, ratees in REVIEW_EXCLUSIONS.items() for ratee in ratees),
+    )
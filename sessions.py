@@ -0,0 +1,94 @@
+import threading
+from db_storage.storage import get_storage
+
+
+class SessionRegistry:
+    """
+    Which reviewer is logged in on which browser, with the `user_auth` table as the source of truth so that several
+    Streamlit processes agree on it. Lookups are read-through: a registration, once found, never changes and stays
+    cached, while a miss is always asked to the DB again, as another process may have registered it in the meantime.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reviewer_by_browser: dict[str, str] = {}
+        self._browser_by_reviewer: dict[str, str] = {}
+        # browser_id -> refresh ids (websocket keys) seen for it. A websocket stays on the process that served the page,
+        # so unlike the registrations, this is only ever needed in-process
+        self._refresh_ids: dict[str, set[str]] = {}
+        # Version of the users table the cached registrations belong to. The users only change when the DB gets
+        # reset or reseeded (e.g. by `manage.py`), which drops every registration along with them
+        self._users_version = None
+
+    def _check_users_version(self):
+        users_version = get_storage().get_data_versions().get("users")
+        if users_version != self._users_version:
+            with self._lock:
+                self._reviewer_by_browser.clear()
+                self._browser_by_reviewer.clear()
+                self._users_version = users_version
+
+    def _cache(self, browser_id, reviewer):
+        with self._lock:
+            self._reviewer_by_browser[browser_id] = reviewer
+            self._browser_by_reviewer[reviewer] = browser_id
+
+    def get_reviewer(self, browser_id) -> str | None:
+        """Name of the reviewer registered on the browser, if any"""
+        self._check_users_version()
+        reviewer = self._reviewer_by_browser.get(browser_id)
+        if reviewer is None:
+            reviewer = get_storage().get_reviewer_by_browser(browser_id)
+            if reviewer is not None:
+                self._cache(browser_id, reviewer)
+        return reviewer
+
+    def is_registered(self, reviewer, user_id) -> bool:
+        self._check_users_version()
+        if reviewer in self._browser_by_reviewer:
+            return True
+        browser_id = get_storage().get_browser_by_user(user_id)
+        if browser_id is not None:
+            self._cache(browser_id, reviewer)
+        return browser_id is not None
+
+    def register(self, browser_id, reviewer, user_id) -> bool:
+        """Registers the reviewer on the browser, unless one of them is already registered (by any process)"""
+        with self._lock:
+            registered = get_storage().register_browser(user_id, browser_id)
+            if registered:
+                self._cache(browser_id, reviewer)
+        return registered
+
+    def record_refresh(self, browser_id, refresh_id) -> bool | None:
+        """Records the refresh id of the page load. Returns None the first time the browser is seen, True if the page got
+        refreshed since the last time, and False for a rerun within the same page load"""
+        with self._lock:
+            refresh_ids = self._refresh_ids.get(browser_id)
+            if refresh_ids is None:
+                self._refresh_ids[browser_id] = {refresh_id}
+                return None
+            if refresh_id in refresh_ids:
+                return False
+            refresh_ids.add(refresh_id)
+        print(f"Page Refreshed for browser: {browser_id}")
+        return True
+
+    def warm(self) -> None:
+        """Loads the registrations already in the DB, e.g. when continuing on an existing one"""
+        for reviewer, browser_id in get_storage().get_initialized_user_requests().items():
+            self._cache(browser_id, reviewer)
+
+    def clear(self) -> None:
+        """Forgets everything cached, e.g. after the DB data got deleted"""
+        with self._lock:
+            self._reviewer_by_browser.clear()
+            self._browser_by_reviewer.clear()
+            self._refresh_ids.clear()
+
+
+_session_registry = SessionRegistry()
+
+
+def get_session_registry() -> SessionRegistry:
+    return _session_registry
@@ -1,7 +1,8 @@
-def get_tooltip_css(msg):
-    return f"""
+def get_tooltip_style():
+    """Styles of the error tooltips and of the invalid cells, to be injected once for the whole page"""
+    return """
         <style>
-            .tooltip {{
+            .tooltip {
                 # display: inline-block;
                 cursor: pointer;
                 margin-left: 0%;
@@ -12,9 +13,9 @@ def get_tooltip_css(msg):
                 border-color: darkred;
                 text-align: center;
                 background-color: #dc143c;
-            }}
+            }
 
-            .tooltip .tooltiptext {{
+            .tooltip .tooltiptext {
                 visibility: hidden;
                 width: max-content;
                 background-color: #dc143c;
@@ -28,19 +29,40 @@ def get_tooltip_css(msg):
                 transition: opacity 0.3s;
                 font-size: 14px;
                 white-space: normal;
-            }}
+            }
 
-            .tooltip:hover .tooltiptext {{
+            .tooltip:hover .tooltiptext {
                 visibility: visible;
                 opacity: 1;
-            }}
+            }
+
+            div[class*="st-key-invalid-cell-"] input {
+                outline: 2px solid #dc143c;
+                background-color: #4d0f0f;
+            }
+
+            .grid-label {
+                height: 2.5rem;
+                display: flex;
+                align-items: center;
+            }
         </style>
+    """
+
+
+def get_tooltip_html(msg):
+    return f"""
         <div class="tooltip">❌ <font style='color:#ffa07a;'>ERROR</font>
             <span class="tooltiptext" style='top:-55px; left:40px'>{msg}</span>
         </div>
     """
 
 
+def get_grid_label_html(label):
+    """Label in the review grid, as tall as a text input so that it lines up with the inputs of its row"""
+    return f"<div class='grid-label'>{label}</div>"
+
+
 def get_self_review_css(reviewer):
     return f"""
         <style>
@@ -0,0 +1,181 @@
+"""Query plans of every statement the DB layer runs: none may scan all of a growing table, unless listed in
+`query_plans.INTENDED_FULL_SCANS`.
+
+The declared statements (the `*_SQL` constants and the trigger bodies) get checked against the schema, and every
+`db_queries` function gets run against a seeded DB, with each statement it executes traced, the SQL built at runtime
+included, and explained with the values it ran with.
+
+USAGE: python -m unittest discover tests   (or python -m pytest tests)
+"""
+import inspect
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_storage import cache, db_queries, query_plans, sqlite3_db_helper, writer  # noqa: E402
+
+_DB_FILES = {os.path.abspath(module.__file__) for module in (db_queries, writer, cache)}
+# Functions that may run no statement on rows: the existence check, the migration of an up to date DB, and the
+# data versions read only once some connection committed since the last read
+NO_ROW_STATEMENTS = {"db_queries.check_if_db_exists", "db_queries.migrate_schema", "db_queries.get_data_versions"}
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\?\d*|\bNULL\b|(?<![\w.])-?\d+(?:\.\d+)?\b", re.IGNORECASE)
+
+
+def skeleton(sql) -> str:
+    """The statement with every literal and placeholder made into `?`, to match an executed one to its constant"""
+    return " ".join(_LITERAL_RE.sub("?", sql).split()).rstrip(";").strip()
+
+
+def get_caller() -> str:
+    frame = sys._getframe(1)
+    while frame is not None and os.path.abspath(frame.f_code.co_filename) not in _DB_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    return f"{os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]}.{frame.f_code.co_name}"
+
+
+class StatementTracer:
+    """Records the (caller, SQL with its values) of every statement run on the connections opened while patched"""
+
+    def __init__(self):
+        self.statements = []
+        self._connect = sqlite3_db_helper.connect
+
+    def connect(self, db_path):
+        conn = self._connect(db_path)
+        conn.set_trace_callback(self.trace)
+        return conn
+
+    def trace(self, sql):
+        if query_plans._STATEMENT_RE.match(sql):
+            self.statements.append((get_caller(), sql))
+
+    def patch(self):
+        return mock.patch.multiple(sqlite3_db_helper, connect=self.connect), \
+            mock.patch.multiple(writer, connect=self.connect), mock.patch.multiple(cache, connect=self.connect)
+
+
+def get_db_functions() -> set[str]:
+    """`db_queries.<name>` of every function of `db_queries` that runs SQL"""
+    return {f"db_queries.{name}" for name, func in vars(db_queries).items()
+            if inspect.isfunction(func) and func.__module__ == db_queries.__name__
+            and re.search(r"\bcursor\.|apply_migrations\(|get_probe\(", inspect.getsource(inspect.unwrap(func)))}
+
+
+def exercise_db_queries(users=30, metrics=4):
+    """Runs every `db_queries` function (and a rating submission) against a freshly seeded DB at `DB_PATH`"""
+    db_queries.initialize_tables_for_db()
+    user_data = [(f"User {idx}", f"user{idx}") for idx in range(users)]
+    metric_data = [(f"Metric {idx}", "") for idx in range(metrics)]
+    rating_data = [(reviewer, ratee, metric, float(1 + (reviewer + ratee + metric) % 10))
+                   for reviewer in range(1, users + 1) for ratee in range(1, users // 2) for metric in range(1, metrics)]
+    db_queries.insert_all_data(user_data, metric_data, rating_data, auth_data=(1, "browser-1"),
+                               assignment_data=[("user0", "user1")], exclusion_data=[("user2", "user3")])
+    db_queries.insert_all_data(user_data=user_data[:2], metric_data=metric_data[:1], rating_data=rating_data[:5],
+                               assignment_data=[("user0", "user1")], exclusion_data=[("user2", "user3")], upsert=True)
+    db_queries.save_assignments([(reviewer, ratee) for reviewer in range(1, users + 1) for ratee in range(1, 6)])
+    db_queries.save_assignments([(1, 2), (2, 1)], replace=True)
+    db_queries.save_assignments([(reviewer, ratee) for reviewer in range(1, users + 1) for ratee in range(1, 6)])
+
+    db_queries.register_browser(2, "browser-2")
+    db_queries.get_initialized_user_requests()
+    db_queries.get_reviewer_by_browser("browser-1")
+    db_queries.get_browser_by_user(1)
+    db_queries.get_metric_id("Metric 1")
+    db_queries.get_assignment_inputs()
+    db_queries.ratings_exist()
+    list(db_queries.get_scored_rating_chunks(100))
+    db_queries.get_user_ids()
+    db_queries.get_user_to_id_map()
+    db_queries.get_registry_rows()
+    db_queries.get_metric_to_id_map()
+    db_queries.get_reviewers_finalised_cols(1)
+    db_queries.get_review_progress()
+    db_queries.get_data_versions()
+    db_queries.get_average_scores([1, 2, 3])
+
+    db_queries.save_drafts([(1, 2, 1, "7"), (1, 2, 2, "x"), (1, 3, 1, "4")])
+    db_queries.save_drafts([(1, 2, 2, "")])
+    db_queries.get_drafts(1)
+    db_queries.delete_drafts(1, 2)
+
+    submission_writer = writer.SubmissionWriter(db_queries.DB_PATH)
+    try:
+        submission_writer.submit([(3, 4, 1, 5.0), (3, 4, 2, None)]).result(timeout=30)
+    finally:
+        submission_writer.shutdown()
+
+    for filters in ({}, {"ratees": ["user1"], "reviewers": ["user2"], "metrics": ["Metric 1"]}):
+        for _ in db_queries.iter_export_ratings(**filters):
+            pass
+    for filters in ({}, {"ratees": ["user1"], "metrics": ["Metric 1"]}):
+        for _ in db_queries.iter_export_aggregates(**filters):
+            pass
+
+    db_queries.rebuild_rating_aggregates()
+    db_queries.migrate_schema()
+    db_queries.get_db_schema_version()
+    db_queries.check_if_db_exists()
+    db_queries.delete_all_db_data()
+
+
+class QueryPlansTest(unittest.TestCase):
+
+    def test_declared_statements(self):
+        full_scans, checked = query_plans.find_full_scans()
+        self.assertGreater(checked, 0)
+        self.assertEqual(full_scans, {}, "full table scans of growing tables (see query_plans.INTENDED_FULL_SCANS)")
+
+    def test_executed_statements(self):
+        tracer = StatementTracer()
+        saved_path = db_queries.DB_PATH
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_queries.DB_PATH = os.path.join(tmp_dir, "query_plans.db")
+            patches = tracer.patch()
+            try:
+                for patch in patches:
+                    patch.start()
+                exercise_db_queries()
+                conn = sqlite3.connect(db_queries.DB_PATH)
+                try:
+                    plans = {sql: [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                             for _, sql in dict.fromkeys(tracer.statements)}
+                finally:
+                    conn.close()
+            finally:
+                for patch in reversed(patches):
+                    patch.stop()
+                sqlite3_db_helper.close_pool(db_queries.DB_PATH)
+                cache.close_probe(db_queries.DB_PATH)
+                db_queries.DB_PATH = saved_path
+
+        # Each statement is named by its constant, or else by the function that built it
+        constants = {}
+        for name, sql in query_plans.get_queries().items():
+            constants[skeleton(sql)] = name
+            if sql in db_queries.UPSERT_CLAUSES:
+                constants.setdefault(skeleton(db_queries.get_insert_sql(sql, upsert=True)), name)
+
+        full_scans = {}
+        for caller, sql in dict.fromkeys(tracer.statements):
+            name = constants.get(skeleton(sql), caller)
+            if name not in query_plans.INTENDED_FULL_SCANS and query_plans.get_full_scans(plans[sql]):
+                full_scans[f"{name} ({caller}): {' '.join(sql.split())[:200]}"] = plans[sql]
+        self.assertEqual(full_scans, {}, "full table scans of growing tables (see query_plans.INTENDED_FULL_SCANS)")
+
+        # A function left out of `exercise_db_queries` would have its statements go unchecked
+        callers = {caller for caller, _ in tracer.statements}
+        self.assertEqual(get_db_functions() - callers - NO_ROW_STATEMENTS, set(), "functions left unexercised")
+        executed = {constants.get(skeleton(sql)) for _, sql in tracer.statements}
+        self.assertEqual(set(query_plans.get_queries()) - executed, set(), "declared statements never executed")
+
+
+if __name__ == "__main__":
+    unittest.main()
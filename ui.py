@@ -1,31 +1,32 @@
 import streamlit as st
-from config import METRIC, REVIEWERS_SHORTHAND
-from metric_utils import page_has_refreshed, fetch_initials, get_refresh_browser_ids
-from template import get_tooltip_css
-from init import get_initialization_choices
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from request_context import get_request_context
+from template import get_tooltip_style, get_tooltip_html, get_grid_label_html
 from handler import confirmation_dialog
-import time
+from db_storage.storage import get_storage
+from db_storage.drafts import get_draft_writer
+from db_storage.cache import get_cache_stats
+from instrumentation import timed, timings, is_enabled, PERCENTILES
+from config import ADMIN_TOKEN
+import hmac
+import os
 import threading
 import datetime
 import asyncio
 
 
-@st.cache_data
-def get_all_metric_initials():
-    # Map full metric to short names and the reverse of it
-    return {li: fetch_initials(li) for li in METRIC}
-    # reversed_metrics_initials = {v: k for k, v in all_metrics_initials.items()}
+# Seconds between the refreshes of the pending reviews watch
+WATCH_REFRESH_SECONDS = 20
 
 
 def confirm_rating(*args, **kwargs):
-    browser_id, _ = get_refresh_browser_ids()
     """Validates and triggers the confirmation dialog."""
-    reviewer = st.const_vars["browser_reviewer"][browser_id]
-    user_name, error_users_field, metrics = args
+    reviewer = get_request_context().reviewer
+    user_name, metrics = args
     if user_name in st.const_vars["input_save"][reviewer]["finalised"]:
         st.error(f"You have already submitted your rating for User: '{user_name.capitalize()}'")
         return
-    if user_name in error_users_field:
+    if validate_inputs([f"{user_name}_{metric_shrt}" for metric_shrt in metrics]):
         st.error("Resolve errors first, before proceeding", icon=":material/error:")
         return
     confirmation_dialog(f'''
@@ -34,9 +35,8 @@ def confirm_rating(*args, **kwargs):
     ''', user_name, metrics)
 
 
-def validate_input(*args, **kwargs):
+def validate_input(val):
     """Ensures that the input is a float and is between 1 and 10."""
-    val: float = st.session_state.get(args[0])
     msg = None
     try:
         val = float(val)
@@ -48,102 +48,133 @@ def validate_input(*args, **kwargs):
     return msg
 
 
-def create_metric_mapping(reviewer, reviewer_mapping=REVIEWERS_SHORTHAND):
-    def create_header(cnt):
-        if pop_self:
-            metric_col, names_col, self_col = container_parent.columns([1.8, cnt, 1], border=False, vertical_alignment="center")
+def validate_inputs(keys, values=None):
+    """
+    Validates the filled in cells among `keys` in one go, and returns {key: message} for the invalid ones. Their values
+    come from `values` if given, and else from the session state
+    """
+    values = st.session_state if values is None else values
+    errors = {}
+    for key in keys:
+        value = values.get(key, "")
+        if value and value != "*":
+            msg = validate_input(value)
+            if msg:
+                errors[key] = msg
+    return errors
+
+
+def get_draft_values(reviewer_id, reload=False) -> dict[str, str]:
+    """
+    {widget key: value} of the reviewer's drafts, read from the store on the first render of the grid in the session
+    (and again on a page refresh). The cells edited afterwards are kept by the session state itself
+    """
+    drafts = st.session_state.get("review_drafts")
+    if reload or drafts is None or drafts[0] != reviewer_id:
+        registry = get_request_context().registry
+        values = {f"{registry.id_user_mapping[ratee_id]}_{registry.id_metric_mapping[metric_id]}": value
+                  for (ratee_id, metric_id), value in get_draft_writer().get_drafts(reviewer_id).items()
+                  if ratee_id in registry.id_user_mapping and metric_id in registry.id_metric_mapping}
+        drafts = (reviewer_id, values)
+        st.session_state["review_drafts"] = drafts
+    return drafts[1]
+
+
+def stage_draft(key, reviewer_id, ratee_id, metric_id):
+    """`on_change` of a grid cell: stages its new value to be saved as a draft, with the next flush of the writer"""
+    get_draft_writer().stage(reviewer_id, ratee_id, metric_id, st.session_state.get(key, ""))
+
+
+@st.fragment
+@timed("fragment.ratee_column")
+def create_ratee_column(reviewer, user_name, is_self):
+    """One ratee's column of the review grid. Being a fragment, typing into it reruns only this column"""
+    request = get_request_context()
+    registry = request.registry
+    reviewer_id, ratee_id = request.reviewer_id, registry.user_id_mapping[user_name]
+    # If reviewer has already reviewed a user_name, replace the values with '*'
+    finalised = user_name in st.const_vars["input_save"][reviewer]["finalised"]
+    drafts = get_draft_values(reviewer_id)
+
+    with st.container(border=True):
+        if is_self:
+            st.markdown(f"<font style='color:magenta;'><b>{user_name.capitalize()}<b></font>", unsafe_allow_html=True)
         else:
-            cnt = 1
-            metric_col, names_col = container_parent.columns([1.8, 1], border=False, vertical_alignment="center")
-        with metric_col:
-            with st.columns(1, border=True)[0]:
-                st.markdown("**METRIC**")
-        with names_col:
-            all_names_col = st.columns(cnt, border=True)
-            for idx in range(len(all_names_col)):
-                with all_names_col[idx]:
-                    st.markdown(f"**{all_users_name[idx][1].capitalize()}**")
-        if pop_self:
-            with self_col:  # pyright:ignore
-                with st.columns(1, border=True)[0]:
-                    st.markdown(f"<font style='color:magenta;'><b>{pop_self.capitalize()}<b></font>", unsafe_allow_html=True)
-
-    def create_txt_entries(cnt):
-        for metric in METRIC:
-            metric_shorthand = all_metrics_initials[metric]
-            with container:
-                metric_col, *names_col = container.columns(columns_cnt_list, vertical_alignment="center")
-                with metric_col:
-                    st.markdown(f"**{metric}**")
-                for idx in range(len(names_col)):
-                    if pop_self:
-                        user_name = all_users_name[idx][1] if idx < cnt else pop_self
-                    else:
-                        user_name = all_users_name[idx][1]
-                    value, disabled = "", False
-                    # If reviewer has already reviewed a user_name, replace the values with '*'
-                    if user_name in reviewer_save_vars["finalised"]:
-                        value, disabled = "*", True
-                    with names_col[idx]:
-                        key = f"{user_name}_{metric_shorthand}"
-                        if value != "*":
-                            if key not in reviewer_save_vars:
-                                value = ""
-                            else:
-                                value = reviewer_save_vars[key] if page_refreshed is True and reviewer_save_vars.get(key) != "" else st.session_state.get(key, "")
-                        value = st.text_input("rating", placeholder=user_name.capitalize(), max_chars=3, label_visibility="collapsed", key=key, value=value, disabled=disabled)
-                        if value and value != '*':
-                            msg = validate_input(key, reviewer)
-                            if msg:
-                                error_users_field.add(user_name)
-                                st.markdown(get_tooltip_css(msg), unsafe_allow_html=True)
-
-    def create_confirmation_row():
-        with metric_col:
-            st.markdown("<font style='color:green;'><b>[ Confirmation ]</b></font>", unsafe_allow_html=True)
-        for idx in range(len(names_col)):
-            if pop_self:
-                user_name = all_users_name[idx][1] if idx < total_cnt_removing_self else pop_self
-            else:
-                user_name = all_users_name[idx][1]
-            disabled = False
-            if user_name in reviewer_save_vars["finalised"]:
-                disabled = True
-            with names_col[idx]:
-                st.button("✅ Done...", key=user_name, on_click=confirm_rating, args=(user_name, error_users_field, metric_shorthand_to_id_map),
-                          use_container_width=True, type="secondary", disabled=disabled)
+            st.markdown(f"**{user_name.capitalize()}**")
+
+    metric_keys = {f"{user_name}_{metric_shorthand}": metric for metric, metric_shorthand in registry.metric_initials.items()}
+    # Only a cell edited in the session is in its state, the others start off their saved draft
+    values = {key: "*" if finalised else st.session_state.get(key, drafts.get(key, "")) for key in metric_keys}
+    errors = {} if finalised else validate_inputs(metric_keys, values)
+    for key, metric in metric_keys.items():
+        metric_id = registry.metric_id_mapping[registry.metric_initials[metric]]
+        # The key of the cell's container toggles the outline of the invalid cells, from the page-wide `get_tooltip_style`
+        with st.container(key=f"{'invalid' if key in errors else 'valid'}-cell-{key}"):
+            st.text_input("rating", placeholder=user_name.capitalize(), max_chars=3, label_visibility="collapsed", key=key, value=values[key], disabled=finalised,
+                          on_change=stage_draft, args=(key, reviewer_id, ratee_id, metric_id))
+
+    st.button("✅ Done...", key=user_name, on_click=confirm_rating, args=(user_name, registry.metric_id_mapping),
+              use_container_width=True, type="secondary", disabled=finalised)
+
+    if errors:
+        # The messages of the invalid cells are listed under the column
+        msg = "<br>".join(f"{metric_keys[key].lstrip('• ')}: {msg}" for key, msg in errors.items())
+        st.markdown(get_tooltip_html(msg), unsafe_allow_html=True)
+
 
+def create_metric_mapping(reviewer, reviewer_mapping):
     """Render metric entry table with validations and UI layout."""
-    all_metrics_initials = get_all_metric_initials()
-    _, metric_shorthand_to_id_map = get_initialization_choices()
-    error_users_field = set()
-    page_refreshed = page_has_refreshed()
+    request = get_request_context()
+    registry = request.registry
     all_users_name: dict = reviewer_mapping.copy()
-    reviewer_save_vars = st.const_vars["input_save"][reviewer]
 
-    # Separate the reviewer from others that needs to be reviewed
+    # Separate the reviewer from others that needs to be reviewed, and keep them as the last column
     pop_self = all_users_name.pop(reviewer, None)
-    all_users_name = list(all_users_name.items())
-    total_cnt_removing_self = len(reviewer_mapping) - 1
+    ratees = list(all_users_name.values()) + ([pop_self] if pop_self else [])
 
-    # Table header layout
+    # The drafts get (re)loaded once here for the whole grid, rather than by the first of its columns
+    get_draft_values(request.reviewer_id, reload=request.page_refreshed is True)
+
+    st.markdown(get_tooltip_style(), unsafe_allow_html=True)
     container_parent = st.container(border=True)
-    create_header(total_cnt_removing_self)
+    metric_col, *names_col = container_parent.columns([1.8] + [1] * len(ratees))
+
+    with metric_col:
+        with st.container(border=True):
+            st.markdown("**METRIC**")
+        for metric in registry.metric_initials:
+            st.markdown(get_grid_label_html(f"<b>{metric}</b>"), unsafe_allow_html=True)
+        st.markdown(get_grid_label_html("<font style='color:green;'><b>[ Confirmation ]</b></font>"), unsafe_allow_html=True)
 
-    # Metric input table rows
-    container = container_parent.container()
-    columns_cnt_list = [1.8] + [1] * total_cnt_removing_self + [1]
-    create_txt_entries(total_cnt_removing_self)
+    # Each ratee column is a fragment of its own
+    for names_col_idx, user_name in zip(names_col, ratees):
+        with names_col_idx:
+            create_ratee_column(reviewer, user_name, user_name == pop_self)
 
-    # Confirmation row corresponding to each user's name
-    metric_col, *names_col = container_parent.columns(columns_cnt_list, vertical_alignment="center")
-    create_confirmation_row()
 
-    # Persist review inputs
-    reviewer_save_vars.update(st.session_state.to_dict())
+def get_review_watch_counts(registry):
+    """`get_counts_of_reviewed`, queried again only once the ratings, assignments, metrics or users have changed since
+    the last time for the session, as the review progress and the reviewer names come from those"""
+    storage = get_storage()
+    versions = storage.get_data_versions()
+    version = tuple(versions.get(table) for table in ("ratings", "assignments", "metrics", "users"))
+    watch_counts = st.session_state.get("review_watch_counts")
+    if watch_counts is None or watch_counts[0] != version:
+        watch_counts = (version, *storage.get_counts_of_reviewed(registry))
+        st.session_state["review_watch_counts"] = watch_counts
+    return watch_counts[1:]
 
 
-def create_remaining_review_watch(pending_reviewers, not_started):
+@st.fragment(run_every=WATCH_REFRESH_SECONDS)
+@timed("fragment.watch")
+def create_remaining_review_watch(registry):
+    """Pending reviews panel. Only this fragment gets refreshed on the interval, by the browser, so no script thread
+    is kept waiting in between, and the counts only get queried when the ratings have changed"""
+    not_started, pending_reviewers, _ = get_review_watch_counts(registry)
+    if not not_started and not pending_reviewers:
+        # Everyone is done, so the whole page moves on from the watch
+        st.rerun(scope="app")
+
     pending_users_html = '<br>'.join([
         f"🔴 <span style='background-color:#0F4D0F; color:#fff; padding:4px 10px; "
         f"border-radius:12px; margin:0px; display:inline-block; font-weight:bold;'>{review}</span>"
@@ -184,8 +215,44 @@ def create_remaining_review_watch(pending_reviewers, not_started):
         </ul>
     </div>
     """
-    container = st.empty()
-    container.markdown(html_output, unsafe_allow_html=True)
-    time.sleep(20)
-    container.empty()
-    st.rerun()
+    st.markdown(html_output, unsafe_allow_html=True)
+
+
+def get_phase_rows(summary) -> list[dict]:
+    return [{"phase": name, "runs": stats["count"], "total (s)": round(stats["total_seconds"], 3),
+             **{f"p{q} (ms)": round(stats.get(f"p{q}_seconds", 0.0) * 1000, 2) for q in PERCENTILES}}
+            for name, stats in summary.items()]
+
+
+def is_admin_request() -> bool:
+    """Whether the page was opened with the admin token (`config.ADMIN_TOKEN`). Always False while none is set"""
+    token = ADMIN_TOKEN or os.environ.get("METRIC_REVIEW_ADMIN_TOKEN")
+    return bool(token) and hmac.compare_digest(st.query_params.get("token", "").encode(), token.encode())
+
+
+def create_instrumentation_view():
+    """
+    Admin page (`?admin=metrics&token=...`) listing the percentiles of each phase, of all the sessions and of this one,
+    and the hits and misses of the cached queries of this process
+    """
+    st.title("Phase timings")
+    # Kept whether the instrumentation is on or not
+    st.subheader("Query cache")
+    st.dataframe([{"query": name, **stats} for name, stats in get_cache_stats().items()], hide_index=True,
+                 use_container_width=True)
+
+    if not is_enabled():
+        st.info("Instrumentation is off. Turn it on with `INSTRUMENTATION_ENABLED` in config.py, or with the "
+                "environment variable METRIC_REVIEW_INSTRUMENTATION=1", icon=":material/info:")
+        return
+
+    st.subheader("All sessions")
+    st.dataframe(get_phase_rows(timings.summary()), hide_index=True, use_container_width=True)
+    st.subheader("This session")
+    session_id = get_script_run_ctx().session_id
+    st.dataframe(get_phase_rows(timings.summary(session_id)), hide_index=True, use_container_width=True)
+
+    prometheus_text = timings.prometheus_text()
+    st.download_button("Download (Prometheus text)", prometheus_text, file_name="phase_timings.prom", mime="text/plain")
+    with st.expander("Prometheus text"):
+        st.code(prometheus_text, language="text")